@@ -0,0 +1,326 @@
+"""
+Аналитика расхода по истории
+
+Взятия загружаются из истории один раз в колонки (время, граммы, номер
+партии, пользователь) и дальше дополняются в памяти при каждой записи.
+Окна произвольной длины, перцентили размера порции, гистограммы,
+профиль по дням недели и скользящие средние считаются по колонкам:
+через NumPy, если он установлен, иначе на array и срезах.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен
+    np = None
+
+
+DAY = 86400
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# "Взято: 200г сырой → 160г готовой"
+TAKE_TEXT_RE = re.compile(r"Взято: ([\d.]+)г сырой")
+
+# "Новая партия: 1500г сырой → 1200г готовой (к=0.800) (заметка)"
+BATCH_TEXT_RE = re.compile(r"Новая партия: ([\d.]+)г сырой → ([\d.]+)г готовой \(к=([\d.]+)\)(?: \((.*)\))?")
+
+
+@lru_cache(maxsize=4096)
+def _day_index(day: str) -> int:
+    return date.fromisoformat(day).toordinal() - _EPOCH_ORDINAL
+
+
+def timestamp(created: str) -> float:
+    """
+    Время записи истории в секундах от 1970-01-01
+    
+    Args:
+        created: "YYYY-MM-DD HH:MM:SS" в локальном времени бота
+    """
+    return (
+        _day_index(created[:10]) * DAY
+        + int(created[11:13]) * 3600
+        + int(created[14:16]) * 60
+        + int(created[17:19])
+    )
+
+
+def day_index(when: datetime) -> int:
+    """Номер дня от 1970-01-01 для локального времени"""
+    return when.toordinal() - _EPOCH_ORDINAL
+
+
+def weekday(day: int) -> int:
+    """День недели номера дня (пн=0); 1970-01-01 - четверг"""
+    return (day + 3) % 7
+
+
+# ─────────────────── КОЛОНКИ ───────────────────
+
+class TakeColumns:
+    """
+    Взятия порций по колонкам, по возрастанию времени
+    
+    ts - время (timestamp()), grams - сырой вес, batch_ids - номер партии
+    по порядку создания (0 - взятие до первой известной партии), user_ids -
+    кто взял (0 - неизвестно). batch_ts - время создания партий.
+    """
+    
+    __slots__ = ("ts", "grams", "batch_ids", "user_ids", "batch_ts")
+    
+    def __init__(self):
+        self.ts = array("d")
+        self.grams = array("d")
+        self.batch_ids = array("q")
+        self.user_ids = array("q")
+        self.batch_ts = array("d")
+    
+    @classmethod
+    def from_history(cls, rows: Iterable[Tuple[str, str, str, Optional[int]]]) -> "TakeColumns":
+        """
+        Собрать из строк истории (action_type, text, created, user_id)
+        
+        Строки должны идти по возрастанию created; записи, кроме взятий
+        и новых партий, пропускаются
+        """
+        columns = cls()
+        ts, grams, batch_ids, user_ids = columns.ts, columns.grams, columns.batch_ids, columns.user_ids
+        batch = 0
+        match_take = TAKE_TEXT_RE.match
+        for action_type, text, created, user_id in rows:
+            if action_type == "new_batch":
+                batch += 1
+                columns.batch_ts.append(timestamp(created))
+            elif action_type == "take":
+                match = match_take(text)
+                if match:
+                    ts.append(timestamp(created))
+                    grams.append(float(match.group(1)))
+                    batch_ids.append(batch)
+                    user_ids.append(user_id or 0)
+        return columns
+    
+    def __len__(self) -> int:
+        return len(self.ts)
+    
+    def add_take(self, created: str, grams: float, user_id: int = 0):
+        """Дописать взятие (после commit в take_portion)"""
+        ts = timestamp(created)
+        batch = len(self.batch_ts)
+        if self.ts and ts < self.ts[-1]:
+            # Часы переведены назад - вставить на своё место
+            i = bisect_right(self.ts, ts)
+            self.ts.insert(i, ts)
+            self.grams.insert(i, grams)
+            self.batch_ids.insert(i, batch)
+            self.user_ids.insert(i, user_id)
+        else:
+            self.ts.append(ts)
+            self.grams.append(grams)
+            self.batch_ids.append(batch)
+            self.user_ids.append(user_id)
+    
+    def add_batch(self, created: str):
+        """Отметить новую партию (после commit в create_batch)"""
+        self.batch_ts.append(timestamp(created))
+    
+    def span(self, start: float, end: float) -> Tuple[int, int]:
+        """Диапазон строк [lo, hi) со временем в [start, end)"""
+        return bisect_left(self.ts, start), bisect_left(self.ts, end)
+
+
+# ─────────────────── ВЫЧИСЛЕНИЯ ───────────────────
+
+def _percentiles(counts: Counter, qs: Sequence[int]) -> Dict[int, float]:
+    """
+    Перцентили по таблице «значение → сколько раз»
+    
+    Линейная интерполяция между соседними по рангу значениями, как в NumPy.
+    Порций разного веса немного, поэтому таблица намного короче выборки.
+    """
+    values = sorted(counts)
+    cumulative = list(accumulate(counts[v] for v in values))
+    last = cumulative[-1] - 1
+    
+    def at(rank: int) -> float:
+        return values[bisect_right(cumulative, rank)]
+    
+    result = {}
+    for q in qs:
+        pos = last * q / 100
+        rank = int(pos)
+        lo = at(rank)
+        hi = at(min(rank + 1, last))
+        result[q] = lo + (hi - lo) * (pos - rank)
+    return result
+
+
+class WindowReport(NamedTuple):
+    """Расширенная статистика за окно"""
+    days: int
+    total: float
+    portions: int
+    batches: int
+    batches_used: int
+    avg_per_day: float
+    percentiles: Dict[int, float]
+    histogram: List[Tuple[int, int]]
+    weekdays: List[float]
+    moving_avg: List[float]
+
+
+class Analytics:
+    """
+    Запросы к колонкам взятий
+    
+    Окно - последние days календарных дней, включая сегодня
+    """
+    
+    PERCENTILES = (25, 50, 75, 90)
+    HISTOGRAM_STEP = 50
+    MOVING_WINDOW = 7
+    
+    def __init__(self, takes: TakeColumns, now: datetime):
+        self.takes = takes
+        self.today = day_index(now)
+    
+    def _bounds(self, days: int) -> Tuple[int, int, int]:
+        """(первый день, lo, hi) для окна"""
+        first = self.today - days + 1
+        lo, hi = self.takes.span(first * DAY, (self.today + 1) * DAY)
+        return first, lo, hi
+    
+    def _grams(self, days: int) -> Sequence[float]:
+        _, lo, hi = self._bounds(days)
+        return self.takes.grams[lo:hi]
+    
+    def daily_totals(self, days: int) -> Sequence[float]:
+        """Съедено по дням окна, от старых к новым"""
+        first, lo, hi = self._bounds(days)
+        takes = self.takes
+        if np is not None:
+            day = (np.frombuffer(takes.ts[lo:hi], dtype=np.float64) // DAY).astype(np.int64) - first
+            weights = np.frombuffer(takes.grams[lo:hi], dtype=np.float64)
+            return np.bincount(day, weights=weights, minlength=days)
+        
+        # Время отсортировано - границы дней находятся бинарным поиском
+        ts, grams = takes.ts, takes.grams
+        totals = array("d")
+        start = lo
+        for day in range(first + 1, self.today + 2):
+            end = bisect_left(ts, day * DAY, start, hi)
+            totals.append(sum(grams[start:end]))
+            start = end
+        return totals
+    
+    @staticmethod
+    def _counts(grams: Sequence[float]) -> Optional[Counter]:
+        """Таблица значений для вычислений без NumPy (с NumPy не нужна)"""
+        return Counter(grams) if np is None else None
+    
+    def percentiles(self, days: int, qs: Sequence[int] = PERCENTILES) -> Dict[int, float]:
+        """Перцентили размера порции, г"""
+        grams = self._grams(days)
+        return self._percentiles(grams, self._counts(grams), qs)
+    
+    def histogram(self, days: int, step: int = HISTOGRAM_STEP) -> List[Tuple[int, int]]:
+        """Гистограмма порций: [(начало корзины в г, сколько порций)], пустые корзины пропущены"""
+        grams = self._grams(days)
+        return self._histogram(grams, self._counts(grams), step)
+    
+    @staticmethod
+    def _distinct(ids: Sequence[int]) -> int:
+        if np is not None:
+            return len(np.unique(np.frombuffer(ids, dtype=np.int64)))
+        return len(set(ids))
+    
+    @staticmethod
+    def _percentiles(grams: Sequence[float], counts: Optional[Counter], qs: Sequence[int]) -> Dict[int, float]:
+        if not grams:
+            return {}
+        if counts is None:
+            values = np.percentile(np.frombuffer(grams, dtype=np.float64), qs)
+            return {q: float(v) for q, v in zip(qs, values)}
+        return _percentiles(counts, qs)
+    
+    @staticmethod
+    def _histogram(grams: Sequence[float], counts: Optional[Counter], step: int) -> List[Tuple[int, int]]:
+        if not grams:
+            return []
+        if counts is None:
+            bins = np.bincount((np.frombuffer(grams, dtype=np.float64) // step).astype(np.int64))
+            return [(int(b) * step, int(bins[b])) for b in np.flatnonzero(bins)]
+        bins: Counter = Counter()
+        for value, count in counts.items():
+            bins[int(value // step)] += count
+        return [(b * step, bins[b]) for b in sorted(bins)]
+    
+    def weekday_profile(self, days: int) -> List[float]:
+        """Средний расход по дням недели (пн=0), г/день"""
+        return self._weekday_profile(self.daily_totals(days), days)
+    
+    def moving_average(self, days: int, window: int = MOVING_WINDOW) -> List[float]:
+        """Скользящее среднее дневного расхода; i-е значение - за window дней до i-го включительно"""
+        return self._moving_average(self.daily_totals(days), window)
+    
+    def _weekday_profile(self, totals: Sequence[float], days: int) -> List[float]:
+        first = self.today - days + 1
+        sums = [0.0] * 7
+        counts = [0] * 7
+        for offset, total in enumerate(totals):
+            wd = weekday(first + offset)
+            sums[wd] += float(total)
+            counts[wd] += 1
+        return [s / c if c else 0.0 for s, c in zip(sums, counts)]
+    
+    @staticmethod
+    def _moving_average(totals: Sequence[float], window: int) -> List[float]:
+        if len(totals) < window:
+            return []
+        if np is not None:
+            return np.convolve(totals, np.full(window, 1 / window), mode="valid").tolist()
+        
+        result = []
+        running = sum(totals[:window])
+        result.append(running / window)
+        for i in range(window, len(totals)):
+            running += totals[i] - totals[i - window]
+            result.append(running / window)
+        return result
+    
+    def batches_created(self, days: int) -> int:
+        """Сколько партий создано в окне"""
+        first = self.today - days + 1
+        batch_ts = self.takes.batch_ts
+        return bisect_left(batch_ts, (self.today + 1) * DAY) - bisect_left(batch_ts, first * DAY)
+    
+    def report(self, days: int) -> Optional[WindowReport]:
+        """Всё для расширенного экрана статистики или None, если взятий в окне нет"""
+        _, lo, hi = self._bounds(days)
+        if lo == hi:
+            return None
+        
+        takes = self.takes
+        grams = takes.grams[lo:hi]
+        counts = self._counts(grams)
+        totals = self.daily_totals(days)
+        total = float(sum(totals))
+        return WindowReport(
+            days=days,
+            total=total,
+            portions=hi - lo,
+            batches=self.batches_created(days),
+            batches_used=self._distinct(takes.batch_ids[lo:hi]),
+            avg_per_day=total / days,
+            percentiles=self._percentiles(grams, counts, self.PERCENTILES),
+            histogram=self._histogram(grams, counts, self.HISTOGRAM_STEP),
+            weekdays=self._weekday_profile(totals, days),
+            moving_avg=self._moving_average(totals, self.MOVING_WINDOW),
+        )
@@ -23,17 +23,20 @@ class BackupManager:
         self,
         db_path: str,
         backup_dir: str = "/tmp/backups",
-        keep_days: int = 7
+        keep_days: int = 7,
+        suffix: str = ""
     ):
         """
         Args:
             db_path: путь к файлу БД
             backup_dir: директория для хранения бэкапов
             keep_days: сколько дней хранить бэкапы
+            suffix: добавка к имени бэкапа (чтобы шарды не затирали друг друга)
         """
         self.db_path = db_path
         self.backup_dir = backup_dir
         self.keep_days = keep_days
+        self.suffix = suffix
         
         # Создать директорию если нет
         os.makedirs(backup_dir, exist_ok=True)
@@ -53,7 +56,7 @@ class BackupManager:
             
             # Имя бэкапа с датой и временем
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_name = f"chicken_backup_{timestamp}.db.gz"
+            backup_name = f"chicken_backup_{timestamp}{self.suffix}.db.gz"
             backup_path = os.path.join(self.backup_dir, backup_name)
             
             # Сжать и скопировать БД
@@ -90,33 +93,56 @@ class BackupManager:
             bool: успешно ли отправлено
         """
         try:
-            # Информация о бэкапе
-            size_bytes = os.path.getsize(backup_path)
-            size_kb = size_bytes / 1024
-            filename = os.path.basename(backup_path)
-            
-            # Отправить файл
-            document = FSInputFile(backup_path, filename=filename)
+            size_kb = os.path.getsize(backup_path) / 1024
+        except OSError as e:
+            log.error(f"❌ Ошибка отправки бэкапа: {e}", exc_info=True)
+            return False
+        
+        caption = (
+            f"💾 <b>Автоматический бэкап БД</b>\n\n"
+            f"📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+            f"📦 Размер: {size_kb:.1f} KB\n"
+            f"🔐 Сжат: gzip\n\n"
+            f"<i>Храни в безопасном месте!</i>"
+        )
+        
+        success = await self.send_file_to_admin(bot, admin_id, backup_path, caption)
+        if success:
+            log.info(f"✅ Бэкап отправлен админу {admin_id}")
+        return success
+    
+    async def send_file_to_admin(
+        self,
+        bot: Bot,
+        admin_id: int,
+        file_path: str,
+        caption: str = None
+    ) -> bool:
+        """
+        Отправить файл администратору документом
+        
+        Args:
+            bot: экземпляр бота
+            admin_id: ID администратора
+            file_path: путь к файлу
+            caption: подпись к документу (HTML)
             
-            caption = (
-                f"💾 <b>Автоматический бэкап БД</b>\n\n"
-                f"📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-                f"📦 Размер: {size_kb:.1f} KB\n"
-                f"🔐 Сжат: gzip\n\n"
-                f"<i>Храни в безопасном месте!</i>"
-            )
+        Returns:
+            bool: успешно ли отправлено
+        """
+        try:
+            filename = os.path.basename(file_path)
+            document = FSInputFile(file_path, filename=filename)
             
             await bot.send_document(
                 chat_id=admin_id,
                 document=document,
                 caption=caption
             )
-            
-            log.info(f"✅ Бэкап отправлен админу {admin_id}")
             return True
             
         except Exception as e:
-            log.error(f"❌ Ошибка отправки бэкапа: {e}", exc_info=True)
+            log.error(f"❌ Ошибка отправки файла {file_path}: {e}", exc_info=True)
             return False
     
     async def cleanup_old_backups(self):
@@ -0,0 +1,3 @@
+"""
+Бенчмарки бота (запускаются вручную или в CI, без сети)
+"""
@@ -0,0 +1,438 @@
+"""
+Микробенчмарки слоя хранения
+
+Засевает SQLite-файлы заданным количеством записей истории и сообщений,
+замеряет каждый публичный метод Database и Statistics (и форматирование
+статуса) и сохраняет результаты в JSON для сравнения между прогонами.
+
+Запуск:
+    python -m benchmarks.db_bench --sizes 1000 100000 1000000 --json bench.json
+    python -m benchmarks.db_bench --baseline bench.json --threshold 0.25
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import Analytics  # noqa: E402
+from database import Database  # noqa: E402
+from forecast import format_forecast  # noqa: E402
+from statistics import Statistics  # noqa: E402
+from utils.render import STATUS_NEEDS, stats_needs  # noqa: E402
+from utils.status_formatter import format_status_message  # noqa: E402
+
+
+log = logging.getLogger("benchmarks.db_bench")
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+SEED_DAYS = 365
+SEED_CHUNK = 50_000
+BENCH_CHAT_ID = -1001234567890
+BENCH_USERS = 8
+
+# Разница меньше этого порога считается шумом и не считается регрессией
+NOISE_FLOOR_MS = 0.1
+
+
+# ─────────────────── ЗАСЕВ ДАННЫХ ───────────────────
+
+def _history_rows(count: int, rnd: random.Random):
+    """Записи истории: взятия порций (от BENCH_USERS пользователей) и изредка новые партии, по возрастанию даты"""
+    start = datetime.now() - timedelta(days=SEED_DAYS)
+    step = SEED_DAYS * 86400 / max(1, count)
+    for i in range(count):
+        created = (start + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S")
+        if i % 50 == 0:
+            raw = rnd.choice([1200, 1500, 2000, 2500])
+            cooked = int(raw * 0.8)
+            yield (BENCH_CHAT_ID, 0, "new_batch", f"Новая партия: {raw}г сырой → {cooked}г готовой (к=0.800)", created, None)
+        else:
+            grams = rnd.choice([100, 150, 200, 200, 250, 300])
+            user_id = 1 + rnd.randrange(BENCH_USERS)
+            yield (BENCH_CHAT_ID, 0, "take", f"Взято: {grams}г сырой → {int(grams * 0.8)}г готовой", created, user_id)
+
+
+def _message_rows(count: int):
+    start = datetime.now() - timedelta(days=SEED_DAYS)
+    step = SEED_DAYS * 86400 / max(1, count)
+    for i in range(count):
+        created = (start + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S")
+        yield (10_000 + i, BENCH_CHAT_ID, 0, created)
+
+
+def _insert_chunked(conn: sqlite3.Connection, sql: str, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= SEED_CHUNK:
+            conn.executemany(sql, chunk)
+            chunk.clear()
+    if chunk:
+        conn.executemany(sql, chunk)
+
+
+async def seed_database(path: str, size: int, seed: int = 1) -> Database:
+    """
+    Создать БД со схемой бота и засеять её
+    
+    Args:
+        path: путь к файлу БД
+        size: количество записей истории и сообщений
+        seed: seed генератора
+    
+    Returns:
+        Database: БД чата BENCH_CHAT_ID с активной партией
+    """
+    root = Database(path, timezone_offset=0)
+    await root.init()
+    db = root.for_tenant(BENCH_CHAT_ID)
+    
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        _insert_chunked(
+            conn,
+            "INSERT INTO history (chat_id, thread_id, action_type, text, created, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            _history_rows(size, rnd),
+        )
+        # Итоги пользователей - как их вёл бы take_portion
+        conn.execute(
+            """INSERT INTO user_rollup (chat_id, thread_id, user_id, day, taken, portions)
+               SELECT chat_id, thread_id, user_id, substr(created, 1, 10),
+                      SUM(CAST(substr(text, 8, instr(text, 'г') - 8) AS REAL)), COUNT(*)
+               FROM history WHERE action_type = 'take' AND user_id IS NOT NULL
+               GROUP BY chat_id, thread_id, user_id, substr(created, 1, 10)"""
+        )
+        conn.executemany(
+            "INSERT INTO users (user_id, name, updated) VALUES (?, ?, datetime('now'))",
+            [(user_id, f"Пользователь {user_id}") for user_id in range(1, BENCH_USERS + 1)],
+        )
+        _insert_chunked(
+            conn,
+            "INSERT INTO messages (msg_id, chat_id, thread_id, created) VALUES (?, ?, ?, ?)",
+            _message_rows(size),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    
+    # Большая партия, чтобы взятия порций не упирались в остаток
+    await db.create_batch(raw_total=1e9, cooked_total=8e8, note="benchmark")
+    return db
+
+
+# ─────────────────── СЦЕНАРИИ ───────────────────
+
+@dataclass
+class Case:
+    """Один замеряемый вызов"""
+    name: str
+    run: Callable[[Database], Awaitable]
+    setup: Optional[Callable[[Database], Awaitable]] = None
+    teardown: Optional[Callable[[Database], Awaitable]] = None
+    # Разрушающие сценарии выполняются один раз на копии файла
+    destructive: bool = False
+
+
+def _stats(db: Database) -> Statistics:
+    return Statistics(db, timezone_offset=db.timezone_offset)
+
+
+async def _analytics_report(db: Database):
+    Analytics(await db.get_takes(), db.local_now()).report(365)
+
+
+async def _format_status(db: Database):
+    batch = await db.get_batch()
+    forecast = format_forecast(await db.get_forecast(), batch.raw_left, db.local_now())
+    return format_status_message(batch, timezone_offset=db.timezone_offset, forecast=forecast)
+
+
+async def _format_status_cached(db: Database):
+    # Как в pinned_status: повторный рендер без записей берётся из кэша
+    versions = db.versions
+    batch = await db.get_batch()
+    forecast = format_forecast(await db.get_forecast(), batch.raw_left, db.local_now())
+    return format_status_message(
+        batch, timezone_offset=db.timezone_offset, versions=versions, forecast=forecast
+    )
+
+
+async def _recreate_batch(db: Database):
+    await db.create_batch(raw_total=1e9, cooked_total=8e8, note="benchmark")
+
+
+async def _take_one(db: Database):
+    await db.take_portion(200)
+
+
+async def _drain_history(db: Database):
+    async for _ in db.iter_export("history", ("id", "action_type", "text", "created", "user_id"), ("id",)):
+        pass
+
+
+async def _discard(rows):
+    # Запись сегментов архива не входит в замер - только выборка и удаление
+    pass
+
+
+def build_cases() -> List[Case]:
+    """Список сценариев. Новые публичные методы нужно добавлять сюда"""
+    message_ids = iter(range(1, 10**9))
+    
+    return [
+        # Database: запуск на актуальной схеме - одно чтение user_version
+        Case("Database.init", lambda db: db.init()),
+        
+        # Database: партии
+        Case("Database.get_batch", lambda db: db.get_batch()),
+        Case("Database.take_portion", lambda db: db.take_portion(200)),
+        Case("Database.take_portion[chat]", lambda db: db.take_portion(200, chat_id=BENCH_CHAT_ID)),
+        Case("Database.take_portion[user]", lambda db: db.take_portion(200, user_id=1, user_name="Пользователь 1")),
+        # Первый вызов берёт порцию, остальные - повторы с тем же ключом
+        Case("Database.take_portion[repeat]", lambda db: db.take_portion(200, idempotency_key="bench")),
+        Case("Database.sweep_idempotency_keys", lambda db: db.sweep_idempotency_keys()),
+        Case("Database.get_quick_portions", lambda db: db.get_quick_portions(BENCH_CHAT_ID)),
+        Case("Database.get_forecast", lambda db: db.get_forecast()),
+        Case("Database.load[status]", lambda db: db.load(STATUS_NEEDS)),
+        Case("Database.load[stats30]", lambda db: db.load(stats_needs(30))),
+        Case("Database.get_takes", lambda db: db.get_takes()),
+        Case("Database.get_leaderboard[7]", lambda db: db.get_leaderboard(days=7)),
+        Case("Database.get_user_totals[30]", lambda db: db.get_user_totals(1, days=30)),
+        Case("Database.get_tenant", lambda db: db.get_tenant(*db.tenant)),
+        Case("Database.adopt_legacy", lambda db: db.adopt_legacy()),
+        Case("Database.set_tenant_enabled", lambda db: db.set_tenant_enabled(True)),
+        Case("Database.update_raw_left", lambda db: db.update_raw_left(5e8)),
+        Case("Database.update_pinned_msg_id", lambda db: db.update_pinned_msg_id(777)),
+        # Каждая партия остаётся открытой - замер на копии, чтобы не копить их в общей БД
+        Case("Database.create_batch", lambda db: db.create_batch(1e9, 8e8, "benchmark"), destructive=True),
+        Case("Database.get_open_batches", lambda db: db.get_open_batches()),
+        Case("Database.get_batch_archive", lambda db: db.get_batch_archive()),
+        Case("Database.get_pinned_msg_id", lambda db: db.get_pinned_msg_id()),
+        Case("Database.get_ledger", lambda db: db.get_ledger()),
+        Case("Database.rebuild_stock", lambda db: db.rebuild_stock()),
+        Case("Database.undo_last_take", lambda db: db.undo_last_take(), setup=_take_one),
+        Case("Database.reset_batch", lambda db: db.reset_batch(), setup=_recreate_batch, teardown=_recreate_batch),
+        # Database: история
+        Case("Database.add_history", lambda db: db.add_history("take", "Взято: 200г сырой → 160г готовой")),
+        Case("Database.get_history[10]", lambda db: db.get_history(limit=10)),
+        Case("Database.get_history[1000]", lambda db: db.get_history(limit=1000)),
+        Case("Database.get_history_columns[1000]", lambda db: db.get_history_columns(limit=1000)),
+        Case("Database.iter_export[history]", _drain_history),
+        Case("Database.clear_history", lambda db: db.clear_history(), destructive=True),
+        Case("Database.archive_history[180]", lambda db: db.archive_history(180, _discard), destructive=True),
+        # Database: сообщения
+        Case("Database.add_message", lambda db: db.add_message(123, BENCH_CHAT_ID)),
+        Case("Database.get_old_messages", lambda db: db.get_old_messages(5)),
+        Case("Database.delete_message_record", lambda db: db.delete_message_record(next(message_ids))),
+        Case("Database.prune_messages", lambda db: db.prune_messages()),
+        Case("Database.clear_messages", lambda db: db.clear_messages(), destructive=True),
+        # Statistics
+        Case("Statistics.get_period_stats[1]", lambda db: _stats(db).get_period_stats(days=1)),
+        Case("Statistics.get_period_stats[7]", lambda db: _stats(db).get_period_stats(days=7)),
+        Case("Statistics.get_period_stats[30]", lambda db: _stats(db).get_period_stats(days=30)),
+        Case("Statistics.get_today_stats", lambda db: _stats(db).get_today_stats()),
+        Case("Statistics.get_week_stats", lambda db: _stats(db).get_week_stats()),
+        Case("Statistics.get_month_stats", lambda db: _stats(db).get_month_stats()),
+        Case("Statistics.get_batch_history", lambda db: _stats(db).get_batch_history()),
+        Case("Statistics.format_stats_message[7]", lambda db: _stats(db).format_stats_message(days=7)),
+        Case("Statistics.format_extended_stats[365]", lambda db: _stats(db).format_extended_stats(days=365)),
+        Case("Statistics.format_leaderboard[7]", lambda db: _stats(db).format_leaderboard(days=7)),
+        Case("Statistics.format_user_stats", lambda db: _stats(db).format_user_stats(1)),
+        Case("Analytics.report[365]", _analytics_report),
+        # Рендеринг
+        Case("format_status_message", _format_status),
+        Case("format_status_message[cached]", _format_status_cached),
+    ]
+
+
+def uncovered_methods(cases: List[Case]) -> List[str]:
+    """Публичные методы Database/Statistics, для которых нет сценария"""
+    covered = {case.name.split("[")[0] for case in cases}
+    missing = []
+    for cls in (Database, Statistics):
+        for name, member in inspect.getmembers(cls, inspect.iscoroutinefunction):
+            if name.startswith("_") or name == "init":
+                continue
+            if f"{cls.__name__}.{name}" not in covered:
+                missing.append(f"{cls.__name__}.{name}")
+    return missing
+
+
+# ─────────────────── ЗАМЕРЫ ───────────────────
+
+def _summary(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {
+        "runs": n,
+        "min_ms": ordered[0] * 1000,
+        "median_ms": ordered[n // 2] * 1000,
+        "p90_ms": ordered[min(n - 1, int(n * 0.9))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def time_case(db: Database, case: Case, min_time: float, max_runs: int) -> dict:
+    """Гонять сценарий, пока не наберётся min_time секунд или max_runs запусков"""
+    samples: List[float] = []
+    total = 0.0
+    while len(samples) < max_runs and (total < min_time or len(samples) < 3):
+        if case.setup:
+            await case.setup(db)
+        started = time.perf_counter()
+        await case.run(db)
+        elapsed = time.perf_counter() - started
+        samples.append(elapsed)
+        total += elapsed
+        if case.destructive:
+            break
+    if case.teardown:
+        await case.teardown(db)
+    return _summary(samples)
+
+
+async def bench_size(size: int, workdir: str, args) -> Dict[str, dict]:
+    """Засеять БД заданного размера и прогнать все сценарии"""
+    path = os.path.join(workdir, f"bench_{size}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    
+    started = time.perf_counter()
+    db = await seed_database(path, size, seed=args.seed)
+    print(f"[{size}] засев: {time.perf_counter() - started:.1f} с, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+    
+    results = {}
+    for case in build_cases():
+        if args.only and not any(pattern in case.name for pattern in args.only):
+            continue
+        
+        target = db
+        if case.destructive:
+            copy_path = os.path.join(workdir, f"bench_{size}_copy.db")
+            shutil.copyfile(path, copy_path)
+            target = Database(copy_path, timezone_offset=db.timezone_offset).for_tenant(*db.tenant)
+        
+        results[case.name] = await time_case(target, case, args.min_time, args.max_runs)
+        print(f"[{size}] {case.name:<40} median={results[case.name]['median_ms']:.3f} мс")
+        
+        if case.destructive:
+            os.remove(target.db_path)
+    
+    os.remove(path)
+    return results
+
+
+# ─────────────────── СРАВНЕНИЕ ───────────────────
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Сравнить медианы с базовым прогоном
+    
+    Returns:
+        list: описания регрессий (пусто - всё в порядке)
+    """
+    regressions = []
+    for size, cases in current["results"].items():
+        base_cases = baseline.get("results", {}).get(size, {})
+        for name, result in cases.items():
+            base = base_cases.get(name)
+            if not base:
+                continue
+            now_ms, base_ms = result["median_ms"], base["median_ms"]
+            ratio = now_ms / base_ms if base_ms else float("inf")
+            marker = ""
+            if ratio > 1 + threshold and now_ms - base_ms > NOISE_FLOOR_MS:
+                marker = "  ← РЕГРЕССИЯ"
+                regressions.append(f"[{size}] {name}: {base_ms:.3f} → {now_ms:.3f} мс (x{ratio:.2f})")
+            print(f"[{size}] {name:<40} {base_ms:>10.3f} → {now_ms:>10.3f} мс  x{ratio:.2f}{marker}")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="chicken_dbbench_")
+    os.makedirs(workdir, exist_ok=True)
+    
+    missing = uncovered_methods(build_cases())
+    if missing:
+        print(f"⚠️ Нет сценариев для: {', '.join(missing)}")
+    
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = await bench_size(size, workdir, args)
+    
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки Database и Statistics")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры истории")
+    parser.add_argument("--only", nargs="+", help="замерять только сценарии с этими подстроками")
+    parser.add_argument("--min-time", type=float, default=0.5, help="минимум секунд на сценарий")
+    parser.add_argument("--max-runs", type=int, default=200, help="максимум запусков на сценарий")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", help="куда класть засеянные БД (по умолчанию временная папка)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление медианы (0.25 = +25%%)")
+    args = parser.parse_args()
+    
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    current = asyncio.run(run(args))
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.json}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nСравнение с {args.baseline} (порог +{args.threshold:.0%}):")
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ Регрессий: {len(regressions)}")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков
+
+aiohttp-приложение, которое отвечает на методы Bot API правдоподобными
+объектами и раздаёт апдейты через getUpdates. Работает полностью офлайн.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+log = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 42,
+    "is_bot": True,
+    "first_name": "Chicken Bench",
+    "username": "chicken_bench_bot",
+}
+
+
+class FakeBotAPI:
+    """
+    Фейковый Bot API сервер
+    
+    Апдейты кладутся в очередь через push_update(); бот забирает их
+    long polling'ом. Ответ answerCallbackQuery завершает обработку апдейта,
+    и по нему считается end-to-end задержка.
+    """
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        
+        self.calls: Counter = Counter()
+        self.documents: List[Dict[str, Any]] = []
+        
+        self._pending: List[Dict[str, Any]] = []
+        self._has_updates = asyncio.Event()
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._served_at: Dict[str, float] = {}
+        self._message_ids = itertools.count(1000)
+        
+        self._runner: Optional[web.AppRunner] = None
+    
+    # ─────────────────── ЖИЗНЕННЫЙ ЦИКЛ ───────────────────
+    
+    async def start(self) -> str:
+        """
+        Запустить сервер
+        
+        Returns:
+            str: базовый URL для TelegramAPIServer.from_base()
+        """
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/bot{token}/{method}", self._handle)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        
+        host, port = self._runner.addresses[0][:2]
+        self.port = port
+        log.info(f"Фейковый Bot API запущен на {host}:{port}")
+        return self.base_url
+    
+    async def stop(self):
+        """Остановить сервер"""
+        for future in self._waiters.values():
+            if not future.done():
+                future.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    # ─────────────────── АПДЕЙТЫ ───────────────────
+    
+    def push_update(self, update: Dict[str, Any]) -> asyncio.Future:
+        """
+        Поставить апдейт в очередь getUpdates
+        
+        Returns:
+            Future: для callback_query - завершится задержкой (сек) от выдачи
+            апдейта боту до answerCallbackQuery; для остальных - сразу None
+        """
+        future = asyncio.get_running_loop().create_future()
+        
+        callback = update.get("callback_query")
+        if callback:
+            self._waiters[callback["id"]] = future
+        else:
+            future.set_result(None)
+        
+        self._pending.append(update)
+        self._has_updates.set()
+        return future
+    
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        
+        # Подтверждённые апдейты (id < offset) больше не отдаём
+        if offset:
+            self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        
+        if not self._pending and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        
+        batch = self._pending[:limit]
+        now = time.perf_counter()
+        for update in batch:
+            callback = update.get("callback_query")
+            if callback:
+                self._served_at.setdefault(callback["id"], now)
+        return batch
+    
+    def _complete_callback(self, callback_id: str):
+        future = self._waiters.pop(callback_id, None)
+        served_at = self._served_at.pop(callback_id, None)
+        if future and not future.done():
+            latency = time.perf_counter() - served_at if served_at else None
+            future.set_result(latency)
+    
+    # ─────────────────── МЕТОДЫ API ───────────────────
+    
+    def _message(self, params: Dict[str, Any], message_id: int = None) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+        }
+        if params.get("text"):
+            message["text"] = params["text"]
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = int(params["message_thread_id"])
+            message["is_topic_message"] = True
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
+    
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        
+        params: Dict[str, Any] = {}
+        if request.can_read_body:
+            form = await request.post()
+            for key, value in form.items():
+                # Файлы (sendDocument) приходят как FileField
+                params[key] = value if isinstance(value, str) else value.filename
+        
+        result = await self._dispatch(method.lower(), params)
+        return web.json_response({"ok": True, "result": result})
+    
+    async def _dispatch(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getupdates":
+            return await self._get_updates(params)
+        if method == "getme":
+            return BOT_USER
+        if method == "sendmessage":
+            return self._message(params)
+        if method == "editmessagetext":
+            if params.get("inline_message_id"):
+                return True
+            return self._message(params, message_id=int(params["message_id"]))
+        if method == "senddocument":
+            message = self._message(params)
+            message["document"] = {
+                "file_id": f"doc{message['message_id']}",
+                "file_unique_id": f"u{message['message_id']}",
+                "file_name": params.get("document") or "file",
+            }
+            if params.get("caption"):
+                message["caption"] = params["caption"]
+            self.documents.append(message)
+            return message
+        if method == "answercallbackquery":
+            self._complete_callback(params.get("callback_query_id", ""))
+            return True
+        # deleteMessage, pinChatMessage, unpinChatMessage, deleteWebhook и т.д.
+        return True
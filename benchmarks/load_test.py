@@ -0,0 +1,296 @@
+"""
+End-to-end нагрузочный бенчмарк
+
+Поднимает фейковый Bot API, запускает настоящий Dispatcher из main.py
+в режиме polling и гоняет синтетических пользователей, которые жмут
+quick:*, take → take:*, stats_* и history. С --shards N вместо одного
+Dispatcher работает супервизор из sharding.py с N рабочими процессами.
+
+Запуск:
+    python -m benchmarks.load_test --users 20 --duration 30
+    python -m benchmarks.load_test --users 40 --chats 16 --shards 4
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+from aiogram.client.telegram import TelegramAPIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callbacks import QuickPortion, TakePortion  # noqa: E402
+from config import Config  # noqa: E402
+from database import Database  # noqa: E402
+from handlers.common import DOUBLE_TAP_WINDOW  # noqa: E402
+from keyboards import KeyboardSession  # noqa: E402
+from main import create_bot, create_dispatcher  # noqa: E402
+from sharding import run_supervisor, shard_path  # noqa: E402
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+log = logging.getLogger("benchmarks.load_test")
+
+BENCH_TOKEN = "42:BENCHMARK-TOKEN"
+BENCH_CHAT_ID = -1001234567890
+
+# Сценарии: (вес, последовательность callback_data)
+SCENARIOS = [
+    (40, [QuickPortion(grams=200).pack()]),
+    (10, [QuickPortion(grams=300).pack()]),
+    (15, ["take", TakePortion(grams=150).pack()]),
+    (5, ["take", TakePortion(grams=100).pack()]),
+    (10, ["stats_today"]),
+    (5, ["stats_week"]),
+    (5, ["stats_month"]),
+    (2, ["stats_year"]),
+    (3, ["stats_top"]),
+    (3, ["stats_me"]),
+    (10, ["history"]),
+]
+
+
+def db_size(path: str) -> int:
+    """Размер файла БД вместе с -wal и -journal"""
+    total = 0
+    for suffix in ("", "-wal", "-journal"):
+        if os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class LoadGenerator:
+    """Синтетические пользователи в закрытом цикле (нажал → дождался ответа → дальше)"""
+    
+    def __init__(self, api: FakeBotAPI, users: int, chat_ids: List[int], thread_id: int, seed: int):
+        self.api = api
+        self.users = users
+        self.chat_ids = chat_ids
+        self.thread_id = thread_id
+        self.random = random.Random(seed)
+        
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent = 0
+        self.timeouts = 0
+        
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._scenarios = [steps for _, steps in SCENARIOS]
+        self._weights = [weight for weight, _ in SCENARIOS]
+    
+    def callback_update(self, user_id: int, data: str) -> dict:
+        """Апдейт с нажатием inline-кнопки"""
+        chat_id = self.chat_ids[user_id % len(self.chat_ids)]
+        message = {
+            "message_id": 500 + user_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "is_forum": True},
+            "from": {"id": 42, "is_bot": True, "first_name": "Chicken Bench"},
+            "text": "🍗",
+        }
+        if self.thread_id:
+            message["message_thread_id"] = self.thread_id
+            message["is_topic_message"] = True
+        
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._callback_ids)),
+                "from": {"id": 10_000 + user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "chat_instance": str(chat_id),
+                "message": message,
+                "data": data,
+            },
+        }
+    
+    async def _user(self, user_id: int, deadline: float, max_updates: int):
+        # Ту же кнопку пользователь жмёт не чаще DOUBLE_TAP_WINDOW: иначе
+        # бот считал бы нажатие двойным и не брал порцию повторно (take_key)
+        pressed: Dict[str, float] = {}
+        while time.perf_counter() < deadline and self.sent < max_updates:
+            steps = self.random.choices(self._scenarios, self._weights)[0]
+            for data in steps:
+                wait = pressed.get(data, -DOUBLE_TAP_WINDOW) + DOUBLE_TAP_WINDOW - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                pressed[data] = time.perf_counter()
+                self.sent += 1
+                future = self.api.push_update(self.callback_update(user_id, data))
+                try:
+                    latency = await asyncio.wait_for(future, timeout=30)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    continue
+                if latency is not None:
+                    action = data.partition(":")[0].split("_")[0]
+                    self.latencies.setdefault(action, []).append(latency)
+    
+    async def run(self, duration: float, max_updates: int):
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            self._user(user_id, deadline, max_updates) for user_id in range(self.users)
+        ))
+
+
+async def run_benchmark(args) -> dict:
+    """Прогнать бенчмарк и вернуть результаты"""
+    workdir = tempfile.mkdtemp(prefix="chicken_bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    
+    api = FakeBotAPI()
+    base_url = await api.start()
+    
+    config = Config(
+        bot_token=BENCH_TOKEN,
+        db_path=db_path,
+        topic_id=args.thread_id,
+        record_updates_path=args.record,
+        shards=args.shards,
+        bot_api_url=base_url,
+    )
+    db = Database(db_path, timezone_offset=config.timezone_offset)
+    await db.init()
+    
+    # Большая партия в каждом чате, чтобы остатка хватило на весь прогон
+    chat_ids = [BENCH_CHAT_ID - i for i in range(args.chats)]
+    for chat_id in chat_ids:
+        tenant = db.for_tenant(chat_id, args.thread_id)
+        await tenant.create_batch(raw_total=1e9, cooked_total=8e8, note="benchmark")
+    size_before = db_size(db_path)
+    
+    if args.shards > 1:
+        # Супервизор разобьёт БД на файлы шардов при запуске
+        db_paths = [shard_path(db_path, shard, args.shards) for shard in range(args.shards)]
+        bot = create_bot(config)
+        # Логи рабочих на каждый апдейт искажают замер так же, как свои
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        polling = asyncio.create_task(run_supervisor(config, bot, polling_timeout=1))
+        stop_polling = None
+    else:
+        db_paths = [db_path]
+        session = KeyboardSession(api=TelegramAPIServer.from_base(base_url))
+        bot = create_bot(config, session=session)
+        dp = create_dispatcher(db, config)
+        polling = asyncio.create_task(dp.start_polling(
+            bot,
+            handle_signals=False,
+            polling_timeout=1,
+            allowed_updates=dp.resolve_used_update_types(),
+        ))
+        stop_polling = dp.stop_polling
+    
+    # Отсчёт - с первого getUpdates (рабочие шардов запущены)
+    while not api.calls["getUpdates"] and not polling.done():
+        await asyncio.sleep(0.01)
+    
+    generator = LoadGenerator(api, args.users, chat_ids, args.thread_id, args.seed)
+    started = time.perf_counter()
+    try:
+        await generator.run(args.duration, args.max_updates)
+    finally:
+        elapsed = time.perf_counter() - started
+        if stop_polling:
+            await stop_polling()
+        else:
+            polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        await bot.session.close()
+        await api.stop()
+    
+    size_after = sum(map(db_size, db_paths))
+    all_latencies = [x for values in generator.latencies.values() for x in values]
+    
+    def summary(values: List[float]) -> dict:
+        return {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+        }
+    
+    return {
+        "users": args.users,
+        "chats": args.chats,
+        "shards": args.shards,
+        "elapsed_s": elapsed,
+        "updates": generator.sent,
+        "completed": len(all_latencies),
+        "timeouts": generator.timeouts,
+        "updates_per_s": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency": summary(all_latencies),
+        "latency_by_action": {
+            action: summary(values) for action, values in sorted(generator.latencies.items())
+        },
+        "api_calls": dict(Counter(api.calls).most_common()),
+        "db_bytes_before": size_before,
+        "db_bytes_after": size_after,
+        "db_growth_bytes_per_update": (size_after - size_before) / max(1, generator.sent),
+    }
+
+
+def print_report(result: dict):
+    """Вывести результаты в человекочитаемом виде"""
+    latency = result["latency"]
+    print(f"Пользователей:      {result['users']} в {result['chats']} чатах, шардов {result['shards']}")
+    print(f"Длительность:       {result['elapsed_s']:.1f} с")
+    print(f"Апдейтов:           {result['updates']} (завершено {result['completed']}, таймаутов {result['timeouts']})")
+    print(f"Пропускная способ.: {result['updates_per_s']:.1f} апдейтов/с")
+    print(
+        f"Задержка:           p50={latency['p50_ms']:.1f} мс  p90={latency['p90_ms']:.1f} мс  "
+        f"p99={latency['p99_ms']:.1f} мс  max={latency['max_ms']:.1f} мс"
+    )
+    print("По действиям:")
+    for action, values in result["latency_by_action"].items():
+        print(f"  {action:<8} n={values['count']:<6} p50={values['p50_ms']:.1f} мс  p99={values['p99_ms']:.1f} мс")
+    print(
+        f"Размер БД:          {result['db_bytes_before'] / 1024:.1f} KB → {result['db_bytes_after'] / 1024:.1f} KB "
+        f"({result['db_growth_bytes_per_update']:.1f} B/апдейт)"
+    )
+    print(f"Вызовы API:         {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк бота на фейковом Bot API")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность, секунд")
+    parser.add_argument("--max-updates", type=int, default=10**9, help="остановиться после N апдейтов")
+    parser.add_argument("--chats", type=int, default=1, help="число чатов, между которыми делятся пользователи")
+    parser.add_argument("--shards", type=int, default=1, help="число процессов-шардов (sharding.py)")
+    parser.add_argument("--thread-id", type=int, default=4, help="ID топика в сообщениях")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора сценариев")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--record", help="записать апдейты в JSONL (для benchmarks.replay)")
+    args = parser.parse_args()
+    
+    # Логи бота на каждый апдейт искажают замер
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
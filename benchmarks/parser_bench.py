@@ -0,0 +1,156 @@
+"""
+Микробенчмарк WeightParser
+
+Сравнивает скорость (разборов/с) текущего парсера без кэша и с кэшем
+с прежней реализацией (подстроки WEIGHT_WORDS + re.sub/re.search),
+и показывает входы, на которых результаты расходятся.
+Режим --bulk меряет пакетный путь parse_many + validate_many
+(строк/мин) против поштучных parse + validate.
+
+Запуск:
+    python -m benchmarks.parser_bench --rounds 20000
+    python -m benchmarks.parser_bench --bulk 1000000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.parser import WeightParser, _parse_normalized  # noqa: E402
+from utils.validators import WeightError, WeightValidator  # noqa: E402
+
+
+CORPUS = [
+    "200", "150", "300", "1500", "1500г", "200 г", "1.5", "1.5кг", "1,5 кг", "0.25кг",
+    "полкило", "пол кило", "полкилограмма", "половина", "четверть", "1/2", "1/4",
+    "кило", "килограмм", "взял 200 г", "150 г курицы", "200+150", "2 по 150",
+    "1 кг 200 г", "двести грамм", "8 oz", "1 lb", "abc", "100 g", "3/4 кг",
+]
+
+
+class LegacyWeightParser:
+    """Прежняя реализация WeightParser.parse - только для сравнения"""
+    
+    WEIGHT_WORDS = {
+        "полкило": 500,
+        "пол кило": 500,
+        "половина": 500,
+        "половинка": 500,
+        "четверть": 250,
+        "1/4": 250,
+        "1/2": 500,
+        "кило": 1000,
+        "килограмм": 1000,
+        "килограма": 1000,
+    }
+    
+    @classmethod
+    def parse(cls, text: str) -> Optional[float]:
+        if not text:
+            return None
+        
+        t = text.lower().strip()
+        t = t.replace(",", ".")
+        
+        for word, value in cls.WEIGHT_WORDS.items():
+            if word in t:
+                return float(value)
+        
+        t = re.sub(r"[^\d\.кгkg ]", "", t)
+        
+        for pattern in (r"([\d\.]+)\s*кг", r"([\d\.]+)\s*kg"):
+            kg_match = re.search(pattern, t)
+            if kg_match:
+                try:
+                    return float(kg_match.group(1)) * 1000
+                except ValueError:
+                    continue
+        
+        g_match = re.search(r"([\d\.]+)", t)
+        if g_match:
+            try:
+                value = float(g_match.group(1))
+                if 0 < value < 50:
+                    return value * 1000
+                return value
+            except ValueError:
+                return None
+        
+        return None
+
+
+def _uncached(text: str) -> Optional[float]:
+    if not text:
+        return None
+    normalized = text.lower().strip()
+    return WeightParser.evaluate(WeightParser.tokenize(normalized))
+
+
+def measure(parse: Callable[[str], Optional[float]], corpus: List[str], rounds: int) -> float:
+    """Разборов в секунду"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            parse(text)
+    elapsed = time.perf_counter() - started
+    return rounds * len(corpus) / elapsed
+
+
+def measure_bulk(rows: int) -> None:
+    """Пакетный разбор и валидация rows строк (импорт истории)"""
+    texts = [CORPUS[i % len(CORPUS)] for i in range(rows)]
+    validator = WeightValidator()
+    
+    _parse_normalized.cache_clear()
+    started = time.perf_counter()
+    for text in texts:
+        validator.validate(WeightParser.parse(text))
+    single = time.perf_counter() - started
+    
+    _parse_normalized.cache_clear()
+    started = time.perf_counter()
+    codes = validator.validate_many(WeightParser.parse_many(texts))
+    bulk = time.perf_counter() - started
+    
+    ok = codes.count(WeightError.OK)
+    print(f"Пакет: {rows:,} строк, валидных {ok:,}")
+    for name, elapsed in (("parse+validate", single), ("parse_many+validate_many", bulk)):
+        print(f"  {name:<24} {rows / elapsed * 60:>14,.0f} строк/мин  {elapsed:.2f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк WeightParser")
+    parser.add_argument("--rounds", type=int, default=5000, help="проходов по корпусу")
+    parser.add_argument("--bulk", type=int, default=0, help="строк для пакетного режима")
+    args = parser.parse_args()
+    
+    if args.bulk:
+        measure_bulk(args.bulk)
+        return
+    
+    _parse_normalized.cache_clear()
+    
+    results = {
+        "legacy": measure(LegacyWeightParser.parse, CORPUS, args.rounds),
+        "tokenizer": measure(_uncached, CORPUS, args.rounds),
+        "tokenizer+lru": measure(WeightParser.parse, CORPUS, args.rounds),
+    }
+    
+    base = results["legacy"]
+    print(f"Корпус: {len(CORPUS)} строк x {args.rounds} проходов")
+    for name, rate in results.items():
+        print(f"  {name:<14} {rate:>12,.0f} разборов/с  x{rate / base:.2f}")
+    
+    print("\nРасхождения с прежним парсером:")
+    for text in CORPUS:
+        old, new = LegacyWeightParser.parse(text), WeightParser.parse(text)
+        if old != new:
+            print(f"  {text!r:<20} было {old} → стало {new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Воспроизведение записанных апдейтов (RECORD_UPDATES)
+
+Прогоняет журнал через настоящий Dispatcher из main.py на временной БД,
+исходящие вызовы уходят в фейковый Bot API. Апдейты подаются строго
+по порядку записи, поэтому прогон детерминирован.
+
+Запуск:
+    python -m benchmarks.replay updates.jsonl                  # с записанными паузами
+    python -m benchmarks.replay updates.jsonl --speed max      # без пауз
+    python -m benchmarks.replay updates.jsonl --speed 10       # в 10 раз быстрее
+    python -m benchmarks.replay updates.jsonl --seed-db prod_copy.db
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiogram.client.telegram import TelegramAPIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from database import Database  # noqa: E402
+from keyboards import KeyboardSession  # noqa: E402
+from main import create_bot, create_dispatcher  # noqa: E402
+from recorder import read_records  # noqa: E402
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from benchmarks.load_test import BENCH_TOKEN, db_size, percentile  # noqa: E402
+
+
+log = logging.getLogger("benchmarks.replay")
+
+
+def update_kind(update: dict) -> str:
+    """Короткое имя апдейта для отчёта: callback по префиксу данных, команда или тип"""
+    callback = update.get("callback_query")
+    if callback:
+        return "cb:" + (callback.get("data") or "").split("_")[0]
+    message = update.get("message")
+    if message:
+        text = message.get("text") or ""
+        return "cmd:" + text.split()[0] if text.startswith("/") else "message"
+    kinds = [key for key in update if key != "update_id"]
+    return kinds[0] if kinds else "unknown"
+
+
+def parse_speed(value: str) -> float:
+    """'recorded' = 1.0, 'max' = 0 (без пауз), число = множитель скорости"""
+    if value == "recorded":
+        return 1.0
+    if value == "max":
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("скорость должна быть больше нуля")
+    return speed
+
+
+async def replay(args) -> dict:
+    """Воспроизвести журнал и вернуть результаты"""
+    # Порядок получения, а не завершения обработки
+    records = sorted(read_records(args.log), key=lambda record: record.get("ts", 0.0))
+    if not records:
+        raise SystemExit(f"В журнале {args.log} нет записей")
+    
+    workdir = tempfile.mkdtemp(prefix="chicken_replay_")
+    db_path = os.path.join(workdir, "replay.db")
+    if args.seed_db:
+        shutil.copyfile(args.seed_db, db_path)
+    
+    config = Config(
+        bot_token=BENCH_TOKEN,
+        db_path=db_path,
+        admin_ids=args.admin_ids or [],
+        topic_id=args.thread_id,
+    )
+    db = Database(db_path, timezone_offset=config.timezone_offset)
+    await db.init(legacy_thread_id=config.topic_id)
+    size_before = db_size(db_path)
+    
+    api = FakeBotAPI()
+    base_url = await api.start()
+    bot = create_bot(config, session=KeyboardSession(api=TelegramAPIServer.from_base(base_url)))
+    dp = create_dispatcher(db, config)
+    
+    durations: Dict[str, List[float]] = {}
+    recorded: List[float] = []
+    errors = 0
+    max_lag = 0.0
+    
+    first_ts = records[0].get("ts", 0.0)
+    started = time.perf_counter()
+    try:
+        for record in records:
+            if args.speed:
+                due = (record.get("ts", first_ts) - first_ts) / args.speed
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            
+            update = record["update"]
+            update_started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                errors += 1
+                log.warning(f"Апдейт {update.get('update_id')} упал: {e}")
+            elapsed = time.perf_counter() - update_started
+            
+            durations.setdefault(update_kind(update), []).append(elapsed)
+            if "duration_ms" in record:
+                recorded.append(record["duration_ms"] / 1000)
+    finally:
+        total = time.perf_counter() - started
+        await bot.session.close()
+        await api.stop()
+    
+    all_durations = [x for values in durations.values() for x in values]
+    
+    def summary(values: List[float]) -> dict:
+        return {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+            "total_ms": sum(values) * 1000,
+        }
+    
+    return {
+        "updates": len(records),
+        "errors": errors,
+        "elapsed_s": total,
+        "updates_per_s": len(records) / total if total else 0.0,
+        "max_lag_s": max_lag,
+        "replayed": summary(all_durations),
+        "recorded": summary(recorded),
+        "by_kind": {kind: summary(values) for kind, values in sorted(durations.items())},
+        "api_calls": dict(api.calls.most_common()),
+        "db_bytes_before": size_before,
+        "db_bytes_after": db_size(db_path),
+    }
+
+
+def print_report(result: dict):
+    """Вывести результаты"""
+    replayed, recorded = result["replayed"], result["recorded"]
+    print(f"Апдейтов:        {result['updates']} (ошибок {result['errors']})")
+    print(f"Длительность:    {result['elapsed_s']:.2f} с ({result['updates_per_s']:.1f} апдейтов/с)")
+    if result["max_lag_s"]:
+        print(f"Макс. отставание от записи: {result['max_lag_s'] * 1000:.1f} мс")
+    print(f"Обработка сейчас: p50={replayed['p50_ms']:.2f} мс  p99={replayed['p99_ms']:.2f} мс  max={replayed['max_ms']:.2f} мс")
+    if recorded["count"]:
+        print(f"Обработка в записи: p50={recorded['p50_ms']:.2f} мс  p99={recorded['p99_ms']:.2f} мс  max={recorded['max_ms']:.2f} мс")
+    print("По типам:")
+    for kind, values in sorted(result["by_kind"].items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"  {kind:<16} n={values['count']:<6} p50={values['p50_ms']:.2f} мс  p99={values['p99_ms']:.2f} мс")
+    print(f"Размер БД:       {result['db_bytes_before'] / 1024:.1f} KB → {result['db_bytes_after'] / 1024:.1f} KB")
+    print(f"Вызовы API:      {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument("log", help="путь к JSONL-журналу (ротированные .1, .2... подхватываются)")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="recorded, max или множитель (по умолчанию recorded)")
+    parser.add_argument("--seed-db", help="копия БД, с которой начать (по умолчанию пустая)")
+    parser.add_argument("--admin-ids", type=int, nargs="*", help="ID админов для админ-команд в журнале")
+    parser.add_argument("--thread-id", type=int, default=Config.topic_id, help="ID топика")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+    
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    result = asyncio.run(replay(args))
+    print_report(result)
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
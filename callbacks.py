@@ -0,0 +1,50 @@
+"""
+Типизированные callback_data для динамических кнопок
+
+Кодек aiogram CallbackData: "quick:200" ⇄ QuickPortion(grams=200).
+Значения проверяются pydantic при распаковке, поэтому битые или
+подделанные данные просто не проходят фильтр и не доходят до хендлера.
+"""
+from typing import Any, Dict, Type, Union
+
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+from pydantic import Field
+
+
+# Верхняя граница веса в кнопке; реальные лимиты проверяет WeightValidator
+MAX_BUTTON_GRAMS = 100_000
+
+
+class QuickPortion(CallbackData, prefix="quick"):
+    """Быстрое взятие порции из главного меню"""
+    grams: int = Field(gt=0, le=MAX_BUTTON_GRAMS)
+
+
+class TakePortion(CallbackData, prefix="take"):
+    """Выбор готовой порции на экране «Взять порцию»"""
+    grams: int = Field(gt=0, le=MAX_BUTTON_GRAMS)
+
+
+class LegacyCallback(Filter):
+    """
+    Кнопки старого формата "<prefix>_<значение>"
+    
+    Такие кнопки остаются на уже отправленных сообщениях. Фильтр
+    переводит их в новый кодек и передаёт хендлеру тот же callback_data.
+    """
+    
+    def __init__(self, codec: Type[CallbackData]):
+        self.codec = codec
+        self.prefix = codec.__prefix__ + "_"
+    
+    async def __call__(self, query: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        data = query.data or ""
+        if not data.startswith(self.prefix):
+            return False
+        packed = self.codec.__prefix__ + self.codec.__separator__ + data[len(self.prefix):]
+        try:
+            return {"callback_data": self.codec.unpack(packed)}
+        except (TypeError, ValueError):
+            return False
@@ -3,7 +3,7 @@
 """
 import os
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 
 @dataclass
@@ -16,9 +16,16 @@ class Config:
     max_messages_store: int = 5
     admin_ids: List[int] = field(default_factory=list)
     
-    # ID топика (ветки) в группе где работает бот
-    # ЗАХАРДКОЖЕНО для BotHost.ru
-    topic_id: int = 4
+    # Топик, которому достанутся данные однопользовательской версии
+    # (None - первому групповому чату). Где работает бот, задаёт таблица
+    # tenants: /disable и /enable в нужном топике
+    topic_id: Optional[int] = 4
+    
+    # Число процессов-шардов (1 - всё в одном процессе, см. sharding.py)
+    shards: int = 1
+    
+    # Свой Bot API сервер, например http://localhost:8081 (None - api.telegram.org)
+    bot_api_url: Optional[str] = None
     
     # Часовой пояс (смещение от UTC в часах)
     # Для Москвы: +3
@@ -28,6 +35,16 @@ class Config:
     min_weight: float = 10.0  # г
     max_weight: float = 10000.0  # г (10 кг)
     
+    # Запись апдейтов в JSONL для воспроизведения (None = выключено)
+    record_updates_path: Optional[str] = None
+    record_max_bytes: int = 50 * 1024 * 1024
+    record_backups: int = 5
+    
+    # Сколько дней истории держать в БД; старше - в сжатый архив на диске
+    # (0 = не переносить). Год с запасом: экран «За год» читает историю
+    history_retention_days: int = 400
+    archive_dir: Optional[str] = None  # None - {имя БД}_archive рядом с БД
+    
     @classmethod
     def from_env(cls) -> 'Config':
         """Создание конфигурации из переменных окружения"""
@@ -45,9 +62,16 @@ class Config:
             low_threshold=int(os.getenv("LOW_THRESHOLD", "300")),
             max_messages_store=int(os.getenv("MAX_MESSAGES", "5")),
             admin_ids=admin_ids if admin_ids else [],
-            # topic_id захардкожен в классе = 4
+            topic_id=int(os.getenv("TOPIC_ID", "4") or 0) or None,
+            shards=max(1, int(os.getenv("SHARDS", "1"))),
+            bot_api_url=os.getenv("BOT_API_URL") or None,
             min_weight=float(os.getenv("MIN_WEIGHT", "10.0")),
-            max_weight=float(os.getenv("MAX_WEIGHT", "10000.0"))
+            max_weight=float(os.getenv("MAX_WEIGHT", "10000.0")),
+            record_updates_path=os.getenv("RECORD_UPDATES") or None,
+            record_max_bytes=int(float(os.getenv("RECORD_MAX_MB", "50")) * 1024 * 1024),
+            record_backups=int(os.getenv("RECORD_BACKUPS", "5")),
+            history_retention_days=int(os.getenv("HISTORY_RETENTION_DAYS", "400")),
+            archive_dir=os.getenv("ARCHIVE_DIR") or None
         )
     
     def is_admin(self, user_id: int) -> bool:
@@ -1,28 +1,351 @@
 """
 Работа с базой данных
 """
+import itertools
+import json
 import logging
+import math
+import time
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import Optional, List, Tuple
+from dataclasses import replace
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, List, Sequence, Tuple
 
 import aiosqlite
 
+import ledger
+from analytics import BATCH_TEXT_RE, TAKE_TEXT_RE, TakeColumns
+from forecast import ConsumptionForecast
+from loader import Need, RenderData, plan
+from records import (
+    ArchivedBatch, BatchSnapshot, DayTotals, HistoryColumns, HistoryEntry, LedgerEvent, OpenBatch,
+    TenantConfig, TrackedMessage, UserTotals, columns, row_factory,
+)
+
 
 log = logging.getLogger(__name__)
 
+# Общий счётчик версий: значения уникальны между экземплярами Database,
+# поэтому ключи кэша рендеринга разных БД не пересекаются
+_version_seq = itertools.count(1)
+
+# Тенант - чат и топик в нём (0 - без топика). Строки однопользовательской
+# версии при миграции получают тенант LEGACY_CHAT_ID и потом переходят
+# первому зарегистрированному групповому чату (см. Database.get_tenant)
+LEGACY_CHAT_ID = 0
+NO_THREAD = 0
+
+_TENANT = "chat_id = ? AND thread_id = ?"
+
+
+class TakeResult(NamedTuple):
+    """Итог взятия порции (Database.take_portion)"""
+    cooked: float  # г готовой
+    raw_left: float  # г сырой в запасе после взятия
+    replayed: bool = False  # повтор по ключу идемпотентности: ничего не записано
+
+_SCHEMA = {
+    # Открытые партии (у тенанта их может быть несколько)
+    "batch": """
+        CREATE TABLE IF NOT EXISTS batch (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            raw_total REAL NOT NULL,
+            raw_left REAL NOT NULL,
+            cooked_total REAL NOT NULL,
+            coef REAL NOT NULL,
+            created TEXT NOT NULL,
+            note TEXT,
+            CHECK(raw_total > 0 AND cooked_total > 0 AND coef > 0 AND raw_left >= 0)
+        )
+    """,
+    # Закрытые партии: съеденные и удалённые
+    "batch_archive": """
+        CREATE TABLE IF NOT EXISTS batch_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER,
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            raw_total REAL NOT NULL,
+            raw_left REAL,
+            cooked_total REAL NOT NULL,
+            coef REAL NOT NULL,
+            created TEXT NOT NULL,
+            closed TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            note TEXT
+        )
+    """,
+    # Журнал запаса: строки только добавляются (см. ledger.py)
+    "ledger": """
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            op INTEGER,
+            kind TEXT NOT NULL,
+            batch_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            created TEXT NOT NULL,
+            user_id INTEGER,
+            history_id INTEGER
+        )
+    """,
+    # Снимки остатков по журналу (последнее учтённое событие и остатки в JSON)
+    "ledger_snapshot": """
+        CREATE TABLE IF NOT EXISTS ledger_snapshot (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            event_id INTEGER NOT NULL,
+            stock TEXT NOT NULL,
+            created TEXT NOT NULL,
+            PRIMARY KEY (chat_id, thread_id, event_id)
+        )
+    """,
+    # История операций
+    "history": """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_type TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created TEXT NOT NULL,
+            chat_id INTEGER NOT NULL DEFAULT 0,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER
+        )
+    """,
+    # Сообщения для автоудаления
+    "messages": """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            msg_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            created TEXT NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0
+        )
+    """,
+    # Частоты порций для быстрых кнопок (по чату: кнопки общие для его топиков)
+    "portion_freq": """
+        CREATE TABLE IF NOT EXISTS portion_freq (
+            chat_id INTEGER NOT NULL,
+            grams INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (chat_id, grams)
+        )
+    """,
+    # Дневные итоги для статистики (поддерживаются при каждой записи)
+    "daily_rollup": """
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            day TEXT NOT NULL,
+            taken REAL NOT NULL DEFAULT 0,
+            portions INTEGER NOT NULL DEFAULT 0,
+            batches INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, thread_id, day)
+        )
+    """,
+    # Дневные итоги по пользователям для личной статистики и рейтинга
+    "user_rollup": """
+        CREATE TABLE IF NOT EXISTS user_rollup (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            taken REAL NOT NULL DEFAULT 0,
+            portions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, thread_id, user_id, day)
+        )
+    """,
+    # Имена пользователей (последнее известное, общее для всех чатов)
+    "users": """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            updated TEXT NOT NULL
+        )
+    """,
+    # Ключи идемпотентности: повторная доставка того же взятия возвращает
+    # записанный результат (строки живут IDEMPOTENCY_TTL секунд)
+    "idempotency": """
+        CREATE TABLE IF NOT EXISTS idempotency (
+            key TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            expires REAL NOT NULL
+        )
+    """,
+    # Состояние прогноза расхода (строка на тенант)
+    "forecast": """
+        CREATE TABLE IF NOT EXISTS forecast (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            day TEXT,
+            day_total REAL NOT NULL,
+            level REAL NOT NULL,
+            season TEXT NOT NULL,
+            days_seen INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, thread_id)
+        )
+    """,
+    # Чаты и топики, которые обслуживает бот
+    "tenants": """
+        CREATE TABLE IF NOT EXISTS tenants (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            created TEXT NOT NULL,
+            pinned_msg_id INTEGER,
+            PRIMARY KEY (chat_id, thread_id)
+        )
+    """,
+}
+
+# Индексы под запросы одного тенанта (прогноз и итоги - по ключу таблицы)
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_batch_open ON batch(chat_id, thread_id, created, id)",
+    "CREATE INDEX IF NOT EXISTS idx_batch_archive_tenant ON batch_archive(chat_id, thread_id, created)",
+    "CREATE INDEX IF NOT EXISTS idx_history_tenant ON history(chat_id, thread_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_history_tenant_created ON history(chat_id, thread_id, created)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_tenant ON messages(chat_id, thread_id, id)",
+    # Рейтинг за окно читает только строки окна, не заходя в таблицу
+    "CREATE INDEX IF NOT EXISTS idx_user_rollup_day ON user_rollup(chat_id, thread_id, day, user_id, taken, portions)",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency(expires)",
+    "CREATE INDEX IF NOT EXISTS idx_ledger_tenant ON ledger(chat_id, thread_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_ledger_op ON ledger(op)",
+)
+
+# Миграции схемы: (номер, что меняет, метод Database с аргументом db).
+# Номер пишется в PRAGMA user_version вместе с миграцией, и init() на
+# актуальной БД обходится без DDL. Изменение схемы - новая строка в конце
+# со следующим номером; _SCHEMA и _INDEXES описывают конечный вид для новых
+# БД. Миграции 1-5 сами проверяют, нужны ли они: до user_version их
+# выполнял каждый запуск, и БД с версией 0 может быть в любом состоянии.
+_MIGRATIONS = (
+    (1, "несколько чатов", "_migrate_tenancy"),
+    (2, "несколько партий", "_migrate_batches"),
+    (3, "автор взятия в истории", "_migrate_users"),
+    (4, "журнал запаса", "_migrate_ledger"),
+    (5, "индексы", "_migrate_indexes"),
+)
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
 
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self, db_path: str, timezone_offset: int = 0):
+    # Частоты порций: вклад взятия убывает вдвое за PORTION_HALF_LIFE_DAYS
+    PORTION_HALF_LIFE_DAYS = 14
+    PORTION_STEP = 10  # порции округляются до 10 г, чтобы 198 и 200 считались одной
+    QUICK_PORTIONS = 4  # сколько частых порций хранить на чат
+    _FREQ_EPOCH = 1_700_000_000
+    
+    # Сколько помнить ключ идемпотентности: дольше двойного нажатия
+    # и перезапуска поллинга или рабочего шарда
+    IDEMPOTENCY_TTL = 3600
+    
+    # Хранение истории: строк в одной пачке переноса в архив и колонки
+    # строки архива (см. retention.py)
+    ARCHIVE_CHUNK = 5000
+    ARCHIVE_COLUMNS = ("id", "chat_id", "thread_id", "action_type", "text", "created", "user_id")
+    
+    # Удалить своё сообщение бот может только в первые 48 часов
+    MESSAGES_RETENTION_DAYS = 2
+    
+    EXPORT_PAGE = 1000  # строк в одной странице выгрузки (см. export.py)
+    
+    def __init__(
+        self,
+        db_path: str,
+        timezone_offset: int = 0,
+        chat_id: int = LEGACY_CHAT_ID,
+        thread_id: int = NO_THREAD
+    ):
         """
         Args:
             db_path: путь к файлу БД
             timezone_offset: смещение часового пояса от UTC в часах (например, +3 для MSK)
+            chat_id: чат, к которому относятся запросы экземпляра
+            thread_id: топик в чате (0 - без топика)
+        
+        Экземпляр работает с данными одного тенанта; экземпляры для других
+        чатов выдаёт for_tenant()
         """
         self.db_path = db_path
         self.timezone_offset = timezone_offset
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.tenant = (chat_id, thread_id)
+        
+        # Реестр тенантов и их настроек - общий, хранится у корневого экземпляра
+        self._root = self
+        self._scopes: Dict[Tuple[int, int], "Database"] = {self.tenant: self}
+        self._tenant_configs: Dict[Tuple[int, int], TenantConfig] = {}
+        self._legacy_thread_id: Optional[int] = None
+        self._legacy_pending = False
+        
+        # Версии состояния в памяти процесса: меняются при каждой записи
+        self.batch_version = next(_version_seq)
+        self.history_version = next(_version_seq)
+        # Номер последней записи в БД (любой таблицы); только растёт
+        self.write_seq = next(_version_seq)
+        
+        # Копия таблицы частот для загруженных чатов и их топ порций;
+        # обновляются в памяти при каждом взятии, без чтения из БД
+        self._portion_scores: Dict[int, Dict[int, float]] = {}
+        self._portions: Dict[int, Tuple[int, ...]] = {}
+        
+        # Копия строки таблицы forecast (загружается при первом обращении)
+        self._forecast: Optional[ConsumptionForecast] = None
+        
+        # Колонки взятий для аналитики (загружаются при первом обращении)
+        self._takes: Optional[TakeColumns] = None
+    
+    def for_tenant(self, chat_id: int, thread_id: int = NO_THREAD) -> "Database":
+        """
+        Экземпляр для чата и топика
+        
+        Создаётся один раз на тенант: у каждого свои версии, прогноз
+        и колонки аналитики в памяти, поэтому задержка запросов тенанта
+        не зависит от числа остальных
+        """
+        root = self._root
+        key = (chat_id, thread_id)
+        scoped = root._scopes.get(key)
+        if scoped is None:
+            scoped = Database(root.db_path, root.timezone_offset, chat_id, thread_id)
+            scoped._root = root
+            # Частоты порций общие для всех тенантов (portion_freq без chat_id)
+            scoped._portion_scores = root._portion_scores
+            scoped._portions = root._portions
+            root._scopes[key] = scoped
+        return scoped
+    
+    def _forget(self):
+        """Сбросить копии данных в памяти (строки тенанта изменены в обход экземпляра)"""
+        self._forecast = None
+        self._takes = None
+        self._bump(batch=True, history=True)
+    
+    @property
+    def versions(self) -> Tuple[int, int]:
+        """(версия партии, версия истории) - ключ для кэша рендеринга"""
+        return self.batch_version, self.history_version
+    
+    def _bump(self, batch: bool = False, history: bool = False):
+        """Отметить запись в БД: всегда write_seq, а также партию и/или историю"""
+        self.write_seq = next(_version_seq)
+        if batch:
+            self.batch_version = next(_version_seq)
+        if history:
+            self.history_version = next(_version_seq)
+    
+    def _bump_all(self, batch: bool = False, history: bool = False):
+        """_bump у всех загруженных тенантов (запись затронула строки разных чатов)"""
+        for scoped in self._root._scopes.values():
+            scoped._bump(batch=batch, history=history)
     
     @asynccontextmanager
     async def connection(self):
@@ -31,191 +354,1569 @@ class Database:
             db.row_factory = aiosqlite.Row
             yield db
     
-    async def init(self):
-        """Инициализация таблиц БД"""
+    @staticmethod
+    async def _select(
+        db: aiosqlite.Connection,
+        record: type,
+        sql: str,
+        params: Tuple = ()
+    ) -> aiosqlite.Cursor:
+        """
+        Запрос, строки которого собираются сразу в записи record
+        
+        {columns} в тексте запроса заменяется на колонки записи
+        """
+        cur = await db.execute(sql.format(columns=columns(record)), params)
+        cur.row_factory = row_factory(record)
+        return cur
+    
+    async def init(self, legacy_thread_id: Optional[int] = None):
+        """
+        Инициализация таблиц БД
+        
+        Версия схемы хранится в PRAGMA user_version: на актуальной БД
+        DDL не выполняется, иначе применяются недостающие миграции
+        
+        Args:
+            legacy_thread_id: TOPIC_ID - топик, которому достанутся данные
+                однопользовательской версии (None - первому групповому чату);
+                остальные новые тенанты при заданном топике регистрируются выключенными
+        
+        Raises:
+            RuntimeError: схема БД новее, чем знает этот код
+        """
+        self._legacy_thread_id = legacy_thread_id
         async with self.connection() as db:
-            # Таблица партий
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS batch (
-                    id INTEGER PRIMARY KEY,
-                    raw_total REAL NOT NULL,
-                    raw_left REAL NOT NULL,
-                    cooked_total REAL NOT NULL,
-                    coef REAL NOT NULL,
-                    created TEXT NOT NULL,
-                    note TEXT,
-                    pinned_msg_id INTEGER,
-                    CHECK(raw_total > 0 AND cooked_total > 0 AND coef > 0 AND raw_left >= 0)
+            cur = await db.execute("PRAGMA user_version")
+            version = (await cur.fetchone())[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"Схема БД v{version} новее, чем поддерживает бот (v{SCHEMA_VERSION}): обновите код"
                 )
-            """)
+            if version < SCHEMA_VERSION:
+                await self._upgrade(db, version)
             
-            # Таблица истории операций
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    action_type TEXT NOT NULL,
-                    text TEXT NOT NULL,
-                    created TEXT NOT NULL
-                )
-            """)
+            # Строки прежней версии ждут своего чата
+            cur = await db.execute(
+                f"""SELECT EXISTS(SELECT 1 FROM batch WHERE {_TENANT})
+                        OR EXISTS(SELECT 1 FROM history WHERE {_TENANT})""",
+                (LEGACY_CHAT_ID, NO_THREAD, LEGACY_CHAT_ID, NO_THREAD)
+            )
+            self._legacy_pending = bool((await cur.fetchone())[0])
             
-            # Таблица сообщений для автоудаления
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    msg_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    created TEXT NOT NULL
-                )
-            """)
+            if self._legacy_pending:
+                legacy = self.for_tenant(LEGACY_CHAT_ID, NO_THREAD)
+                await legacy._backfill_forecast(db)
+                await legacy._backfill_rollup(db)
             
-            # Создание индексов для оптимизации
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_history_created 
-                ON history(created DESC)
-            """)
+            await db.commit()
+            self._bump()
+            log.info(f"База данных инициализирована (схема v{SCHEMA_VERSION})")
+    
+    async def _upgrade(self, db: aiosqlite.Connection, version: int):
+        """
+        Довести схему с версии version до SCHEMA_VERSION
+        
+        Новая БД сразу создаётся в конечном виде по _SCHEMA и _INDEXES.
+        Иначе миграции из _MIGRATIONS применяются по порядку, каждая в своей
+        транзакции вместе с записью user_version: прерванное обновление
+        продолжится с первой незавершённой миграции.
+        """
+        if version == 0:
+            # Режим auto_vacuum меняется только до первой таблицы или через VACUUM
+            await self._enable_incremental_vacuum(db)
             
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_created 
-                ON messages(created DESC)
-            """)
+            cur = await db.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table')")
+            fresh = not (await cur.fetchone())[0]
+            # БД без user_version: новая или любой прежней версии - недостающие
+            # таблицы нужны миграциям в конечном виде
+            for ddl in _SCHEMA.values():
+                await db.execute(ddl)
             
+            if fresh:
+                for ddl in _INDEXES:
+                    await db.execute(ddl)
+                await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                await db.commit()
+                log.info(f"Создана схема БД v{SCHEMA_VERSION}")
+                return
+        
+        pending = [m for m in _MIGRATIONS if m[0] > version]
+        log.info(f"Обновление схемы БД v{version} → v{SCHEMA_VERSION}, миграций: {len(pending)}")
+        for number, title, method in pending:
+            started = time.perf_counter()
+            # Явный BEGIN: иначе DDL миграции выполнялся бы вне транзакции
+            await db.execute("BEGIN")
+            await getattr(self, method)(db)
+            await db.execute(f"PRAGMA user_version = {number}")
             await db.commit()
-            log.info("База данных инициализирована")
+            log.info(f"Миграция {number}/{SCHEMA_VERSION} ({title}): {time.perf_counter() - started:.2f} с")
+    
+    @staticmethod
+    async def _enable_incremental_vacuum(db: aiosqlite.Connection):
+        """
+        Включить auto_vacuum = INCREMENTAL, чтобы место от удалённых строк
+        истории возвращалось без полного VACUUM
+        
+        У существующей БД режим меняется только через VACUUM - он
+        выполняется один раз, до создания таблиц и начала транзакции
+        """
+        cur = await db.execute("PRAGMA auto_vacuum")
+        if (await cur.fetchone())[0] == 2:
+            return
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+        log.info("Включён auto_vacuum = INCREMENTAL")
+    
+    async def _migrate_tenancy(self, db: aiosqlite.Connection):
+        """
+        Перевести таблицы однопользовательской версии на ключ (chat_id, thread_id)
+        
+        Старые строки получают тенант LEGACY_CHAT_ID. Таблицы с изменившимся
+        первичным ключом пересоздаются, в остальные добавляются колонки.
+        Сообщения уже хранят свой чат - им достаётся топик legacy_thread_id из init.
+        """
+        cur = await db.execute("PRAGMA table_info(batch)")
+        if "chat_id" in {row["name"] for row in await cur.fetchall()}:
+            return
+        
+        log.info("Миграция БД на несколько чатов...")
+        rebuilt = {
+            "daily_rollup": "day, taken, portions, batches",
+            "forecast": "day, day_total, level, season, days_seen",
+        }
+        for table, fields in rebuilt.items():
+            await db.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+            await db.execute(_SCHEMA[table])
+            await db.execute(
+                f"INSERT INTO {table} (chat_id, thread_id, {fields}) "
+                f"SELECT {LEGACY_CHAT_ID}, {NO_THREAD}, {fields} FROM {table}_v1"
+            )
+            await db.execute(f"DROP TABLE {table}_v1")
+        
+        # batch пересоздаётся в _migrate_batches
+        for table in ("batch", "history"):
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN chat_id INTEGER NOT NULL DEFAULT 0")
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN thread_id INTEGER NOT NULL DEFAULT 0")
+        await db.execute("ALTER TABLE messages ADD COLUMN thread_id INTEGER NOT NULL DEFAULT 0")
+        if self._legacy_thread_id:
+            await db.execute("UPDATE messages SET thread_id = ?", (self._legacy_thread_id,))
+        
+        # Глобальные индексы заменены индексами по тенанту
+        await db.execute("DROP INDEX IF EXISTS idx_history_created")
+        await db.execute("DROP INDEX IF EXISTS idx_messages_created")
+        log.info("Миграция БД на несколько чатов завершена")
+    
+    async def _migrate_batches(self, db: aiosqlite.Connection):
+        """
+        Перейти от одной партии на тенант к нескольким открытым и архиву
+        
+        Снимается ограничение «одна партия на чат», закреп переезжает
+        в tenants, а прежние партии восстанавливаются в batch_archive
+        из записей истории «Новая партия».
+        """
+        cur = await db.execute("PRAGMA table_info(tenants)")
+        if "pinned_msg_id" not in {row["name"] for row in await cur.fetchall()}:
+            await db.execute("ALTER TABLE tenants ADD COLUMN pinned_msg_id INTEGER")
+        
+        cur = await db.execute("PRAGMA table_info(batch)")
+        if "pinned_msg_id" not in {row["name"] for row in await cur.fetchall()}:
+            return
+        
+        log.info("Миграция БД на несколько партий...")
+        await db.execute("ALTER TABLE batch RENAME TO batch_v2")
+        await db.execute(_SCHEMA["batch"])
+        fields = "id, chat_id, thread_id, raw_total, raw_left, cooked_total, coef, created, note"
+        await db.execute(f"INSERT INTO batch ({fields}) SELECT {fields} FROM batch_v2")
+        
+        # Закреп - у тенанта, а не у партии (у старых данных тенанта в tenants нет)
+        await db.execute(
+            """INSERT OR IGNORE INTO tenants (chat_id, thread_id, enabled, created)
+               SELECT chat_id, thread_id, 1, created FROM batch_v2 WHERE pinned_msg_id IS NOT NULL"""
+        )
+        await db.execute(
+            """UPDATE tenants SET pinned_msg_id = (
+                   SELECT b.pinned_msg_id FROM batch_v2 b
+                   WHERE b.chat_id = tenants.chat_id AND b.thread_id = tenants.thread_id
+               )
+               WHERE EXISTS (
+                   SELECT 1 FROM batch_v2 b
+                   WHERE b.chat_id = tenants.chat_id AND b.thread_id = tenants.thread_id
+                     AND b.pinned_msg_id IS NOT NULL
+               )"""
+        )
+        await db.execute("DROP TABLE batch_v2")
+        
+        archived = await self._backfill_archive(db)
+        log.info(f"Миграция БД на несколько партий завершена, в архиве {archived} партий из истории")
+    
+    async def _migrate_users(self, db: aiosqlite.Connection):
+        """
+        Добавить в историю автора взятия
+        
+        У старых записей автор неизвестен (user_id NULL): они остаются
+        в общей статистике, но не попадают в user_rollup и рейтинг.
+        """
+        cur = await db.execute("PRAGMA table_info(history)")
+        if "user_id" not in {row["name"] for row in await cur.fetchall()}:
+            await db.execute("ALTER TABLE history ADD COLUMN user_id INTEGER")
+            log.info("В историю добавлена колонка user_id")
+    
+    async def _migrate_ledger(self, db: aiosqlite.Connection):
+        """
+        Начать журнал запаса для БД, где партии уже есть
+        
+        Прежние изменения остатка не восстановить, поэтому открытые партии
+        каждого тенанта записываются начальным снимком (event_id 0) -
+        события журнала проигрываются поверх него.
+        """
+        cur = await db.execute(
+            "SELECT EXISTS(SELECT 1 FROM ledger) OR EXISTS(SELECT 1 FROM ledger_snapshot)"
+        )
+        if (await cur.fetchone())[0]:
+            return
+        
+        cur = await db.execute("SELECT chat_id, thread_id, id, raw_left FROM batch")
+        stocks: Dict[Tuple[int, int], ledger.Stock] = {}
+        for row in await cur.fetchall():
+            stocks.setdefault((row["chat_id"], row["thread_id"]), {})[row["id"]] = row["raw_left"]
+        if not stocks:
+            return
+        
+        created = self._now()
+        await db.executemany(
+            "INSERT INTO ledger_snapshot (chat_id, thread_id, event_id, stock, created) VALUES (?, ?, 0, ?, ?)",
+            [(*tenant, ledger.dump(stock), created) for tenant, stock in stocks.items()]
+        )
+        log.info(f"Журнал запаса начат со снимка открытых партий: {len(stocks)} тенант(ов)")
+    
+    async def _migrate_indexes(self, db: aiosqlite.Connection):
+        """Создать индексы _INDEXES, которых ещё нет"""
+        for ddl in _INDEXES:
+            await db.execute(ddl)
+    
+    async def _backfill_archive(self, db: aiosqlite.Connection) -> int:
+        """
+        Восстановить закрытые партии по истории (в транзакции вызывающего)
+        
+        Раньше новая партия удаляла прежнюю: партия закрыта следующей
+        записью «Новая партия» (replaced) или «Партия удалена» (reset).
+        Остаток на момент закрытия неизвестен.
+        """
+        cur = await db.execute("SELECT chat_id, thread_id, created, raw_total FROM batch")
+        open_batches = {(r["chat_id"], r["thread_id"], r["created"], r["raw_total"]) for r in await cur.fetchall()}
+        
+        cur = await db.execute(
+            """SELECT chat_id, thread_id, action_type, text, created FROM history
+               WHERE action_type IN ('new_batch', 'reset')
+               ORDER BY chat_id, thread_id, created, id"""
+        )
+        rows = []
+        pending = None  # (тенант, строка архива без closed и reason)
+        for row in await cur.fetchall():
+            tenant = (row["chat_id"], row["thread_id"])
+            if pending is not None:
+                if pending[0] != tenant:
+                    # Последняя партия тенанта, но не открытая - время закрытия неизвестно
+                    rows.append((*pending[1], pending[1][-1], "replaced"))
+                else:
+                    reason = "replaced" if row["action_type"] == "new_batch" else "reset"
+                    rows.append((*pending[1], row["created"], reason))
+                pending = None
+            if row["action_type"] != "new_batch":
+                continue
+            match = BATCH_TEXT_RE.match(row["text"])
+            if not match:
+                continue
+            raw, cooked, coef, note = match.groups()
+            if (*tenant, row["created"], float(raw)) in open_batches:
+                continue
+            pending = (tenant, (*tenant, float(raw), float(cooked), float(coef), note, row["created"]))
+        if pending is not None:
+            rows.append((*pending[1], pending[1][-1], "replaced"))
+        
+        if rows:
+            await db.executemany(
+                """INSERT INTO batch_archive
+                   (chat_id, thread_id, raw_total, cooked_total, coef, note, created, closed, reason)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+        return len(rows)
+    
+    # ─────────────────── ТЕНАНТЫ ───────────────────
+    
+    async def get_tenant(self, chat_id: int, thread_id: int = NO_THREAD) -> Optional[TenantConfig]:
+        """
+        Настройки чата/топика; новый тенант регистрируется включённым,
+        только если он в топике legacy_thread_id или топик не задан
+        (остальные включает админ командой /enable)
+        
+        Настройки читаются из БД один раз и дальше берутся из памяти.
+        Первый групповой чат (в топике legacy_thread_id, если он задан)
+        получает данные однопользовательской версии.
+        
+        Returns:
+            TenantConfig или None при ошибке БД
+        """
+        root = self._root
+        key = (chat_id, thread_id)
+        config = root._tenant_configs.get(key)
+        if config is not None:
+            return config
+        
+        adopted = False
+        try:
+            async with self.connection() as db:
+                config = await self._tenant_config(db, key)
+                if config is None:
+                    created = self._now()
+                    enabled = root._enabled_by_default(thread_id)
+                    cur = await db.execute(
+                        "INSERT OR IGNORE INTO tenants (chat_id, thread_id, enabled, created) VALUES (?, ?, ?, ?)",
+                        (chat_id, thread_id, int(enabled), created)
+                    )
+                    config = TenantConfig(chat_id, thread_id, enabled, created)
+                    if cur.rowcount and root._takes_legacy(chat_id, thread_id):
+                        await self._adopt_legacy(db, chat_id, thread_id)
+                        config = await self._tenant_config(db, key)
+                        adopted = True
+                    await db.commit()
+                    log.info(
+                        f"Новый тенант: чат {chat_id}, топик {thread_id}"
+                        + ("" if enabled else " (выключен до /enable)")
+                    )
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении настроек тенанта: {e}")
+            return None
+        
+        if adopted:
+            root._legacy_pending = False
+            for tenant in ((LEGACY_CHAT_ID, NO_THREAD), key):
+                scoped = root._scopes.get(tenant)
+                if scoped is not None:
+                    scoped._forget()
+        root._tenant_configs[key] = config
+        return config
+    
+    async def _tenant_config(self, db: aiosqlite.Connection, key: Tuple[int, int]) -> Optional[TenantConfig]:
+        cur = await self._select(db, TenantConfig, f"SELECT {{columns}} FROM tenants WHERE {_TENANT}", key)
+        return await cur.fetchone()
+    
+    def _enabled_by_default(self, thread_id: int) -> bool:
+        """Включать ли новый тенант сразу: как прежний фильтр по TOPIC_ID"""
+        return self._legacy_thread_id is None or thread_id == self._legacy_thread_id
+    
+    def _takes_legacy(self, chat_id: int, thread_id: int) -> bool:
+        """Должен ли новый тенант получить данные однопользовательской версии"""
+        if not self._legacy_pending or chat_id >= 0:
+            return False
+        return self._legacy_thread_id is None or thread_id == self._legacy_thread_id
+    
+    async def _adopt_legacy(self, db: aiosqlite.Connection, chat_id: int, thread_id: int):
+        """Передать строки тенанта LEGACY_CHAT_ID новому тенанту (в транзакции вызывающего)"""
+        for table in (
+            "batch", "batch_archive", "ledger", "ledger_snapshot", "history", "daily_rollup", "user_rollup", "forecast",
+        ):
+            await db.execute(
+                f"UPDATE {table} SET chat_id = ?, thread_id = ? WHERE {_TENANT}",
+                (chat_id, thread_id, LEGACY_CHAT_ID, NO_THREAD)
+            )
+        await db.execute(
+            f"UPDATE tenants SET pinned_msg_id = ? WHERE {_TENANT}",
+            (await self._legacy_pinned(db), chat_id, thread_id)
+        )
+        await db.execute(f"DELETE FROM tenants WHERE {_TENANT}", (LEGACY_CHAT_ID, NO_THREAD))
+        log.info(f"Данные прежней версии переданы чату {chat_id}, топик {thread_id}")
+    
+    @staticmethod
+    async def _legacy_pinned(db: aiosqlite.Connection) -> Optional[int]:
+        """Закреп данных прежней версии (перенесён в tenants при миграции)"""
+        cur = await db.execute(
+            f"SELECT pinned_msg_id FROM tenants WHERE {_TENANT}",
+            (LEGACY_CHAT_ID, NO_THREAD)
+        )
+        row = await cur.fetchone()
+        return row["pinned_msg_id"] if row else None
+    
+    async def adopt_legacy(self) -> Optional[Tuple[int, int]]:
+        """
+        Передать данные однопользовательской версии её групповому чату заранее
+        
+        Нужно перед разбиением на шарды: иначе строки LEGACY_CHAT_ID ждут
+        первого сообщения из группы, а оно может прийти в другой шард.
+        Чат берётся из сообщений бота, которые старая версия хранила
+        вместе с chat_id (в топике legacy_thread_id, если он задан).
+        
+        Returns:
+            (chat_id, thread_id) получателя или None - данных нет, чат
+            неизвестен или ошибка БД
+        """
+        root = self._root
+        if not root._legacy_pending:
+            return None
+        
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    """SELECT chat_id, thread_id FROM messages
+                       WHERE chat_id < 0 AND (? IS NULL OR thread_id = ?)
+                       ORDER BY id DESC LIMIT 1""",
+                    (root._legacy_thread_id, root._legacy_thread_id)
+                )
+                row = await cur.fetchone()
+                if row is None:
+                    return None
+                key = (row["chat_id"], row["thread_id"])
+                
+                await db.execute(
+                    "INSERT OR IGNORE INTO tenants (chat_id, thread_id, enabled, created) VALUES (?, ?, 1, ?)",
+                    (*key, self._now())
+                )
+                await self._adopt_legacy(db, *key)
+                await db.commit()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при передаче данных прежней версии: {e}")
+            return None
+        
+        root._legacy_pending = False
+        root._tenant_configs.pop(key, None)
+        for tenant in ((LEGACY_CHAT_ID, NO_THREAD), key):
+            scoped = root._scopes.get(tenant)
+            if scoped is not None:
+                scoped._forget()
+        self._bump()
+        return key
+    
+    async def set_tenant_enabled(self, enabled: bool) -> bool:
+        """Включить или выключить бота в чате/топике этого экземпляра"""
+        try:
+            async with self.connection() as db:
+                await db.execute(
+                    f"UPDATE tenants SET enabled = ? WHERE {_TENANT}",
+                    (int(enabled), *self.tenant)
+                )
+                await db.commit()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при изменении настроек тенанта: {e}")
+            return False
+        
+        root = self._root
+        config = root._tenant_configs.get(self.tenant)
+        if config is not None:
+            root._tenant_configs[self.tenant] = replace(config, enabled=enabled)
+        self._bump()
+        log.info(f"Тенант {self.tenant}: {'включён' if enabled else 'выключен'}")
+        return True
     
     # ─────────────────── ПАРТИИ ───────────────────
     
-    async def get_batch(self) -> Optional[aiosqlite.Row]:
-        """Получить текущую партию"""
+    async def _insert_history(
+        self,
+        db: aiosqlite.Connection,
+        action_type: str,
+        text: str,
+        created: str,
+        user_id: Optional[int] = None
+    ) -> int:
+        """Запись в историю тенанта (в транзакции вызывающего); возвращает id записи"""
+        cur = await db.execute(
+            "INSERT INTO history (chat_id, thread_id, action_type, text, created, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (*self.tenant, action_type, text, created, user_id)
+        )
+        return cur.lastrowid
+    
+    async def _open_batches(self, db: aiosqlite.Connection) -> List[OpenBatch]:
+        """Открытые партии тенанта в порядке списания (по индексу idx_batch_open)"""
+        cur = await self._select(
+            db, OpenBatch,
+            f"SELECT {{columns}} FROM batch WHERE {_TENANT} ORDER BY created, id",
+            self.tenant
+        )
+        return await cur.fetchall()
+    
+    async def _pinned_msg_id(self, db: aiosqlite.Connection) -> Optional[int]:
+        """Закреп тенанта: из настроек в памяти или из tenants"""
+        config = self._root._tenant_configs.get(self.tenant)
+        if config is None:
+            config = await self._tenant_config(db, self.tenant)
+        return config.pinned_msg_id if config else None
+    
+    async def _load_stock(self, db: aiosqlite.Connection) -> Optional[BatchSnapshot]:
+        batches = await self._open_batches(db)
+        if not batches:
+            return None
+        return BatchSnapshot.from_batches(batches, await self._pinned_msg_id(db))
+    
+    async def _archive(
+        self,
+        db: aiosqlite.Connection,
+        closed: str,
+        reason: str,
+        batch_id: Optional[int] = None
+    ) -> int:
+        """
+        Перенести партию (или все открытые партии тенанта) в batch_archive
+        (в транзакции вызывающего)
+        
+        Returns:
+            int: сколько партий закрыто
+        """
+        if batch_id is None:
+            where, params = _TENANT, self.tenant
+        else:
+            where, params = "id = ?", (batch_id,)
+        await db.execute(
+            f"""INSERT INTO batch_archive
+                (batch_id, chat_id, thread_id, raw_total, raw_left, cooked_total, coef, created, note, closed, reason)
+                SELECT id, chat_id, thread_id, raw_total, raw_left, cooked_total, coef, created, note, ?, ?
+                FROM batch WHERE {where}""",
+            (closed, reason, *params)
+        )
+        cur = await db.execute(f"DELETE FROM batch WHERE {where}", params)
+        return cur.rowcount
+    
+    async def get_batch(self) -> Optional[BatchSnapshot]:
+        """Получить текущий запас: открытые партии одной записью"""
         try:
             async with self.connection() as db:
-                cur = await db.execute("SELECT * FROM batch WHERE id = 1")
-                return await cur.fetchone()
+                return await self._load_stock(db)
         except aiosqlite.Error as e:
             log.error(f"Ошибка при получении партии: {e}")
             return None
     
+    async def get_open_batches(self) -> List[OpenBatch]:
+        """Открытые партии по порядку списания (самая старая первой)"""
+        try:
+            async with self.connection() as db:
+                return await self._open_batches(db)
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении партий: {e}")
+            return []
+    
+    async def get_batch_archive(self, limit: int = 10) -> List[ArchivedBatch]:
+        """Закрытые партии, новые первыми"""
+        try:
+            async with self.connection() as db:
+                cur = await self._select(
+                    db, ArchivedBatch,
+                    f"SELECT {{columns}} FROM batch_archive WHERE {_TENANT} ORDER BY created DESC, id DESC LIMIT ?",
+                    (*self.tenant, limit)
+                )
+                return await cur.fetchall()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении архива партий: {e}")
+            return []
+    
     async def create_batch(self, raw_total: float, cooked_total: float, note: str = None) -> bool:
-        """Создать новую партию"""
+        """Создать новую партию (открытые партии остаются и расходуются первыми)"""
         try:
             coef = cooked_total / raw_total
-            created = self._now()
+            now = self.local_now()
+            created = now.strftime("%Y-%m-%d %H:%M:%S")
             
             async with self.connection() as db:
-                await db.execute("DELETE FROM batch")
-                await db.execute(
-                    """INSERT INTO batch (id, raw_total, raw_left, cooked_total, coef, created, note, pinned_msg_id) 
-                       VALUES (1, ?, ?, ?, ?, ?, ?, NULL)""",
-                    (raw_total, raw_total, cooked_total, coef, created, note)
+                cur = await db.execute(
+                    """INSERT INTO batch (chat_id, thread_id, raw_total, raw_left, cooked_total, coef, created, note) 
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (*self.tenant, raw_total, raw_total, cooked_total, coef, created, note)
                 )
+                batch_id = cur.lastrowid
                 
                 # Записать в историю в той же транзакции
                 note_text = f" ({note})" if note else ""
-                await db.execute(
-                    "INSERT INTO history (action_type, text, created) VALUES (?, ?, ?)",
-                    ("new_batch", f"Новая партия: {int(raw_total)}г сырой → {int(cooked_total)}г готовой (к={coef:.3f}){note_text}", self._now())
+                history_id = await self._insert_history(db, "new_batch", f"Новая партия: {int(raw_total)}г сырой → {int(cooked_total)}г готовой (к={coef:.3f}){note_text}", created)
+                await self._add_rollup(db, now, batches=1)
+                
+                event_id = await self._append_event(
+                    db, ledger.BATCH_CREATED, batch_id, raw_total, created, history_id=history_id
                 )
+                await self._snapshot_if_due(db, event_id, created)
                 
                 await db.commit()
                 
+            self._bump(batch=True, history=True)
+            if self._takes is not None:
+                self._takes.add_batch(created)
             log.info(f"Создана партия: сырая={raw_total}г, готовая={cooked_total}г, к={coef:.3f}, заметка={note}")
             return True
         except aiosqlite.Error as e:
             log.error(f"Ошибка при создании партии: {e}")
             return False
     
-    async def update_raw_left(self, new_value: float) -> bool:
-        """Обновить остаток сырой курицы"""
+    async def update_raw_left(self, new_value: float, batch_id: Optional[int] = None) -> bool:
+        """
+        Обновить остаток сырой курицы партии (по умолчанию - самой старой открытой)
+        
+        В журнал пишется поправка на разницу со старым остатком
+        """
         try:
             async with self.connection() as db:
-                await db.execute(
-                    "UPDATE batch SET raw_left = ? WHERE id = 1",
-                    (new_value,)
+                cur = await db.execute(
+                    f"""SELECT id, raw_left FROM batch WHERE {_TENANT} AND id = COALESCE(?, (
+                            SELECT id FROM batch WHERE {_TENANT} ORDER BY created, id LIMIT 1
+                        ))""",
+                    (*self.tenant, batch_id, *self.tenant)
                 )
+                row = await cur.fetchone()
+                if row is None:
+                    return True
+                
+                await db.execute("UPDATE batch SET raw_left = ? WHERE id = ?", (new_value, row["id"]))
+                created = self._now()
+                event_id = await self._append_event(db, ledger.ADJUST, row["id"], new_value - row["raw_left"], created)
+                await self._snapshot_if_due(db, event_id, created)
                 await db.commit()
+            self._bump(batch=True)
             return True
         except aiosqlite.Error as e:
             log.error(f"Ошибка при обновлении остатка: {e}")
             return False
     
-    async def take_portion(self, raw_amount: float) -> Optional[Tuple[float, float]]:
+    async def take_portion(
+        self,
+        raw_amount: float,
+        chat_id: int = None,
+        batch_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        user_name: Optional[str] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Optional[TakeResult]:
         """
         Взять порцию
-        Возвращает (готовая_порция, новый_остаток) или None при ошибке
+        Возвращает TakeResult (готовая порция, новый остаток запаса) или None при ошибке
+        
+        Порция списывается с открытых партий по порядку создания (FIFO),
+        каждая часть - со своим коэффициентом; опустевшая партия уходит
+        в архив. С batch_id порция берётся только из этой партии.
+        
+        Если передан chat_id, порция учитывается в частотах быстрых кнопок чата.
+        Если передан user_id, взятие записывается на пользователя: в историю
+        и в его дневные итоги (user_rollup), а user_name обновляет его имя.
+        
+        С idempotency_key взятие выполняется не больше одного раза за
+        IDEMPOTENCY_TTL: повтор с тем же ключом (повторная доставка апдейта,
+        двойное нажатие) возвращает записанный результат с replayed=True
+        и ничего не пишет
         """
         try:
             async with self.connection() as db:
-                cur = await db.execute("SELECT raw_left, coef FROM batch WHERE id = 1")
-                row = await cur.fetchone()
+                if idempotency_key is not None:
+                    recorded = await self._claim_key(db, idempotency_key)
+                    if recorded is not None:
+                        log.info(
+                            "Повтор взятия %s, возвращён записанный результат", idempotency_key,
+                            extra={"route": "db:take"}
+                        )
+                        return TakeResult(*recorded, replayed=True)
                 
-                if not row:
+                batches = await self._open_batches(db)
+                
+                if not batches:
                     log.warning("Партия не найдена")
                     return None
                 
-                raw_left = row["raw_left"]
-                coef = row["coef"]
+                sources = batches if batch_id is None else [b for b in batches if b.id == batch_id]
+                raw_left = sum(b.raw_left for b in sources)
                 
                 if raw_amount > raw_left:
                     log.warning(f"Недостаточно сырой: запрошено {raw_amount}г, доступно {raw_left}г")
                     return None
                 
-                cooked_portion = raw_amount * coef
-                new_raw_left = raw_left - raw_amount
+                now = self.local_now()
+                created = now.strftime("%Y-%m-%d %H:%M:%S")
                 
-                await db.execute(
-                    "UPDATE batch SET raw_left = ? WHERE id = 1",
-                    (new_raw_left,)
-                )
+                # Части порции по партиям
+                parts = []
+                remaining = raw_amount
+                for batch in sources:
+                    if remaining <= 0:
+                        break
+                    part = min(batch.raw_left, remaining)
+                    remaining -= part
+                    parts.append((batch, part))
+                cooked_portion = sum(part * batch.coef for batch, part in parts)
+                
+                new_raw_left = sum(b.raw_left for b in batches) - raw_amount
                 
                 # Записать в историю в той же транзакции
-                await db.execute(
-                    "INSERT INTO history (action_type, text, created) VALUES (?, ?, ?)",
-                    ("take", f"Взято: {int(raw_amount)}г сырой → {int(cooked_portion)}г готовой", self._now())
+                history_id = await self._insert_history(
+                    db, "take", f"Взято: {int(raw_amount)}г сырой → {int(cooked_portion)}г готовой", created,
+                    user_id=user_id
                 )
                 
+                # Проекция и журнал: событие на каждую партию, одна операция
+                op = event_id = None
+                for batch, part in parts:
+                    await db.execute(
+                        "UPDATE batch SET raw_left = ? WHERE id = ?",
+                        (batch.raw_left - part, batch.id)
+                    )
+                    event_id = await self._append_event(
+                        db, ledger.TAKE, batch.id, part, created,
+                        op=op, user_id=user_id, history_id=history_id
+                    )
+                    op = op or event_id
+                    if batch.raw_left - part <= 0:
+                        await self._archive(db, created, "finished", batch.id)
+                await self._snapshot_if_due(db, event_id, created)
+                
+                await self._add_rollup(db, now, taken=raw_amount, portions=1)
+                if user_id is not None:
+                    await self._add_user_rollup(db, now, user_id, raw_amount)
+                    if user_name:
+                        await self._save_user(db, user_id, user_name, created)
+                
+                forecast = (await self._load_forecast(db)).copy()
+                forecast.observe(now, raw_amount)
+                await self._save_forecast(db, forecast)
+                
+                counted = None
+                if chat_id is not None:
+                    counted = await self._count_portion(db, chat_id, raw_amount)
+                
+                if idempotency_key is not None:
+                    await self._record_key(db, idempotency_key, (cooked_portion, new_raw_left))
+                
                 await db.commit()
+                self._bump(batch=True, history=True)
+                self._forecast = forecast
+                if self._takes is not None:
+                    self._takes.add_take(created, float(int(raw_amount)), user_id or 0)
+                if counted:
+                    self._apply_portion(chat_id, *counted)
                 
-                log.info(f"Взято {raw_amount}г, осталось {new_raw_left}г")
-                return cooked_portion, new_raw_left
+                log.info(
+                    "Взято %sг, осталось %sг", raw_amount, new_raw_left,
+                    extra={"route": "db:take"}
+                )
+                return TakeResult(cooked_portion, new_raw_left)
                 
         except aiosqlite.Error as e:
             log.error(f"Ошибка при взятии порции: {e}")
             return None
     
+    async def _claim_key(self, db: aiosqlite.Connection, key: str) -> Optional[Tuple[float, float]]:
+        """
+        Занять ключ идемпотентности (первой записью транзакции вызывающего)
+        
+        Запись сразу берёт блокировку БД, поэтому параллельная доставка
+        того же апдейта ждёт commit первой и видит её результат. Ключ
+        с истёкшим сроком занимается заново.
+        
+        Returns:
+            None - ключ занят этим вызовом, иначе записанный результат
+        """
+        now = time.time()
+        cur = await db.execute(
+            """INSERT INTO idempotency (key, chat_id, thread_id, expires) VALUES (?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   chat_id = excluded.chat_id,
+                   thread_id = excluded.thread_id,
+                   result = NULL,
+                   expires = excluded.expires
+               WHERE idempotency.expires < ?""",
+            (key, *self.tenant, now + self.IDEMPOTENCY_TTL, now)
+        )
+        if cur.rowcount:
+            return None
+        cur = await db.execute("SELECT result FROM idempotency WHERE key = ?", (key,))
+        row = await cur.fetchone()
+        first, second = json.loads(row["result"])
+        return first, second
+    
+    @staticmethod
+    async def _record_key(db: aiosqlite.Connection, key: str, result: Tuple[float, float]):
+        """Сохранить результат под занятым ключом (перед commit вызывающего)"""
+        await db.execute("UPDATE idempotency SET result = ? WHERE key = ?", (json.dumps(result), key))
+    
+    async def sweep_idempotency_keys(self) -> int:
+        """
+        Удалить ключи идемпотентности с истёкшим сроком (всех тенантов)
+        
+        Returns:
+            int: сколько удалено (0 при ошибке)
+        """
+        try:
+            async with self.connection() as db:
+                cur = await db.execute("DELETE FROM idempotency WHERE expires < ?", (time.time(),))
+                await db.commit()
+                swept = cur.rowcount
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при очистке ключей идемпотентности: {e}")
+            return 0
+        
+        if swept:
+            self._bump()
+            log.info(f"Удалено ключей идемпотентности: {swept}")
+        return swept
+    
+    async def archive_history(
+        self,
+        days: int,
+        sink: Callable[[List[Tuple]], Awaitable[None]],
+        chunk: int = ARCHIVE_CHUNK
+    ) -> int:
+        """
+        Перенести записи истории старше days дней в архив (всех тенантов)
+        
+        Строки выбираются пачками по chunk в порядке id, отдаются sink и
+        только после этого удаляются; транзакция закрывается после каждой
+        пачки, чтобы не держать блокировку записи. Дневные итоги, рейтинг
+        и журнал запаса не трогаются. Освобождённые страницы в конце
+        возвращаются файлу через incremental_vacuum.
+        
+        Args:
+            days: горизонт хранения; остаются записи за последние days дней
+            sink: сохраняет пачку строк с колонками ARCHIVE_COLUMNS;
+                OSError в sink прерывает перенос, пачка остаётся в БД
+            chunk: строк в пачке
+        
+        Returns:
+            int: сколько записей перенесено
+        """
+        before = self._window_start(days)
+        archived = 0
+        try:
+            async with self.connection() as db:
+                while True:
+                    cur = await db.execute(
+                        f"SELECT {', '.join(self.ARCHIVE_COLUMNS)} FROM history WHERE created < ? ORDER BY id LIMIT ?",
+                        (before, chunk)
+                    )
+                    rows = [tuple(row) for row in await cur.fetchall()]
+                    if not rows:
+                        break
+                    
+                    await sink(rows)
+                    # Выбранные строки - ровно строки старше границы в диапазоне их id
+                    await db.execute(
+                        "DELETE FROM history WHERE id BETWEEN ? AND ? AND created < ?",
+                        (rows[0][0], rows[-1][0], before)
+                    )
+                    await db.commit()
+                    archived += len(rows)
+                    if len(rows) < chunk:
+                        break
+                
+                if archived:
+                    # execute делает один шаг - одну страницу; executescript доводит до конца
+                    await db.executescript("PRAGMA incremental_vacuum")
+        except (aiosqlite.Error, OSError) as e:
+            log.error(f"Ошибка при переносе истории в архив: {e}")
+        
+        if archived:
+            # Кэши рендеринга тенантов привязаны к их версиям истории
+            self._bump_all(history=True)
+            log.info(f"Перенесено в архив записей истории: {archived}")
+        return archived
+    
+    async def prune_messages(self, days: int = MESSAGES_RETENTION_DAYS) -> int:
+        """
+        Забыть сообщения бота старше days дней (всех тенантов)
+        
+        Такие сообщения бот уже не может удалить, а строки копятся
+        в чатах, где давно не было новых
+        
+        Returns:
+            int: сколько строк удалено (0 при ошибке)
+        """
+        before = (self.local_now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            async with self.connection() as db:
+                cur = await db.execute("DELETE FROM messages WHERE created < ?", (before,))
+                await db.commit()
+                pruned = cur.rowcount
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при очистке старых сообщений: {e}")
+            return 0
+        
+        if pruned:
+            self._bump_all()
+            log.info(f"Удалено записей о старых сообщениях: {pruned}")
+        return pruned
+    
+    async def iter_export(
+        self,
+        table: str,
+        names: Sequence[str],
+        key: Sequence[str],
+        page: int = EXPORT_PAGE
+    ) -> AsyncIterator[Tuple]:
+        """
+        Строки таблицы тенанта по одной, по возрастанию key
+        
+        Таблица читается страницами по page строк: следующая страница
+        начинается после ключа последней строки. Каждая страница - свой
+        короткий запрос, поэтому выгрузка большой истории не держит
+        блокировку чтения между страницами, а в памяти не больше page строк.
+        
+        Args:
+            table: таблица с колонками chat_id и thread_id
+            names: колонки строки
+            key: уникальный в тенанте ключ порядка, колонки из names
+        """
+        key_at = [names.index(column) for column in key]
+        order = ", ".join(key)
+        after: Tuple = ()
+        async with self.connection() as db:
+            while True:
+                where = _TENANT
+                if after:
+                    where += f" AND ({order}) > ({', '.join('?' * len(key))})"
+                cur = await db.execute(
+                    f"SELECT {', '.join(names)} FROM {table} WHERE {where} ORDER BY {order} LIMIT ?",
+                    (*self.tenant, *after, page)
+                )
+                rows = await cur.fetchmany(page)
+                await cur.close()
+                for row in rows:
+                    yield tuple(row)
+                if len(rows) < page:
+                    return
+                after = tuple(rows[-1][i] for i in key_at)
+    
     async def reset_batch(self) -> bool:
-        """Очистить текущую партию"""
+        """Закрыть все открытые партии (в архив с причиной reset)"""
         try:
             async with self.connection() as db:
-                await db.execute("DELETE FROM batch")
+                closed = self._now()
+                event_id = None
+                for batch in await self._open_batches(db):
+                    event_id = await self._append_event(db, ledger.RESET, batch.id, batch.raw_left, closed)
+                count = await self._archive(db, closed, "reset")
+                if event_id is not None:
+                    await self._snapshot_if_due(db, event_id, closed)
                 
                 # Записать в историю в той же транзакции
-                await db.execute(
-                    "INSERT INTO history (action_type, text, created) VALUES (?, ?, ?)",
-                    ("reset", "Партия удалена", self._now())
-                )
+                text = "Партия удалена" if count <= 1 else f"Партии удалены: {count}"
+                await self._insert_history(db, "reset", text, closed)
                 
                 await db.commit()
                 
-            log.info("Партия удалена")
+            self._bump(batch=True, history=True)
+            log.info(f"Удалено партий: {count}")
             return True
         except aiosqlite.Error as e:
             log.error(f"Ошибка при удалении партии: {e}")
             return False
     
-    async def update_pinned_msg_id(self, msg_id: int) -> bool:
-        """Обновить ID закреплённого сообщения"""
+    async def get_pinned_msg_id(self) -> Optional[int]:
+        """ID сообщения со статусом в чате/топике"""
+        try:
+            async with self.connection() as db:
+                return await self._pinned_msg_id(db)
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении pinned_msg_id: {e}")
+            return None
+    
+    async def update_pinned_msg_id(self, msg_id: Optional[int]) -> bool:
+        """Обновить ID закреплённого сообщения (одно на тенант, общее для всех партий)"""
         try:
             async with self.connection() as db:
                 await db.execute(
-                    "UPDATE batch SET pinned_msg_id = ? WHERE id = 1",
-                    (msg_id,)
+                    """INSERT INTO tenants (chat_id, thread_id, enabled, created, pinned_msg_id) VALUES (?, ?, 1, ?, ?)
+                       ON CONFLICT(chat_id, thread_id) DO UPDATE SET pinned_msg_id = excluded.pinned_msg_id""",
+                    (*self.tenant, self._now(), msg_id)
                 )
                 await db.commit()
-            log.info(f"Обновлён ID закреплённого сообщения: {msg_id}")
-            return True
         except aiosqlite.Error as e:
             log.error(f"Ошибка при обновлении pinned_msg_id: {e}")
             return False
+        
+        root = self._root
+        config = root._tenant_configs.get(self.tenant)
+        if config is not None:
+            root._tenant_configs[self.tenant] = replace(config, pinned_msg_id=msg_id)
+        self._bump()
+        log.info(f"Обновлён ID закреплённого сообщения: {msg_id}")
+        return True
+    
+    # ─────────────────── ЖУРНАЛ ЗАПАСА ───────────────────
+    
+    async def _append_event(
+        self,
+        db: aiosqlite.Connection,
+        kind: str,
+        batch_id: int,
+        amount: float,
+        created: str,
+        op: Optional[int] = None,
+        user_id: Optional[int] = None,
+        history_id: Optional[int] = None
+    ) -> int:
+        """
+        Дописать событие в журнал (в транзакции вызывающего)
+        
+        Без op событие начинает новую операцию: op - его собственный id
+        
+        Returns:
+            int: id события
+        """
+        cur = await db.execute(
+            """INSERT INTO ledger (chat_id, thread_id, op, kind, batch_id, amount, created, user_id, history_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (*self.tenant, op, kind, batch_id, amount, created, user_id, history_id)
+        )
+        event_id = cur.lastrowid
+        if op is None:
+            await db.execute("UPDATE ledger SET op = id WHERE id = ?", (event_id,))
+        return event_id
+    
+    async def _replay_stock(self, db: aiosqlite.Connection) -> Tuple[ledger.Stock, int, int]:
+        """
+        Остатки по журналу: последний снимок и события после него
+        
+        Returns:
+            tuple: (партия → остаток, id последнего события, сколько событий проиграно)
+        """
+        cur = await db.execute(
+            f"SELECT event_id, stock FROM ledger_snapshot WHERE {_TENANT} ORDER BY event_id DESC LIMIT 1",
+            self.tenant
+        )
+        row = await cur.fetchone()
+        last_id, stock = (row["event_id"], ledger.load(row["stock"])) if row else (0, {})
+        
+        cur = await self._select(
+            db, LedgerEvent,
+            f"SELECT {{columns}} FROM ledger WHERE {_TENANT} AND id > ? ORDER BY id",
+            (*self.tenant, last_id)
+        )
+        events = await cur.fetchall()
+        if events:
+            last_id = events[-1].id
+        return ledger.replay(events, stock), last_id, len(events)
+    
+    async def _snapshot_if_due(self, db: aiosqlite.Connection, event_id: int, created: str):
+        """
+        Снять снимок остатков, если после прошлого набралось SNAPSHOT_EVERY событий
+        (в транзакции вызывающего, после записи события event_id)
+        """
+        cur = await db.execute(
+            f"""SELECT COUNT(*) FROM ledger WHERE {_TENANT} AND id > COALESCE(
+                    (SELECT MAX(event_id) FROM ledger_snapshot WHERE {_TENANT}), 0
+                )""",
+            (*self.tenant, *self.tenant)
+        )
+        if (await cur.fetchone())[0] < ledger.SNAPSHOT_EVERY:
+            return
+        
+        stock, last_id, _ = await self._replay_stock(db)
+        await db.execute(
+            "INSERT OR REPLACE INTO ledger_snapshot (chat_id, thread_id, event_id, stock, created) VALUES (?, ?, ?, ?, ?)",
+            (*self.tenant, last_id, ledger.dump(stock), created)
+        )
+    
+    async def get_ledger(self, limit: int = 20) -> List[LedgerEvent]:
+        """Последние события журнала запаса, новые первыми"""
+        try:
+            async with self.connection() as db:
+                cur = await self._select(
+                    db, LedgerEvent,
+                    f"SELECT {{columns}} FROM ledger WHERE {_TENANT} ORDER BY id DESC LIMIT ?",
+                    (*self.tenant, limit)
+                )
+                return await cur.fetchall()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении журнала запаса: {e}")
+            return []
+    
+    async def rebuild_stock(self) -> Optional[Tuple[int, int]]:
+        """
+        Пересобрать остатки открытых партий (batch.raw_left) по журналу
+        
+        Проигрываются только события после последнего снимка. Партии,
+        которых нет в журнале (открытые до его появления и без снимка),
+        не трогаются.
+        
+        Returns:
+            tuple: (проиграно событий, исправлено партий) или None при ошибке БД
+        """
+        try:
+            async with self.connection() as db:
+                stock, _, replayed = await self._replay_stock(db)
+                fixed = 0
+                for batch in await self._open_batches(db):
+                    expected = stock.get(batch.id)
+                    if expected is None or math.isclose(expected, batch.raw_left, abs_tol=1e-6):
+                        continue
+                    log.warning(f"Остаток партии {batch.id} расходится с журналом: {batch.raw_left} → {expected}")
+                    await db.execute("UPDATE batch SET raw_left = ? WHERE id = ?", (max(expected, 0.0), batch.id))
+                    fixed += 1
+                await db.commit()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при пересборке остатков по журналу: {e}")
+            return None
+        
+        if fixed:
+            self._bump(batch=True)
+        log.info(f"Остатки пересобраны по журналу: событий {replayed}, исправлено партий {fixed}")
+        return replayed, fixed
+    
+    async def undo_last_take(
+        self,
+        user_id: Optional[int] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Отменить последнее взятие (ещё не отменённое)
+        
+        Сырая возвращается в партии, из которых была взята; съеденная
+        партия возвращается из архива. Запись истории о взятии помечается
+        take_undone, дневные итоги уменьшаются. Прогноз расхода и частоты
+        порций не откатываются - это сглаженные оценки.
+        
+        Args:
+            user_id: отменить последнее взятие этого пользователя (None - любое)
+            idempotency_key: как у take_portion
+        
+        Returns:
+            (возвращено_сырой, новый_остаток_запаса) или None, если отменять нечего
+        """
+        try:
+            async with self.connection() as db:
+                if idempotency_key is not None:
+                    recorded = await self._claim_key(db, idempotency_key)
+                    if recorded is not None:
+                        return recorded
+                
+                user_filter = "" if user_id is None else "AND user_id = ?"
+                cur = await db.execute(
+                    f"""SELECT op FROM ledger l WHERE {_TENANT} AND kind = ? {user_filter}
+                          AND NOT EXISTS (SELECT 1 FROM ledger u WHERE u.op = l.op AND u.kind = ?)
+                        ORDER BY id DESC LIMIT 1""",
+                    (*self.tenant, ledger.TAKE, *(() if user_id is None else (user_id,)), ledger.UNDO)
+                )
+                row = await cur.fetchone()
+                if row is None:
+                    return None
+                op = row["op"]
+                
+                cur = await self._select(
+                    db, LedgerEvent,
+                    "SELECT {columns} FROM ledger WHERE op = ? AND kind = ? ORDER BY id",
+                    (op, ledger.TAKE)
+                )
+                parts = await cur.fetchall()
+                cur = await db.execute("SELECT history_id FROM ledger WHERE id = ?", (op,))
+                history_id = (await cur.fetchone())["history_id"]
+                
+                now = self.local_now()
+                created = now.strftime("%Y-%m-%d %H:%M:%S")
+                open_ids = {b.id for b in await self._open_batches(db)}
+                restored = 0.0
+                event_id = None
+                for part in parts:
+                    if part.batch_id in open_ids:
+                        await db.execute(
+                            "UPDATE batch SET raw_left = raw_left + ? WHERE id = ?",
+                            (part.amount, part.batch_id)
+                        )
+                    elif not await self._unarchive(db, part.batch_id, part.amount):
+                        # Партия удалена после взятия - возвращать некуда
+                        continue
+                    event_id = await self._append_event(
+                        db, ledger.UNDO, part.batch_id, part.amount, created, op=op, user_id=part.user_id
+                    )
+                    restored += part.amount
+                
+                if event_id is None:
+                    log.warning(f"Взятие {op} не отменено: его партии удалены")
+                    return None
+                
+                # Вычитается возвращённое: взятое из удалённой партии остаётся съеденным
+                day = parts[0].created[:10]
+                await db.execute(
+                    f"UPDATE daily_rollup SET taken = taken - ?, portions = portions - 1 WHERE {_TENANT} AND day = ?",
+                    (restored, *self.tenant, day)
+                )
+                if parts[0].user_id is not None:
+                    await db.execute(
+                        f"""UPDATE user_rollup SET taken = taken - ?, portions = portions - 1
+                            WHERE {_TENANT} AND user_id = ? AND day = ?""",
+                        (restored, *self.tenant, parts[0].user_id, day)
+                    )
+                if history_id is not None:
+                    await db.execute(
+                        "UPDATE history SET action_type = 'take_undone' WHERE id = ?", (history_id,)
+                    )
+                await self._insert_history(db, "undo", f"Отменено взятие: {int(restored)}г сырой", created, user_id=user_id)
+                await self._snapshot_if_due(db, event_id, created)
+                
+                new_raw_left = sum(b.raw_left for b in await self._open_batches(db))
+                if idempotency_key is not None:
+                    await self._record_key(db, idempotency_key, (restored, new_raw_left))
+                
+                await db.commit()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при отмене взятия: {e}")
+            return None
+        
+        self._bump(batch=True, history=True)
+        self._takes = None
+        log.info(f"Отменено взятие {op}: возвращено {restored}г, осталось {new_raw_left}г")
+        return restored, new_raw_left
+    
+    async def _unarchive(self, db: aiosqlite.Connection, batch_id: int, raw_left: float) -> bool:
+        """Вернуть съеденную партию из архива с остатком raw_left (в транзакции вызывающего)"""
+        cur = await db.execute(
+            f"""INSERT INTO batch (id, chat_id, thread_id, raw_total, raw_left, cooked_total, coef, created, note)
+                SELECT batch_id, chat_id, thread_id, raw_total, ?, cooked_total, coef, created, note
+                FROM batch_archive WHERE {_TENANT} AND batch_id = ? AND reason = 'finished'""",
+            (raw_left, *self.tenant, batch_id)
+        )
+        if not cur.rowcount:
+            return False
+        await db.execute(
+            f"DELETE FROM batch_archive WHERE {_TENANT} AND batch_id = ? AND reason = 'finished'",
+            (*self.tenant, batch_id)
+        )
+        return True
+    
+    # ─────────────────── ЧАСТЫЕ ПОРЦИИ ───────────────────
+    
+    async def _count_portion(
+        self,
+        db: aiosqlite.Connection,
+        chat_id: int,
+        grams: float
+    ) -> Optional[Tuple[int, float]]:
+        """
+        Учесть порцию в таблице частот (в транзакции вызывающего)
+        
+        Используется прямое затухание: вес взятия растёт со временем
+        как 2^(t / полураспад), поэтому старые записи не нужно пересчитывать -
+        порядок сумм совпадает с порядком затухающих частот.
+        
+        Returns:
+            (порция, вес) для _apply_portion после commit или None
+        """
+        step = self.PORTION_STEP
+        grams = int(round(grams / step) * step)
+        if grams <= 0:
+            return None
+        
+        half_life = self.PORTION_HALF_LIFE_DAYS * 86400
+        weight = math.pow(2.0, (time.time() - self._FREQ_EPOCH) / half_life)
+        
+        await db.execute(
+            """INSERT INTO portion_freq (chat_id, grams, score) VALUES (?, ?, ?)
+               ON CONFLICT(chat_id, grams) DO UPDATE SET score = score + excluded.score""",
+            (chat_id, grams, weight)
+        )
+        return grams, weight
+    
+    def _apply_portion(self, chat_id: int, grams: int, weight: float):
+        """Повторить запись в копии таблицы частот и пересчитать топ чата"""
+        scores = self._portion_scores.get(chat_id)
+        if scores is None:
+            # Чат ещё не загружен - прочитается целиком при первом запросе
+            return
+        scores[grams] = scores.get(grams, 0.0) + weight
+        self._portions[chat_id] = self._top_portions(scores)
+    
+    def _top_portions(self, scores: Dict[int, float]) -> Tuple[int, ...]:
+        return tuple(sorted(scores, key=scores.__getitem__, reverse=True)[:self.QUICK_PORTIONS])
+    
+    async def get_quick_portions(self, chat_id: int) -> Tuple[int, ...]:
+        """
+        Самые частые порции чата (до QUICK_PORTIONS, по убыванию частоты)
+        
+        Таблица частот чата читается один раз, дальше поддерживается
+        в памяти из take_portion
+        """
+        cached = self._portions.get(chat_id)
+        if cached is not None:
+            return cached
+        
+        # Взятие во время запроса меняет batch_version - тогда не кэшируем
+        version = self.batch_version
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    "SELECT grams, score FROM portion_freq WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                scores = {row["grams"]: row["score"] for row in await cur.fetchall()}
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении частых порций: {e}")
+            return ()
+        
+        portions = self._top_portions(scores)
+        if version == self.batch_version:
+            self._portion_scores[chat_id] = scores
+            self._portions[chat_id] = portions
+        return portions
+    
+    # ─────────────────── ПРОГНОЗ ───────────────────
+    
+    async def _load_forecast(self, db: aiosqlite.Connection) -> ConsumptionForecast:
+        """Состояние прогноза из памяти или из таблицы forecast"""
+        if self._forecast is None:
+            cur = await db.execute(f"SELECT * FROM forecast WHERE {_TENANT}", self.tenant)
+            row = await cur.fetchone()
+            self._forecast = ConsumptionForecast.from_row(row) if row else ConsumptionForecast()
+        return self._forecast
+    
+    async def _save_forecast(self, db: aiosqlite.Connection, forecast: ConsumptionForecast):
+        await db.execute(
+            """INSERT OR REPLACE INTO forecast (chat_id, thread_id, day, day_total, level, season, days_seen)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (*self.tenant, *forecast.to_row())
+        )
+    
+    async def _backfill_forecast(self, db: aiosqlite.Connection):
+        """Однократно восстановить прогноз из истории взятий (для старых БД)"""
+        cur = await db.execute(f"SELECT 1 FROM forecast WHERE {_TENANT}", self.tenant)
+        if await cur.fetchone():
+            return
+        
+        forecast = ConsumptionForecast()
+        cur = await db.execute(
+            f"SELECT text, created FROM history WHERE {_TENANT} AND action_type = 'take' ORDER BY created, id",
+            self.tenant
+        )
+        async for row in cur:
+            match = TAKE_TEXT_RE.match(row["text"])
+            if not match:
+                continue
+            try:
+                when = datetime.strptime(row["created"], "%Y-%m-%d %H:%M:%S")
+                forecast.observe(when, float(match.group(1)))
+            except ValueError:
+                continue
+        
+        await self._save_forecast(db, forecast)
+        self._forecast = forecast
+        log.info(f"Прогноз восстановлен из истории: {forecast.days_seen} дн., {forecast.level:.0f} г/день")
+    
+    async def get_forecast(self) -> Optional[ConsumptionForecast]:
+        """
+        Текущее состояние прогноза расхода
+        
+        Returns:
+            ConsumptionForecast: копия из памяти (история не читается) или None при ошибке
+        """
+        if self._forecast is not None:
+            return self._forecast
+        try:
+            async with self.connection() as db:
+                return await self._load_forecast(db)
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении прогноза: {e}")
+            return None
+    
+    # ─────────────────── ДНЕВНЫЕ ИТОГИ ───────────────────
+    
+    async def _add_rollup(
+        self,
+        db: aiosqlite.Connection,
+        when: datetime,
+        taken: float = 0.0,
+        portions: int = 0,
+        batches: int = 0
+    ):
+        """Прибавить к итогам дня (в транзакции вызывающего)"""
+        await db.execute(
+            """INSERT INTO daily_rollup (chat_id, thread_id, day, taken, portions, batches) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(chat_id, thread_id, day) DO UPDATE SET
+                   taken = taken + excluded.taken,
+                   portions = portions + excluded.portions,
+                   batches = batches + excluded.batches""",
+            (*self.tenant, when.strftime("%Y-%m-%d"), taken, portions, batches)
+        )
+    
+    async def _backfill_rollup(self, db: aiosqlite.Connection):
+        """Однократно построить итоги из истории (для старых БД)"""
+        cur = await db.execute(f"SELECT 1 FROM daily_rollup WHERE {_TENANT} LIMIT 1", self.tenant)
+        if await cur.fetchone():
+            return
+        
+        days: Dict[str, List[float]] = {}
+        cur = await db.execute(
+            f"SELECT action_type, text, created FROM history WHERE {_TENANT} AND action_type IN ('take', 'new_batch')",
+            self.tenant
+        )
+        async for row in cur:
+            day = days.setdefault(row["created"][:10], [0.0, 0, 0])
+            if row["action_type"] == "new_batch":
+                day[2] += 1
+                continue
+            match = TAKE_TEXT_RE.match(row["text"])
+            if match:
+                day[0] += float(match.group(1))
+                day[1] += 1
+        
+        if days:
+            await db.executemany(
+                "INSERT INTO daily_rollup (chat_id, thread_id, day, taken, portions, batches) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*self.tenant, day, *totals) for day, totals in days.items()]
+            )
+            log.info(f"Дневные итоги восстановлены из истории: {len(days)} дн.")
+    
+    # ─────────────────── ПОЛЬЗОВАТЕЛИ ───────────────────
+    
+    async def _add_user_rollup(self, db: aiosqlite.Connection, when: datetime, user_id: int, taken: float):
+        """Прибавить взятие к итогам дня пользователя (в транзакции вызывающего)"""
+        await db.execute(
+            """INSERT INTO user_rollup (chat_id, thread_id, user_id, day, taken, portions) VALUES (?, ?, ?, ?, ?, 1)
+               ON CONFLICT(chat_id, thread_id, user_id, day) DO UPDATE SET
+                   taken = taken + excluded.taken,
+                   portions = portions + 1""",
+            (*self.tenant, user_id, when.strftime("%Y-%m-%d"), taken)
+        )
+    
+    @staticmethod
+    async def _save_user(db: aiosqlite.Connection, user_id: int, name: str, updated: str):
+        """Запомнить имя пользователя (в транзакции вызывающего)"""
+        await db.execute(
+            """INSERT INTO users (user_id, name, updated) VALUES (?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, updated = excluded.updated
+               WHERE name != excluded.name""",
+            (user_id, name, updated)
+        )
+    
+    def _window_start(self, days: int) -> str:
+        """Первый день окна из days календарных дней, включая сегодня"""
+        return (self.local_now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    
+    async def get_leaderboard(self, days: int = 7, limit: Optional[int] = None) -> List[UserTotals]:
+        """
+        Рейтинг пользователей тенанта по съеденному за последние days дней
+        
+        Читаются только строки user_rollup за окно (по индексу
+        idx_user_rollup_day): их не больше «пользователи × days»,
+        сколько бы ни было истории.
+        
+        Args:
+            days: окно в календарных днях, включая сегодня
+            limit: сколько мест вернуть (None - всех)
+        
+        Returns:
+            list: по убыванию съеденного; пустой при ошибке
+        """
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    """SELECT r.user_id, COALESCE(u.name, ''), SUM(r.taken), SUM(r.portions)
+                        FROM user_rollup r LEFT JOIN users u ON u.user_id = r.user_id
+                        WHERE r.chat_id = ? AND r.thread_id = ? AND r.day >= ?
+                        GROUP BY r.user_id
+                        HAVING SUM(r.portions) > 0
+                        ORDER BY SUM(r.taken) DESC, SUM(r.portions) DESC, r.user_id
+                        LIMIT ?""",
+                    (*self.tenant, self._window_start(days), -1 if limit is None else limit)
+                )
+                cur.row_factory = row_factory(UserTotals)
+                return await cur.fetchall()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении рейтинга: {e}")
+            return []
+    
+    async def get_user_totals(self, user_id: int, days: int = 30) -> Optional[UserTotals]:
+        """
+        Итоги пользователя в тенанте за последние days дней
+        
+        Returns:
+            UserTotals (нули, если взятий не было) или None при ошибке БД
+        """
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    f"""SELECT ?, COALESCE((SELECT name FROM users WHERE user_id = ?), ''),
+                               COALESCE(SUM(taken), 0), COALESCE(SUM(portions), 0)
+                        FROM user_rollup WHERE {_TENANT} AND user_id = ? AND day >= ?""",
+                    (user_id, user_id, *self.tenant, user_id, self._window_start(days))
+                )
+                cur.row_factory = row_factory(UserTotals)
+                return await cur.fetchone()
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении статистики пользователя: {e}")
+            return None
+    
+    # ─────────────────── АНАЛИТИКА ───────────────────
+    
+    async def get_takes(self) -> TakeColumns:
+        """
+        Все взятия по колонкам (для analytics.Analytics)
+        
+        История читается один раз, дальше колонки дописываются в памяти
+        из take_portion и create_batch
+        """
+        if self._takes is not None:
+            return self._takes
+        
+        # Запись во время чтения меняет history_version - тогда не кэшируем
+        version = self.history_version
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    f"""SELECT action_type, text, created, user_id FROM history
+                        WHERE {_TENANT} AND action_type IN ('take', 'new_batch') ORDER BY created, id""",
+                    self.tenant
+                )
+                cur.row_factory = None
+                takes = TakeColumns.from_history(await cur.fetchall())
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при загрузке взятий для аналитики: {e}")
+            return TakeColumns()
+        
+        if version == self.history_version:
+            self._takes = takes
+        return takes
+    
+    # ─────────────────── ЗАГРУЗКА ДЛЯ РЕНДЕРИНГА ───────────────────
+    
+    async def load(self, needs: Iterable[Need]) -> RenderData:
+        """
+        Загрузить всё, что объявил рендерер, за одно подключение
+        
+        Args:
+            needs: потребности из loader (BATCH, FORECAST, history(n), rollup(d))
+        
+        Returns:
+            RenderData: при ошибке БД - с пустыми полями
+        """
+        wanted = plan(needs)
+        now = self.local_now()
+        data = RenderData(now)
+        
+        # Прогноз обычно уже в памяти - тогда подключение ради него не нужно
+        if wanted.forecast and self._forecast is not None:
+            data.forecast = self._forecast
+            wanted = wanted._replace(forecast=False)
+        
+        if not any(wanted):
+            return data
+        
+        try:
+            async with self.connection() as db:
+                if wanted.batch:
+                    data.batch = await self._load_stock(db)
+                
+                if wanted.forecast:
+                    data.forecast = await self._load_forecast(db)
+                
+                if wanted.history_limit:
+                    cur = await self._select(
+                        db, HistoryEntry,
+                        f"SELECT {{columns}} FROM history WHERE {_TENANT} ORDER BY id DESC LIMIT ?",
+                        (*self.tenant, wanted.history_limit)
+                    )
+                    data.history = await cur.fetchall()
+                
+                if wanted.rollup_days:
+                    cutoff = (now - timedelta(days=wanted.rollup_days - 1)).strftime("%Y-%m-%d")
+                    cur = await self._select(
+                        db, DayTotals,
+                        f"SELECT {{columns}} FROM daily_rollup WHERE {_TENANT} AND day >= ?",
+                        (*self.tenant, cutoff)
+                    )
+                    data.rollup = {row.day: row for row in await cur.fetchall()}
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при загрузке данных для рендеринга: {e}")
+        
+        return data
     
     # ─────────────────── ИСТОРИЯ ───────────────────
     
@@ -223,33 +1924,62 @@ class Database:
         """Добавить запись в историю"""
         try:
             async with self.connection() as db:
-                await db.execute(
-                    "INSERT INTO history (action_type, text, created) VALUES (?, ?, ?)",
-                    (action_type, text, self._now())
-                )
+                await self._insert_history(db, action_type, text, self._now())
                 await db.commit()
+            self._bump(history=True)
+            if action_type in ("take", "new_batch"):
+                # Текст записи произвольный - колонки перечитаются из истории
+                self._takes = None
         except aiosqlite.Error as e:
             log.error(f"Ошибка при добавлении в историю: {e}")
     
-    async def get_history(self, limit: int = 10) -> List[aiosqlite.Row]:
+    async def get_history(self, limit: int = 10) -> List[HistoryEntry]:
         """Получить последние записи истории"""
         try:
             async with self.connection() as db:
-                cur = await db.execute(
-                    "SELECT * FROM history ORDER BY id DESC LIMIT ?",
-                    (limit,)
+                cur = await self._select(
+                    db, HistoryEntry,
+                    f"SELECT {{columns}} FROM history WHERE {_TENANT} ORDER BY id DESC LIMIT ?",
+                    (*self.tenant, limit)
                 )
                 return await cur.fetchall()
         except aiosqlite.Error as e:
             log.error(f"Ошибка при получении истории: {e}")
             return []
     
+    async def get_history_columns(self, limit: int = 1000) -> HistoryColumns:
+        """
+        Последние записи истории по колонкам - для анализа больших выборок
+        
+        Строки не превращаются в отдельные объекты: кортежи сразу
+        раскладываются в колонки HistoryColumns
+        """
+        try:
+            async with self.connection() as db:
+                cur = await db.execute(
+                    f"SELECT id, action_type, text, created FROM history WHERE {_TENANT} ORDER BY id DESC LIMIT ?",
+                    (*self.tenant, limit)
+                )
+                cur.row_factory = None
+                return HistoryColumns.from_rows(await cur.fetchall())
+        except aiosqlite.Error as e:
+            log.error(f"Ошибка при получении истории: {e}")
+            return HistoryColumns()
+    
     async def clear_history(self) -> bool:
-        """Очистить историю"""
+        """
+        Очистить историю
+        
+        Удаляется только лента операций. Дневные итоги, рейтинг, архив
+        партий и журнал запаса остаются: по ним считается статистика,
+        а /undo возвращает взятие из съеденной партии через архив.
+        """
         try:
             async with self.connection() as db:
-                await db.execute("DELETE FROM history")
+                await db.execute(f"DELETE FROM history WHERE {_TENANT}", self.tenant)
                 await db.commit()
+            self._bump(history=True)
+            self._takes = None
             log.info("История очищена")
             return True
         except aiosqlite.Error as e:
@@ -263,26 +1993,24 @@ class Database:
         try:
             async with self.connection() as db:
                 await db.execute(
-                    "INSERT INTO messages (msg_id, chat_id, created) VALUES (?, ?, ?)",
-                    (msg_id, chat_id, self._now())
+                    "INSERT INTO messages (msg_id, chat_id, thread_id, created) VALUES (?, ?, ?, ?)",
+                    (msg_id, chat_id, self.thread_id, self._now())
                 )
                 await db.commit()
+            self._bump()
         except aiosqlite.Error as e:
             log.error(f"Ошибка при добавлении сообщения: {e}")
     
-    async def get_old_messages(self, keep_count: int = 5) -> List[Tuple[int, int, int]]:
-        """Получить старые сообщения для удаления (id, msg_id, chat_id)"""
+    async def get_old_messages(self, keep_count: int = 5) -> List[TrackedMessage]:
+        """Получить старые сообщения для удаления (все, кроме keep_count последних)"""
         try:
             async with self.connection() as db:
-                cur = await db.execute(
-                    "SELECT id, msg_id, chat_id FROM messages ORDER BY id DESC"
+                cur = await self._select(
+                    db, TrackedMessage,
+                    f"SELECT {{columns}} FROM messages WHERE {_TENANT} ORDER BY id DESC LIMIT -1 OFFSET ?",
+                    (*self.tenant, keep_count)
                 )
-                rows = await cur.fetchall()
-                
-                if len(rows) <= keep_count:
-                    return []
-                
-                return [(r["id"], r["msg_id"], r["chat_id"]) for r in rows[keep_count:]]
+                return await cur.fetchall()
         except aiosqlite.Error as e:
             log.error(f"Ошибка при получении старых сообщений: {e}")
             return []
@@ -293,6 +2021,7 @@ class Database:
             async with self.connection() as db:
                 await db.execute("DELETE FROM messages WHERE id = ?", (record_id,))
                 await db.commit()
+            self._bump()
         except aiosqlite.Error as e:
             log.error(f"Ошибка при удалении записи сообщения: {e}")
     
@@ -300,8 +2029,9 @@ class Database:
         """Очистить все записи сообщений"""
         try:
             async with self.connection() as db:
-                await db.execute("DELETE FROM messages")
+                await db.execute(f"DELETE FROM messages WHERE {_TENANT}", self.tenant)
                 await db.commit()
+            self._bump()
             return True
         except aiosqlite.Error as e:
             log.error(f"Ошибка при очистке сообщений: {e}")
@@ -309,9 +2039,10 @@ class Database:
     
     # ─────────────────── УТИЛИТЫ ───────────────────
     
+    def local_now(self) -> datetime:
+        """Текущее локальное время с учётом часового пояса"""
+        return datetime.now() + timedelta(hours=self.timezone_offset)
+    
     def _now(self) -> str:
         """Текущая дата и время с учётом часового пояса"""
-        from datetime import timedelta
-        utc_now = datetime.now()
-        local_now = utc_now + timedelta(hours=self.timezone_offset)
-        return local_now.strftime("%Y-%m-%d %H:%M:%S")
+        return self.local_now().strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,312 @@
+"""
+Выгрузка данных тенанта
+
+Наборы (история, партии, архив партий, дневные итоги, итоги по
+пользователям) читаются из БД страницами через Database.iter_export и
+пишутся в gzip-файл пачками по CHUNK строк. Пачку сжимает рабочий поток,
+пока из БД читается следующая, поэтому в памяти не больше двух пачек
+при любом размере истории.
+
+Форматы: csv, jsonl и col - компактный колоночный:
+    
+    b"CHKCOL1\\n", JSON-заголовок {"columns": [[имя, тип], ...]} и b"\\n"
+    группы строк: b"G", число строк n (uint32), затем по колонкам:
+        флаг NULL (uint8); при 1 - n байт маски (1 - NULL);
+        int - n × int64 разностей с предыдущим значением (первое - с 0),
+        float - n × float64,
+        text - кодировка (uint8): 0 - n длин (uint32) и байты UTF-8 подряд,
+            1 - словарь: k (uint16), k длин и байты k строк, n номеров (uint16)
+    b"E" в конце
+
+Числа little-endian, файл целиком сжат gzip. Разности id, словари
+типов операций и одинаковые длины строк gzip сжимает почти в ноль.
+Прочитать - read_columnar().
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import aiosqlite
+
+from database import Database
+
+
+log = logging.getLogger(__name__)
+
+CHUNK = 1000  # строк в пачке на сжатие
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """Набор для выгрузки: таблица, колонки с типами (int, float, text) и ключ порядка"""
+    table: str
+    columns: Tuple[Tuple[str, str], ...]
+    key: Tuple[str, ...]
+    
+    @property
+    def names(self) -> List[str]:
+        return [name for name, _ in self.columns]
+
+
+DATASETS: Dict[str, Dataset] = {
+    "history": Dataset(
+        "history",
+        (("id", "int"), ("action_type", "text"), ("text", "text"), ("created", "text"), ("user_id", "int")),
+        ("id",),
+    ),
+    "batches": Dataset(
+        "batch",
+        (("id", "int"), ("raw_total", "float"), ("raw_left", "float"), ("cooked_total", "float"),
+         ("coef", "float"), ("created", "text"), ("note", "text")),
+        ("id",),
+    ),
+    "batch_archive": Dataset(
+        "batch_archive",
+        (("id", "int"), ("batch_id", "int"), ("raw_total", "float"), ("raw_left", "float"),
+         ("cooked_total", "float"), ("coef", "float"), ("created", "text"), ("closed", "text"),
+         ("reason", "text"), ("note", "text")),
+        ("id",),
+    ),
+    "daily_rollup": Dataset(
+        "daily_rollup",
+        (("day", "text"), ("taken", "float"), ("portions", "int"), ("batches", "int")),
+        ("day",),
+    ),
+    # Ключ в порядке первичного ключа таблицы
+    "user_rollup": Dataset(
+        "user_rollup",
+        (("user_id", "int"), ("day", "text"), ("taken", "float"), ("portions", "int")),
+        ("user_id", "day"),
+    ),
+}
+
+
+# ─────────────────── ФОРМАТЫ ───────────────────
+
+# У писателей форматов (WRITERS) общий вид: конструктор (out, dataset),
+# write(rows) на каждую пачку и finish() в конце; вызываются из рабочего потока
+
+class CsvWriter:
+    """CSV с заголовком из имён колонок"""
+    
+    extension = "csv"
+    
+    def __init__(self, out: BinaryIO, dataset: Dataset):
+        self.text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+        self.csv = csv.writer(self.text)
+        self.csv.writerow(dataset.names)
+    
+    def write(self, rows: List[Tuple]):
+        self.csv.writerows(rows)
+    
+    def finish(self):
+        # Поток gzip закрывает вызывающий
+        self.text.flush()
+        self.text.detach()
+
+
+class JsonlWriter:
+    """Объект JSON на строку"""
+    
+    extension = "jsonl"
+    
+    def __init__(self, out: BinaryIO, dataset: Dataset):
+        self.out = out
+        self.names = dataset.names
+    
+    def write(self, rows: List[Tuple]):
+        self.out.write("".join(
+            json.dumps(dict(zip(self.names, row)), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8"))
+    
+    def finish(self):
+        pass
+
+
+_MAGIC = b"CHKCOL1\n"
+_TYPECODES = {"int": "q", "float": "d"}
+_SWAP = sys.byteorder == "big"
+_DICT_MAX = 0xFFFF
+
+
+def _write_array(out: BinaryIO, values: array):
+    if _SWAP:
+        values.byteswap()
+    out.write(values.tobytes())
+
+
+def _read_array(f: BinaryIO, typecode: str, n: int) -> array:
+    values = array(typecode)
+    values.frombytes(f.read(values.itemsize * n))
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def _write_strings(out: BinaryIO, strings: List[str]):
+    data = [string.encode("utf-8") for string in strings]
+    _write_array(out, array("I", map(len, data)))
+    out.write(b"".join(data))
+
+
+def _read_strings(f: BinaryIO, n: int) -> List[str]:
+    lengths = _read_array(f, "I", n)
+    blob = f.read(sum(lengths))
+    result = []
+    start = 0
+    for length in lengths:
+        result.append(blob[start:start + length].decode("utf-8"))
+        start += length
+    return result
+
+
+class ColumnarWriter:
+    """Колоночный формат (см. описание модуля)"""
+    
+    extension = "col"
+    
+    def __init__(self, out: BinaryIO, dataset: Dataset):
+        self.out = out
+        self.dataset = dataset
+        out.write(_MAGIC)
+        out.write(json.dumps({"columns": dataset.columns}).encode("utf-8") + b"\n")
+    
+    def write(self, rows: List[Tuple]):
+        out = self.out
+        out.write(b"G" + struct.pack("<I", len(rows)))
+        for i, (_, kind) in enumerate(self.dataset.columns):
+            values = [row[i] for row in rows]
+            nulls = bytes(value is None for value in values)
+            if any(nulls):
+                out.write(b"\x01" + nulls)
+            else:
+                out.write(b"\x00")
+            
+            if kind == "text":
+                strings = ["" if value is None else str(value) for value in values]
+                distinct = list(dict.fromkeys(strings))
+                if len(distinct) * 2 <= len(strings) and len(distinct) <= _DICT_MAX:
+                    out.write(b"\x01" + struct.pack("<H", len(distinct)))
+                    _write_strings(out, distinct)
+                    index = {string: j for j, string in enumerate(distinct)}
+                    _write_array(out, array("H", (index[string] for string in strings)))
+                else:
+                    out.write(b"\x00")
+                    _write_strings(out, strings)
+            else:
+                cast = int if kind == "int" else float
+                column = array(_TYPECODES[kind], (0 if value is None else cast(value) for value in values))
+                if kind == "int":
+                    column = array("q", (b - a for a, b in zip([0, *column], column)))
+                _write_array(out, column)
+    
+    def finish(self):
+        self.out.write(b"E")
+
+
+WRITERS = {writer.extension: writer for writer in (CsvWriter, JsonlWriter, ColumnarWriter)}
+
+
+def read_columnar(f: BinaryIO) -> Iterator[Dict[str, list]]:
+    """
+    Группы строк колоночного файла: {колонка: значения}
+    
+    Args:
+        f: распакованный поток, например gzip.open(path, "rb")
+    """
+    if f.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError("Не колоночный файл выгрузки")
+    columns = json.loads(f.readline())["columns"]
+    
+    while (marker := f.read(1)) == b"G":
+        n = struct.unpack("<I", f.read(4))[0]
+        group = {}
+        for name, kind in columns:
+            nulls = f.read(n) if f.read(1) == b"\x01" else None
+            if kind == "text":
+                if f.read(1) == b"\x01":
+                    distinct = _read_strings(f, struct.unpack("<H", f.read(2))[0])
+                    values = [distinct[j] for j in _read_array(f, "H", n)]
+                else:
+                    values = _read_strings(f, n)
+            else:
+                values = _read_array(f, _TYPECODES[kind], n).tolist()
+                if kind == "int":
+                    values = list(accumulate(values))
+            if nulls:
+                values = [None if null else value for value, null in zip(values, nulls)]
+            group[name] = values
+        yield group
+    
+    if marker != b"E":
+        raise ValueError("Колоночный файл выгрузки обрезан")
+
+
+# ─────────────────── ВЫГРУЗКА ───────────────────
+
+async def export_dataset(
+    db: Database,
+    name: str,
+    fmt: str,
+    directory: Optional[str] = None
+) -> Optional[Tuple[str, int]]:
+    """
+    Выгрузить набор тенанта db во временный gzip-файл
+    
+    Args:
+        name: ключ DATASETS
+        fmt: ключ WRITERS (csv, jsonl, col)
+        directory: куда положить файл (None - временная директория системы)
+    
+    Returns:
+        (путь к файлу, строк) или None при ошибке; файл удаляет вызывающий
+    """
+    dataset = DATASETS[name]
+    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=f".{fmt}.gz", dir=directory)
+    os.close(fd)
+    
+    rows = 0
+    pending: Optional[asyncio.Future] = None
+    try:
+        with gzip.open(path, "wb") as out:
+            writer = WRITERS[fmt](out, dataset)
+            chunk: List[Tuple] = []
+            try:
+                async for row in db.iter_export(dataset.table, dataset.names, dataset.key):
+                    chunk.append(row)
+                    if len(chunk) == CHUNK:
+                        # Предыдущая пачка дожимается, пока читается эта
+                        if pending is not None:
+                            await pending
+                        pending = asyncio.ensure_future(asyncio.to_thread(writer.write, chunk))
+                        rows += len(chunk)
+                        chunk = []
+                if pending is not None:
+                    await pending
+                    pending = None
+                if chunk:
+                    await asyncio.to_thread(writer.write, chunk)
+                    rows += len(chunk)
+                await asyncio.to_thread(writer.finish)
+            finally:
+                # При ошибке поток не должен писать в уже закрытый файл
+                if pending is not None:
+                    await asyncio.gather(pending, return_exceptions=True)
+    except (aiosqlite.Error, OSError) as e:
+        log.error(f"Ошибка выгрузки {name} ({fmt}): {e}")
+        os.remove(path)
+        return None
+    
+    log.info(f"📤 Выгружено {name} ({fmt}): {rows} строк, {os.path.getsize(path) / 1024:.1f} KB")
+    return path, rows
@@ -0,0 +1,203 @@
+"""
+Прогноз расхода курицы
+
+Экспоненциальное сглаживание дневного расхода с сезонностью по дням
+недели (Холт-Винтерс без тренда, мультипликативная сезонность).
+Состояние - несколько чисел; каждое взятие обновляет его за O(1),
+а Database хранит его в таблице forecast.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+
+class ConsumptionForecast:
+    """
+    Состояние прогноза
+    
+    level - сглаженный расход в «средний» день (г/день), season - множители
+    по дням недели (пн=0), их среднее держится равным 1. Расход текущего
+    дня копится в day_total и попадает в модель, когда день закончился.
+    """
+    
+    ALPHA = 0.3  # вес нового дня в уровне
+    GAMMA = 0.1  # вес нового дня в сезонном множителе
+    MAX_GAP_DAYS = 7  # более длинный перерыв - нет курицы, а не нулевой расход
+    HORIZON_DAYS = 365
+    
+    def __init__(
+        self,
+        day: Optional[date] = None,
+        day_total: float = 0.0,
+        level: float = 0.0,
+        season: Optional[List[float]] = None,
+        days_seen: int = 0
+    ):
+        self.day = day
+        self.day_total = day_total
+        self.level = level
+        self.season = list(season) if season else [1.0] * 7
+        self.days_seen = days_seen
+    
+    # ─────────────────── ОБНОВЛЕНИЕ ───────────────────
+    
+    def observe(self, when: datetime, grams: float):
+        """
+        Учесть взятие порции
+        
+        Args:
+            when: локальное время взятия
+            grams: вес сырой в граммах
+        """
+        today = when.date()
+        
+        if self.day is None:
+            self.day = today
+        elif today > self.day:
+            gap = (today - self.day).days
+            self._close_day(self.day, self.day_total)
+            if gap <= self.MAX_GAP_DAYS:
+                for offset in range(1, gap):
+                    self._close_day(self.day + timedelta(days=offset), 0.0)
+            self.day = today
+            self.day_total = 0.0
+        
+        # Взятие «в прошлом» (часы переведены назад) учитываем в текущем дне
+        self.day_total += grams
+    
+    def _close_day(self, day: date, total: float):
+        """Обновить уровень и сезонность по итогу завершённого дня"""
+        weekday = day.weekday()
+        factor = self.season[weekday]
+        
+        if self.days_seen == 0:
+            self.level = total
+        else:
+            self.level = self.ALPHA * (total / factor) + (1 - self.ALPHA) * self.level
+            if self.level > 0:
+                factor = self.GAMMA * (total / self.level) + (1 - self.GAMMA) * factor
+                self.season[weekday] = max(factor, 0.05)
+                mean = sum(self.season) / 7
+                self.season = [s / mean for s in self.season]
+        
+        self.days_seen += 1
+    
+    # ─────────────────── ПРОГНОЗ ───────────────────
+    
+    @property
+    def ready(self) -> bool:
+        """Есть ли хотя бы один завершённый день с расходом"""
+        return self.days_seen > 0 and self.level > 0
+    
+    def daily_rate(self, day: date) -> float:
+        """Ожидаемый расход в указанный день, г"""
+        return self.level * self.season[day.weekday()]
+    
+    def run_out(self, raw_left: float, now: datetime) -> Optional[Tuple[float, date]]:
+        """
+        Когда закончится остаток
+        
+        Returns:
+            Optional[Tuple[float, date]]: (дней, дата) или None, если прогноза нет
+        """
+        if not self.ready or raw_left <= 0:
+            return None
+        
+        today = now.date()
+        left = raw_left
+        # Сегодня ещё можно съесть ожидаемое за день минус уже взятое
+        eaten_today = self.day_total if self.day == today else 0.0
+        expected = max(self.daily_rate(today) - eaten_today, 0.0)
+        day_fraction = 1 - (now - datetime.combine(today, datetime.min.time())).total_seconds() / 86400
+        
+        days = 0.0
+        current = today
+        while days < self.HORIZON_DAYS:
+            if expected >= left:
+                part = left / expected if expected else 0.0
+                span = day_fraction if current == today else 1.0
+                return days + part * span, current
+            left -= expected
+            days += day_fraction if current == today else 1.0
+            current += timedelta(days=1)
+            expected = self.daily_rate(current)
+        
+        return None
+    
+    def days_left(self, raw_left: float, now: datetime) -> Optional[float]:
+        """
+        На сколько дней хватит остатка
+        
+        Args:
+            raw_left: остаток сырой, г
+            now: текущее локальное время
+        
+        Returns:
+            Optional[float]: дней или None, если прогноза нет
+        """
+        result = self.run_out(raw_left, now)
+        return result[0] if result else None
+    
+    def runs_out_on(self, raw_left: float, now: datetime) -> Optional[date]:
+        """
+        Дата, когда остаток закончится
+        
+        Args:
+            raw_left: остаток сырой, г
+            now: текущее локальное время
+        
+        Returns:
+            Optional[date]: дата или None, если прогноза нет
+        """
+        result = self.run_out(raw_left, now)
+        return result[1] if result else None
+    
+    # ─────────────────── ХРАНЕНИЕ ───────────────────
+    
+    def to_row(self) -> Tuple:
+        """Значения для INSERT в таблицу forecast (без id)"""
+        return (
+            self.day.isoformat() if self.day else None,
+            self.day_total,
+            self.level,
+            ",".join(f"{s:.6f}" for s in self.season),
+            self.days_seen,
+        )
+    
+    @classmethod
+    def from_row(cls, row) -> "ConsumptionForecast":
+        """Восстановить из строки таблицы forecast"""
+        return cls(
+            day=date.fromisoformat(row["day"]) if row["day"] else None,
+            day_total=row["day_total"],
+            level=row["level"],
+            season=[float(s) for s in row["season"].split(",")],
+            days_seen=row["days_seen"],
+        )
+    
+    def copy(self) -> "ConsumptionForecast":
+        return ConsumptionForecast(self.day, self.day_total, self.level, self.season, self.days_seen)
+
+
+def format_forecast(
+    forecast: Optional[ConsumptionForecast],
+    raw_left: float,
+    now: datetime
+) -> Optional[str]:
+    """
+    Строка прогноза для сообщений
+    
+    Args:
+        forecast: состояние прогноза (Database.get_forecast)
+        raw_left: остаток сырой, г
+        now: текущее локальное время
+    
+    Returns:
+        Optional[str]: "хватит на ~3 дн. (до 21.10)" или None
+    """
+    result = forecast.run_out(raw_left, now) if forecast else None
+    if result is None:
+        return None
+    days, runs_out = result
+    if days < 1:
+        return f"хватит меньше чем на день (до {runs_out.strftime('%d.%m')})"
+    return f"хватит на ~{int(round(days))} дн. (до {runs_out.strftime('%d.%m')})"
@@ -17,3 +17,4 @@ def register_handlers(dp: Dispatcher):
     dp.include_router(take.router)
     dp.include_router(history.router)
     dp.include_router(admin.router)
+    dp.include_router(quick.fallback_router)  # Устаревшие кнопки - всегда последним
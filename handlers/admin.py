@@ -1,13 +1,25 @@
 """
 Обработчики команд администратора
 """
+import asyncio
+import os
+import re
+from datetime import datetime
+
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message, CallbackQuery
 
+from analytics import TAKE_TEXT_RE
 from database import Database
 from config import Config
-from keyboards import main_kb, admin_kb, confirm_kb
+from export import DATASETS, WRITERS, export_dataset
+from keyboards import admin_kb, confirm_kb
+from .common import main_menu
+from profiler import ProfilerManager
+from retention import HistoryArchive
+from statistics import Statistics
+from utils.render import render_history
 
 
 router = Router(name="admin")
@@ -62,7 +74,7 @@ async def admin_clear_batch_execute(callback: CallbackQuery, config: Config, db:
     if success:
         await callback.message.edit_text(
             "✅ Партия успешно удалена",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer("Партия удалена")
     else:
@@ -101,7 +113,7 @@ async def admin_clear_history_execute(callback: CallbackQuery, config: Config, d
     if success:
         await callback.message.edit_text(
             "✅ История успешно очищена",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer("История очищена")
     else:
@@ -130,38 +142,193 @@ async def reset_all(message: Message, config: Config, db: Database):
             "• Партия удалена\n"
             "• История очищена\n"
             "• Записи сообщений удалены",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, message.chat.id)
         )
     else:
         await message.answer(
             "⚠️ Сброс выполнен с ошибками",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, message.chat.id)
+        )
+
+
+@router.message(Command("disable"))
+async def disable_here(message: Message, config: Config, db: Database):
+    """Выключить бота в этом чате/топике (только для админов)"""
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    if await db.set_tenant_enabled(False):
+        await message.answer(
+            "🔕 Бот выключен в этом топике\n\n"
+            "Сообщения и кнопки здесь больше не обрабатываются.\n"
+            "Включить снова: /enable"
         )
+    else:
+        await message.answer("❌ Не удалось изменить настройки")
+
+
+@router.message(Command("enable"))
+async def enable_here(message: Message, config: Config, db: Database):
+    """Включить бота в этом чате/топике (только для админов)"""
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    if await db.set_tenant_enabled(True):
+        await message.answer(
+            "🔔 Бот включён в этом топике",
+            reply_markup=await main_menu(db, message.chat.id)
+        )
+    else:
+        await message.answer("❌ Не удалось изменить настройки")
+
+
+@router.message(Command("rebuild"))
+async def rebuild_stock(message: Message, config: Config, db: Database):
+    """Пересобрать остатки партий по журналу запаса (только для админов)"""
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    result = await db.rebuild_stock()
+    if result is None:
+        await message.answer("❌ Не удалось пересобрать остатки")
+        return
+    
+    replayed, fixed = result
+    await message.answer(
+        f"📒 <b>Остатки пересобраны по журналу</b>\n\n"
+        f"• Событий после последнего снимка: {replayed}\n"
+        f"• Исправлено партий: {fixed}",
+        reply_markup=await main_menu(db, message.chat.id)
+    )
+
+
+ARCHIVE_SHOW = 20  # сколько последних записей месяца показывать из архива
+_MONTH_RE = re.compile(r"\d{4}-\d{2}")
+
+
+@router.message(Command("archive"))
+async def show_archive(message: Message, command: CommandObject, config: Config, db: Database, archive: HistoryArchive):
+    """
+    Архив истории (только для админов)
+    
+    /archive - месяцы в архиве, /archive 2025-03 - записи этого топика за месяц
+    """
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    month = (command.args or "").strip()
+    if not month:
+        months = await asyncio.to_thread(archive.months)
+        if not months:
+            await message.answer("🗄 Архив истории пуст")
+            return
+        lines = [f"• {m.month}: сегментов {m.segments}, {m.size / 1024:.1f} KB" for m in months]
+        await message.answer(
+            "🗄 <b>Архив истории</b>\n\n" + "\n".join(lines) + "\n\nПоказать месяц: /archive ГГГГ-ММ"
+        )
+        return
+    
+    if not _MONTH_RE.fullmatch(month):
+        await message.answer("❌ Укажи месяц: /archive 2025-03")
+        return
+    
+    entries = await asyncio.to_thread(archive.read, *db.tenant, month)
+    if not entries:
+        await message.answer(f"🗄 За {month} в архиве нет записей этого топика")
+        return
+    
+    takes = [m for m in (TAKE_TEXT_RE.match(e.text) for e in entries if e.action_type == "take") if m]
+    eaten = sum(float(m.group(1)) for m in takes)
+    await message.answer(
+        f"🗄 <b>Архив за {month}</b>\n\n"
+        f"• Записей: {len(entries)}\n"
+        f"• Взятий: {len(takes)} ({eaten:.0f}г сырой)\n\n"
+        + render_history(reversed(entries[-ARCHIVE_SHOW:])),
+        reply_markup=await main_menu(db, message.chat.id)
+    )
+
+
+@router.message(Command("export"))
+async def export_data(message: Message, command: CommandObject, config: Config, db: Database):
+    """
+    Выгрузить данные топика файлами gzip (только для админов)
+    
+    /export [csv|jsonl|col] [набор] - по умолчанию csv и все наборы
+    """
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    args = (command.args or "").split()
+    fmt = args.pop(0) if args and args[0] in WRITERS else "csv"
+    names = args or list(DATASETS)
+    unknown = [name for name in names if name not in DATASETS]
+    if unknown:
+        await message.answer(
+            f"❌ Неизвестный набор: {', '.join(unknown)}\n\n"
+            f"Форматы: {', '.join(WRITERS)}\nНаборы: {', '.join(DATASETS)}\n"
+            f"Пример: /export jsonl history"
+        )
+        return
+    
+    stamp = datetime.now().strftime("%Y%m%d")
+    for name in names:
+        result = await export_dataset(db, name, fmt)
+        if result is None:
+            await message.answer(f"❌ Не удалось выгрузить {name}")
+            continue
+        path, rows = result
+        try:
+            await message.answer_document(
+                FSInputFile(path, filename=f"{name}_{stamp}.{fmt}.gz"),
+                caption=f"📤 <b>{name}</b>: {rows} строк ({fmt}, gzip)"
+            )
+        finally:
+            os.remove(path)
 
 
 @router.message(Command("stats"))
-async def show_stats(message: Message, config: Config, db: Database):
-    """Показать статистику (только для админов)"""
+async def show_stats(message: Message, command: CommandObject, config: Config, db: Database):
+    """
+    Показать статистику (только для админов)
+    
+    /stats 90 - подробная статистика за 90 дней
+    """
     if not config.is_admin(message.from_user.id):
         await message.answer("❌ Недостаточно прав")
         return
     
+    if command.args:
+        args = command.args.strip()
+        if not args.isdigit() or not 1 <= int(args) <= 3650:
+            await message.answer("❌ Укажи период в днях: /stats 90")
+            return
+        text = await Statistics(db, db.timezone_offset).format_extended_stats(days=int(args), chat_id=message.chat.id)
+        await message.answer(text, reply_markup=await main_menu(db, message.chat.id))
+        return
+    
     batch = await db.get_batch()
-    history = await db.get_history(limit=100)
+    history = await db.get_history_columns(limit=100)
     
     if not batch:
         batch_text = "Нет активной партии"
     else:
         batch_text = (
-            f"Сырой: {int(batch['raw_total'])}г → {int(batch['raw_left'])}г\n"
-            f"Готовой: {int(batch['cooked_total'])}г\n"
-            f"Коэфф: {batch['coef']:.3f}\n"
-            f"Создана: {batch['created']}"
+            f"Сырой: {int(batch.raw_total)}г → {int(batch.raw_left)}г\n"
+            f"Готовой: {int(batch.cooked_total)}г\n"
+            f"Коэфф: {batch.coef:.3f}\n"
+            f"Создана: {batch.created}"
         )
+        if batch.batches > 1:
+            batch_text += f"\nОткрытых партий: {batch.batches}"
     
     # Подсчёт операций по типам
-    take_count = sum(1 for h in history if h['action_type'] == 'take')
-    batch_count = sum(1 for h in history if h['action_type'] == 'new_batch')
+    take_count = history.count("take")
+    batch_count = history.count("new_batch")
     
     await message.answer(
         f"📊 <b>Статистика</b>\n\n"
@@ -170,7 +337,7 @@ async def show_stats(message: Message, config: Config, db: Database):
         f"• Всего записей: {len(history)}\n"
         f"• Создано партий: {batch_count}\n"
         f"• Взято порций: {take_count}",
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, message.chat.id)
     )
 
 
@@ -230,3 +397,80 @@ async def admin_backup(callback: CallbackQuery, config: Config, db: Database):
         )
     
     await callback.answer()
+
+
+def parse_profile_args(args: str):
+    """
+    Разбор аргументов /profile
+    
+    "60" или "60s" - секунды, "200u" - апдейты, "stop" - остановить
+    
+    Returns:
+        tuple: (seconds, updates) или None если аргументы некорректны
+    """
+    if not args:
+        return 30, None
+    
+    arg = args.strip().lower()
+    unit = "s"
+    if arg[-1] in ("s", "u"):
+        arg, unit = arg[:-1], arg[-1]
+    
+    if not arg.isdigit() or int(arg) <= 0:
+        return None
+    
+    value = int(arg)
+    if unit == "u":
+        return None, min(value, ProfilerManager.MAX_UPDATES)
+    return min(value, ProfilerManager.MAX_SECONDS), None
+
+
+@router.message(Command("profile"))
+async def profile_command(
+    message: Message,
+    command: CommandObject,
+    config: Config,
+    profiler: ProfilerManager
+):
+    """Профилирование бота на N секунд или N апдейтов (только для админов)"""
+    if not config.is_admin(message.from_user.id):
+        await message.answer("❌ Недостаточно прав")
+        return
+    
+    if command.args and command.args.strip().lower() == "stop":
+        if not profiler.active:
+            await message.answer("ℹ️ Профилирование не запущено")
+            return
+        await message.answer("⏹ Останавливаю, отчёт придёт в личку")
+        await profiler.finish()
+        return
+    
+    parsed = parse_profile_args(command.args)
+    if parsed is None:
+        await message.answer(
+            "❌ Неверный формат\n\n"
+            "💡 Примеры:\n"
+            "• /profile 60 - на 60 секунд\n"
+            "• /profile 200u - на 200 апдейтов\n"
+            "• /profile stop - остановить"
+        )
+        return
+    
+    seconds, updates = parsed
+    started = profiler.start(
+        message.bot,
+        message.from_user.id,
+        seconds=seconds,
+        updates=updates
+    )
+    
+    if not started:
+        await message.answer("⚠️ Профилирование уже идёт")
+        return
+    
+    scope = f"{seconds} с" if seconds else f"{updates} апдейтов"
+    await message.answer(
+        f"🔬 <b>Профилирование запущено</b>\n\n"
+        f"Длительность: {scope}\n"
+        f"Отчёт и файл профиля придут тебе в личку."
+    )
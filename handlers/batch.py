@@ -9,8 +9,8 @@ from database import Database
 from config import Config
 from states import CookFSM
 from utils import WeightParser, WeightValidator
-from keyboards import main_kb
-from .common import send_or_edit, log_message
+from keyboards import cancel_kb, note_kb
+from .common import send_or_edit, log_message, main_menu
 
 
 router = Router(name="batch")
@@ -21,23 +21,17 @@ async def new_batch_start(callback: CallbackQuery, state: FSMContext):
     """Начало создания новой партии"""
     await state.set_state(CookFSM.raw_total)
     
-    # Клавиатура с кнопкой отмены
-    from keyboards import InlineKeyboardMarkup, InlineKeyboardButton
-    cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-    ])
-    
     await callback.message.edit_text(
         "🥩 <b>Новая партия</b>\n\n"
         "Сколько весила <b>СЫРАЯ</b> курица?\n\n"
         "💡 Примеры: 1500, 1.5кг, полкило",
-        reply_markup=cancel_kb
+        reply_markup=cancel_kb()
     )
     await callback.answer()
 
 
 @router.message(CookFSM.raw_total)
-async def set_raw_weight(message: Message, state: FSMContext, config: Config):
+async def set_raw_weight(message: Message, state: FSMContext, validator: WeightValidator):
     """Установка веса сырой курицы"""
     # Удалить сообщение пользователя для чистоты
     try:
@@ -49,7 +43,6 @@ async def set_raw_weight(message: Message, state: FSMContext, config: Config):
     raw = WeightParser.parse(message.text)
     
     # Валидация
-    validator = WeightValidator(config.min_weight, config.max_weight)
     is_valid, error_msg = validator.validate(raw)
     
     if not is_valid:
@@ -66,18 +59,12 @@ async def set_raw_weight(message: Message, state: FSMContext, config: Config):
     await state.update_data(raw=raw)
     await state.set_state(CookFSM.cooked_total)
     
-    # Клавиатура с кнопкой отмены
-    from keyboards import InlineKeyboardMarkup, InlineKeyboardButton
-    cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-    ])
-    
     formatted_weight = WeightParser.format_weight(raw)
     await message.answer(
         f"✅ Сырая курица: <b>{formatted_weight}</b>\n\n"
         f"🍗 Теперь сколько весит <b>ГОТОВАЯ</b> курица?\n\n"
         f"💡 Примеры: 1200, 1.2кг",
-        reply_markup=cancel_kb
+        reply_markup=cancel_kb()
     )
 
 
@@ -85,8 +72,7 @@ async def set_raw_weight(message: Message, state: FSMContext, config: Config):
 async def set_cooked_weight(
     message: Message, 
     state: FSMContext, 
-    db: Database,
-    config: Config
+    validator: WeightValidator
 ):
     """Установка веса готовой курицы"""
     # Удалить сообщение пользователя для чистоты
@@ -99,7 +85,6 @@ async def set_cooked_weight(
     cooked = WeightParser.parse(message.text)
     
     # Валидация веса
-    validator = WeightValidator(config.min_weight, config.max_weight)
     is_valid, error_msg = validator.validate(cooked)
     
     if not is_valid:
@@ -124,13 +109,6 @@ async def set_cooked_weight(
     await state.update_data(cooked=cooked)
     await state.set_state(CookFSM.note)
     
-    # Клавиатура с кнопками
-    from keyboards import InlineKeyboardMarkup, InlineKeyboardButton
-    note_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➡️ Пропустить", callback_data="skip_note")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-    ])
-    
     coef = cooked / raw
     raw_formatted = WeightParser.format_weight(raw)
     cooked_formatted = WeightParser.format_weight(cooked)
@@ -143,7 +121,7 @@ async def set_cooked_weight(
         f"📝 Хочешь добавить заметку к партии?\n"
         f"💡 Например: \"острая\", \"с овощами\", \"маринованная\"\n\n"
         f"Напиши заметку или нажми \"Пропустить\":",
-        reply_markup=note_kb
+        reply_markup=note_kb()
     )
 
 
@@ -193,7 +171,7 @@ async def create_batch_final(
         await message.answer(
             "😔 Произошла ошибка при сохранении партии.\n"
             "Попробуй ещё раз позже.",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, message.chat.id)
         )
         await state.clear()
         return
@@ -209,7 +187,7 @@ async def create_batch_final(
     
     # Проверить есть ли уже закреплённое сообщение
     batch = await db.get_batch()
-    has_pinned = batch and batch["pinned_msg_id"] if batch else False
+    has_pinned = bool(batch and batch.pinned_msg_id)
     
     # Очистка состояния
     await state.clear()
@@ -237,7 +215,7 @@ async def create_batch_final(
         f"🍗 Готовая: <b>{cooked_formatted}</b>\n"
         f"⚖️ Коэффициент: <b>{coef:.3f}</b>{note_text}{pin_hint}\n\n"
         f"Теперь можешь брать порции! 😋",
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, message.chat.id)
     )
     
     await log_message(msg, db, config)
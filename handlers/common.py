@@ -2,15 +2,26 @@
 Общие утилиты для обработчиков
 """
 import logging
-from aiogram.types import Message
+import time
+from typing import Dict, Tuple, Union
+
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 from aiogram import Bot
 
 from database import Database
 from config import Config
+from keyboards import main_kb
 
 
 log = logging.getLogger(__name__)
 
+# Повторное нажатие той же кнопки тем же пользователем за это время - дубль
+DOUBLE_TAP_WINDOW = 1.0  # сек
+_TAPS_LIMIT = 10_000
+
+# (чат, сообщение, пользователь, кнопка) → (время первого нажатия, его ключ)
+_taps: Dict[Tuple[int, int, int, str], Tuple[float, str]] = {}
+
 
 async def send_or_edit(
     message: Message,
@@ -36,6 +47,46 @@ async def send_or_edit(
         return await message.answer(text, reply_markup=reply_markup)
 
 
+def take_key(event: Union[Message, CallbackQuery]) -> str:
+    """
+    Ключ идемпотентности взятия порции (Database.take_portion)
+    
+    Сообщение с весом - по своему id: повторная доставка апдейта даёт тот же
+    ключ. Нажатие - по пользователю и id callback: он один на нажатие и не
+    меняется при повторной доставке, а нажатия разных участников группы
+    не пересекаются. Двойное нажатие (та же кнопка того же сообщения тем же
+    пользователем за DOUBLE_TAP_WINDOW) получает ключ первого нажатия.
+    """
+    if isinstance(event, Message):
+        return f"msg:{event.chat.id}:{event.message_id}"
+    
+    key = f"cb:{event.from_user.id}:{event.id}"
+    if event.message is None:
+        return key
+    
+    now = time.monotonic()
+    tap = (event.message.chat.id, event.message.message_id, event.from_user.id, event.data or "")
+    first = _taps.get(tap)
+    if first is not None and now - first[0] < DOUBLE_TAP_WINDOW:
+        return first[1]
+    
+    if len(_taps) >= _TAPS_LIMIT:
+        for stale in [t for t, (at, _) in _taps.items() if now - at >= DOUBLE_TAP_WINDOW]:
+            del _taps[stale]
+    _taps[tap] = (now, key)
+    return key
+
+
+async def main_menu(db: Database, chat_id: int) -> InlineKeyboardMarkup:
+    """
+    Главное меню с частыми порциями чата
+    
+    Порции берутся из кэша Database, клавиатура - из кэша keyboards,
+    так что обычно это два поиска в словаре без запросов к БД.
+    """
+    return main_kb(await db.get_quick_portions(chat_id))
+
+
 async def log_message(message: Message, db: Database, config: Config):
     """
     Логирование сообщения для последующего удаления
@@ -54,13 +105,13 @@ async def log_message(message: Message, db: Database, config: Config):
         
         # Удалить старые сообщения
         bot = message.bot
-        for record_id, msg_id, chat_id in old_messages:
+        for old in old_messages:
             try:
-                await bot.delete_message(chat_id, msg_id)
+                await bot.delete_message(old.chat_id, old.msg_id)
             except Exception as e:
-                log.debug(f"Не удалось удалить сообщение {msg_id}: {e}")
+                log.debug(f"Не удалось удалить сообщение {old.msg_id}: {e}")
             finally:
-                await db.delete_message_record(record_id)
+                await db.delete_message_record(old.id)
                 
     except Exception as e:
         log.error(f"Ошибка при логировании сообщения: {e}")
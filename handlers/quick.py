@@ -2,39 +2,49 @@
 Обработчики быстрых действий
 """
 import logging
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from database import Database
 from config import Config
-from keyboards import main_kb
+from callbacks import QuickPortion, LegacyCallback
 from utils.parser import WeightParser
-from handlers.common import log_message
+from utils.validators import WeightValidator
+from handlers.common import log_message, main_menu, take_key
 
 
 log = logging.getLogger(__name__)
 router = Router()
+# Подключается последним: ловит кнопки, которые не разобрал ни один роутер
+fallback_router = Router(name="fallback")
 
 
-@router.callback_query(F.data.startswith("quick_"))
+@router.callback_query(QuickPortion.filter())
+@router.callback_query(LegacyCallback(QuickPortion))
 async def quick_take(
     callback: CallbackQuery,
+    callback_data: QuickPortion,
     db: Database,
     config: Config,
-    state: FSMContext
+    state: FSMContext,
+    validator: WeightValidator
 ):
     """
     Быстрое взятие порции одним нажатием
     
-    Поддерживает: quick_200, quick_300
+    callback_data: "quick:200" (и старый формат "quick_200")
     """
     # Очистить состояние если было
     await state.clear()
     
-    # Получить вес из callback
-    weight_str = callback.data.split("_")[1]  # "quick_200" -> "200"
-    grams = float(weight_str)
+    grams = callback_data.grams
+    
+    # Кнопки могли остаться от старых настроек - те же лимиты, что и при ручном вводе
+    is_valid, error_msg = validator.validate(grams)
+    if not is_valid:
+        await callback.answer(f"❌ {error_msg}", show_alert=True)
+        return
     
     # Проверить что партия существует
     batch = await db.get_batch()
@@ -43,28 +53,37 @@ async def quick_take(
             "❌ <b>Партия не найдена</b>\n\n"
             "Сначала создай партию:\n"
             "➕ Новая партия",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer()
         return
     
     # Попытка взять порцию
-    result = await db.take_portion(grams)
+    result = await db.take_portion(
+        grams, chat_id=callback.message.chat.id,
+        user_id=callback.from_user.id, user_name=callback.from_user.full_name,
+        idempotency_key=take_key(callback)
+    )
     
     if result is None:
-        raw_left = batch["raw_left"]
+        raw_left = batch.raw_left
         left_formatted = WeightParser.format_weight(raw_left)
         
         await callback.message.edit_text(
             f"❌ <b>Столько нет!</b>\n\n"
             f"Осталось только <b>{left_formatted}</b> сырой\n\n"
             "Выбери меньше или создай новую партию",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer()
         return
     
-    cooked_portion, new_raw_left = result
+    if result.replayed:
+        # Двойное нажатие или повторная доставка: сообщение уже показывает это взятие
+        await callback.answer("⚡ Уже взято")
+        return
+    
+    cooked_portion, new_raw_left, _ = result
     
     # Форматирование
     raw_formatted = WeightParser.format_weight(grams)
@@ -72,7 +91,7 @@ async def quick_take(
     left_formatted = WeightParser.format_weight(new_raw_left)
     
     # Определить эмодзи в зависимости от остатка
-    percentage = (new_raw_left / batch["raw_total"]) * 100 if batch["raw_total"] > 0 else 0
+    percentage = (new_raw_left / batch.raw_total) * 100 if batch.raw_total > 0 else 0
     if percentage >= 50:
         status_emoji = "🟢"
     elif percentage >= 20:
@@ -92,7 +111,7 @@ async def quick_take(
     
     await callback.message.edit_text(
         response_text,
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, callback.message.chat.id)
     )
     
     # Обновить закреплённое сообщение
@@ -120,3 +139,15 @@ async def quick_take(
         log.error(f"Ошибка уведомлений: {e}")
     
     await callback.answer("⚡ Готово!")
+
+
+@fallback_router.callback_query()
+async def stale_button(callback: CallbackQuery):
+    """
+    Кнопка, которую не разобрал ни один хендлер
+    
+    Старые данные вроде "take_150.5", кнопки чужого шага FSM и т.п. -
+    без ответа у пользователя бесконечно крутится индикатор загрузки
+    """
+    log.info(f"Необработанная кнопка: {callback.data!r}")
+    await callback.answer("⌛ Кнопка устарела, открой меню заново")
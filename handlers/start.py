@@ -6,14 +6,16 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from keyboards import main_kb, back_kb
+from keyboards import back_kb
+from database import Database
+from .common import main_menu
 
 
 router = Router(name="start")
 
 
 @router.message(Command("start"))
-async def start_command(message: Message, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, db: Database):
     """Команда /start - Душевное приветствие"""
     await state.clear()
     
@@ -23,7 +25,7 @@ async def start_command(message: Message, state: FSMContext):
         f"👋 Привет, {user_name}!\n\n"
         f"🎉 <b>Chicken Chief к твоим услугам!</b>\n\n"
         f"Я помогу тебе:\n"
-        f"• ⚡ <b>Быстро брать порции</b> (200г/300г одним тапом)\n"
+        f"• ⚡ <b>Быстро брать порции</b> (твои частые порции одним тапом)\n"
         f"• 📊 <b>Следить за остатком</b> с красивым статусом\n"
         f"• 📈 <b>Видеть статистику</b> потребления\n"
         f"• 💾 <b>Не терять данные</b> (автобэкапы)\n\n"
@@ -34,17 +36,17 @@ async def start_command(message: Message, state: FSMContext):
     
     await message.answer(
         welcome_text,
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, message.chat.id)
     )
 
 
 @router.callback_query(F.data == "cancel")
-async def cancel_operation(callback: CallbackQuery, state: FSMContext):
+async def cancel_operation(callback: CallbackQuery, state: FSMContext, db: Database):
     """Отмена текущей операции"""
     await state.clear()
     await callback.message.edit_text(
         "❌ Операция отменена",
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, callback.message.chat.id)
     )
     await callback.answer("Отменено")
 
@@ -57,7 +59,8 @@ async def help_command(callback: CallbackQuery):
         
         "⚡ <b>БЫСТРЫЕ ДЕЙСТВИЯ</b> (NEW!)\n"
         "• <b>⚡ 200г / ⚡ 300г</b> - взять порцию одним тапом\n"
-        "Самый быстрый способ! Просто нажми и готово.\n\n"
+        "Самый быстрый способ! Просто нажми и готово.\n"
+        "Кнопки подстраиваются под порции, которые ты берёшь чаще всего.\n\n"
         
         "📊 <b>СОЗДАНИЕ ПАРТИИ</b>\n"
         "• Нажми <b>➕ Новая партия</b>\n"
@@ -67,9 +70,10 @@ async def help_command(callback: CallbackQuery):
         "• Готово! Я запомню коэффициент.\n\n"
         
         "🍗 <b>ВЗЯТЬ ПОРЦИЮ</b>\n"
-        "• <b>Быстро:</b> ⚡ 200г или ⚡ 300г\n"
+        "• <b>Быстро:</b> ⚡ кнопки в главном меню\n"
         "• <b>Обычно:</b> 🍗 Взять порцию → выбери вес\n"
-        "Я покажу сколько это готовой и обновлю статус!\n\n"
+        "Я покажу сколько это готовой и обновлю статус!\n"
+        "• <b>Ошибся?</b> /undo отменит твоё последнее взятие\n\n"
         
         "📈 <b>СТАТИСТИКА</b> (NEW!)\n"
         "• Нажми <b>📈 Статистика</b>\n"
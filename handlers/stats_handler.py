@@ -6,7 +6,7 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
 from database import Database
-from keyboards import stats_kb, main_kb
+from keyboards import stats_kb
 from statistics import Statistics
 
 
@@ -29,7 +29,7 @@ async def stats_menu(callback: CallbackQuery, db: Database):
 async def stats_today(callback: CallbackQuery, db: Database):
     """Статистика за сегодня"""
     stats = Statistics(db, timezone_offset=3)
-    message = await stats.format_stats_message(days=1)
+    message = await stats.format_stats_message(days=1, chat_id=callback.message.chat.id)
     
     await callback.message.edit_text(
         message,
@@ -42,7 +42,7 @@ async def stats_today(callback: CallbackQuery, db: Database):
 async def stats_week(callback: CallbackQuery, db: Database):
     """Статистика за неделю"""
     stats = Statistics(db, timezone_offset=3)
-    message = await stats.format_stats_message(days=7)
+    message = await stats.format_stats_message(days=7, chat_id=callback.message.chat.id)
     
     await callback.message.edit_text(
         message,
@@ -55,7 +55,46 @@ async def stats_week(callback: CallbackQuery, db: Database):
 async def stats_month(callback: CallbackQuery, db: Database):
     """Статистика за месяц"""
     stats = Statistics(db, timezone_offset=3)
-    message = await stats.format_stats_message(days=30)
+    message = await stats.format_stats_message(days=30, chat_id=callback.message.chat.id)
+    
+    await callback.message.edit_text(
+        message,
+        reply_markup=stats_kb()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "stats_year")
+async def stats_year(callback: CallbackQuery, db: Database):
+    """Подробная статистика за год"""
+    stats = Statistics(db, timezone_offset=3)
+    message = await stats.format_extended_stats(days=365, chat_id=callback.message.chat.id)
+    
+    await callback.message.edit_text(
+        message,
+        reply_markup=stats_kb()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "stats_top")
+async def stats_top(callback: CallbackQuery, db: Database):
+    """Рейтинг пользователей за неделю"""
+    stats = Statistics(db, timezone_offset=3)
+    message = await stats.format_leaderboard(days=7, chat_id=callback.message.chat.id)
+    
+    await callback.message.edit_text(
+        message,
+        reply_markup=stats_kb()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "stats_me")
+async def stats_me(callback: CallbackQuery, db: Database):
+    """Личная статистика нажавшего"""
+    stats = Statistics(db, timezone_offset=3)
+    message = await stats.format_user_stats(callback.from_user.id, chat_id=callback.message.chat.id)
     
     await callback.message.edit_text(
         message,
@@ -6,7 +6,7 @@ from aiogram.types import CallbackQuery
 
 from database import Database
 from config import Config
-from keyboards import main_kb
+from .common import main_menu
 
 
 router = Router(name="status")
@@ -21,13 +21,13 @@ async def show_status(callback: CallbackQuery, db: Database, config: Config):
         await callback.message.edit_text(
             "❌ Партия не задана\n\n"
             "Нажми «➕ Новая партия» чтобы начать",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer()
         return
     
-    raw_left = batch["raw_left"]
-    coef = batch["coef"]
+    raw_left = batch.raw_left
+    coef = batch.coef
     cooked_left = raw_left * coef
     
     # Формирование сообщения
@@ -36,10 +36,10 @@ async def show_status(callback: CallbackQuery, db: Database, config: Config):
         f"🥩 Сырой: <b>{int(raw_left)} г</b>\n"
         f"🍗 Готовой: <b>{int(cooked_left)} г</b>\n\n"
         f"⚖️ Коэффициент: {coef:.3f}\n"
-        f"📅 Партия от: {batch['created']}"
+        f"📅 Партия от: {batch.created}"
     )
     
-    await callback.message.edit_text(text, reply_markup=main_kb())
+    await callback.message.edit_text(text, reply_markup=await main_menu(db, callback.message.chat.id))
     
     # Предупреждение о низком остатке
     if raw_left < config.low_threshold:
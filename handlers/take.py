@@ -1,16 +1,20 @@
 """
 Обработчик взятия порции
 """
+from typing import Optional
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, User
 from aiogram.fsm.context import FSMContext
 
 from database import Database
 from config import Config
 from states import TakeFSM
 from utils import WeightParser, WeightValidator, PortionValidator
-from keyboards import main_kb, take_kb
-from .common import send_or_edit, log_message
+from keyboards import take_kb, cancel_kb
+from callbacks import TakePortion, LegacyCallback
+from .common import send_or_edit, log_message, main_menu, take_key
 
 
 router = Router(name="take")
@@ -26,19 +30,19 @@ async def take_start(callback: CallbackQuery, state: FSMContext, db: Database):
         await callback.message.edit_text(
             "❌ Партия не задана\n\n"
             "Сначала создай партию: «➕ Новая партия»",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer()
         return
     
     # Проверка остатка
-    raw_left = batch["raw_left"]
+    raw_left = batch.raw_left
     
     if raw_left <= 0:
         await callback.message.edit_text(
             "❌ Курица закончилась!\n\n"
             "Создай новую партию: «➕ Новая партия»",
-            reply_markup=main_kb()
+            reply_markup=await main_menu(db, callback.message.chat.id)
         )
         await callback.answer()
         return
@@ -50,43 +54,73 @@ async def take_start(callback: CallbackQuery, state: FSMContext, db: Database):
         f"🍗 <b>Взять порцию</b>\n\n"
         f"Осталось сырой: <b>{formatted_left}</b>\n\n"
         f"Сколько <b>СЫРОЙ</b> берёшь?",
-        reply_markup=take_kb()
+        reply_markup=take_kb(await db.get_quick_portions(callback.message.chat.id))
+    )
+    await callback.answer()
+
+
+@router.message(Command("undo"))
+async def undo_take(message: Message, state: FSMContext, db: Database):
+    """Отменить своё последнее взятие"""
+    await state.clear()
+    result = await db.undo_last_take(user_id=message.from_user.id, idempotency_key=take_key(message))
+    
+    if result is None:
+        await message.answer(
+            "🤷 Нечего отменять\n\n"
+            "Отменить можно только своё взятие из партии, которая ещё не удалена",
+            reply_markup=await main_menu(db, message.chat.id)
+        )
+        return
+    
+    restored, new_raw_left = result
+    await message.answer(
+        f"↩️ <b>Взятие отменено</b>\n\n"
+        f"🥩 Возвращено сырой: <b>{WeightParser.format_weight(restored)}</b>\n"
+        f"📊 Осталось сырой: <b>{WeightParser.format_weight(new_raw_left)}</b>",
+        reply_markup=await main_menu(db, message.chat.id)
+    )
+    
+    from pinned_status import update_pinned_status
+    await update_pinned_status(
+        bot=message.bot,
+        chat_id=message.chat.id,
+        db=db,
+        message_thread_id=message.message_thread_id
+    )
+
+
+@router.callback_query(F.data == "take_other", TakeFSM.raw_take)
+async def take_other(callback: CallbackQuery):
+    """Ручной ввод веса порции"""
+    await callback.message.edit_text(
+        "✍️ Введи вес сырой курицы:\n\n"
+        "💡 Примеры: 150, 200, 0.25кг",
+        reply_markup=cancel_kb()
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("take_"), TakeFSM.raw_take)
+@router.callback_query(TakePortion.filter(), TakeFSM.raw_take)
+@router.callback_query(LegacyCallback(TakePortion), TakeFSM.raw_take)
 async def take_quick(
     callback: CallbackQuery,
+    callback_data: TakePortion,
     state: FSMContext,
     db: Database,
-    config: Config
+    config: Config,
+    validator: WeightValidator
 ):
     """Быстрый выбор порции"""
-    # Проверка на "другое"
-    if callback.data == "take_other":
-        # Клавиатура с кнопкой отмены
-        from keyboards import InlineKeyboardMarkup, InlineKeyboardButton
-        cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-        ])
-        
-        await callback.message.edit_text(
-            "✍️ Введи вес сырой курицы:\n\n"
-            "💡 Примеры: 150, 200, 0.25кг",
-            reply_markup=cancel_kb
-        )
-        await callback.answer()
-        return
-    
-    # Извлечение веса из callback_data
-    try:
-        grams = float(callback.data.split("_")[1])
-    except (IndexError, ValueError):
-        await callback.answer("Ошибка при обработке")
+    is_valid, error_msg = validator.validate(callback_data.grams)
+    if not is_valid:
+        await callback.answer(f"❌ {error_msg}", show_alert=True)
         return
     
-    await process_take(callback.message, grams, state, db, config, is_callback=True)
+    await process_take(
+        callback.message, callback_data.grams, state, db, config,
+        is_callback=True, user=callback.from_user, key=take_key(callback)
+    )
     await callback.answer()
 
 
@@ -95,7 +129,8 @@ async def take_manual(
     message: Message,
     state: FSMContext,
     db: Database,
-    config: Config
+    config: Config,
+    validator: WeightValidator
 ):
     """Ручной ввод веса порции"""
     # Удалить сообщение пользователя для чистоты
@@ -108,7 +143,6 @@ async def take_manual(
     grams = WeightParser.parse(message.text)
     
     # Валидация
-    validator = WeightValidator(config.min_weight, config.max_weight)
     is_valid, error_msg = validator.validate(grams)
     
     if not is_valid:
@@ -118,7 +152,10 @@ async def take_manual(
         )
         return
     
-    await process_take(message, grams, state, db, config, is_callback=False)
+    await process_take(
+        message, grams, state, db, config,
+        is_callback=False, user=message.from_user, key=take_key(message)
+    )
 
 
 async def process_take(
@@ -127,7 +164,9 @@ async def process_take(
     state: FSMContext,
     db: Database,
     config: Config,
-    is_callback: bool = False
+    is_callback: bool = False,
+    user: Optional[User] = None,
+    key: Optional[str] = None
 ):
     """
     Обработка взятия порции
@@ -139,9 +178,16 @@ async def process_take(
         db: база данных
         config: конфигурация
         is_callback: True если вызвано из callback
+        user: кто берёт порцию (в callback message - сообщение бота)
+        key: ключ идемпотентности (common.take_key)
     """
     # Попытка взять порцию
-    result = await db.take_portion(grams)
+    result = await db.take_portion(
+        grams, chat_id=message.chat.id,
+        user_id=user.id if user else None,
+        user_name=user.full_name if user else None,
+        idempotency_key=key
+    )
     
     if result is None:
         # Получаем информацию о партии для ошибки
@@ -153,22 +199,26 @@ async def process_take(
                 "Создай новую партию: «➕ Новая партия»"
             )
         else:
-            raw_left = batch["raw_left"]
+            raw_left = batch.raw_left
             formatted_left = WeightParser.format_weight(raw_left)
             text = (
                 f"❌ Столько нет!\n\n"
                 f"Осталось только <b>{formatted_left}</b> сырой"
             )
         
-        await send_or_edit(message, text, is_callback, reply_markup=main_kb())
+        await send_or_edit(message, text, is_callback, reply_markup=await main_menu(db, message.chat.id))
         await state.clear()
         return
     
-    cooked_portion, new_raw_left = result
-    
     # Очистка состояния
     await state.clear()
     
+    if result.replayed:
+        # Повтор уже обработанного взятия: ответ и закреп не изменились бы
+        return
+    
+    cooked_portion, new_raw_left, _ = result
+    
     # Форматирование весов
     raw_formatted = WeightParser.format_weight(grams)
     cooked_formatted = WeightParser.format_weight(cooked_portion)
@@ -188,7 +238,7 @@ async def process_take(
         message,
         response_text,
         is_callback,
-        reply_markup=main_kb()
+        reply_markup=await main_menu(db, message.chat.id)
     )
     
     # Обновить закреплённое сообщение
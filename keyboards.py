@@ -1,17 +1,113 @@
 """
 Клавиатуры бота
+
+Статические клавиатуры собираются один раз при импорте, а их JSON
+сериализуется сразу же. KeyboardSession подставляет готовый JSON
+в запрос вместо повторной сериализации дерева кнопок.
+
+Главное меню и выбор порции зависят от частых порций чата
+(Database.get_quick_portions) и кэшируются по набору порций.
 """
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import json
+import weakref
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from aiohttp import FormData
+
+from callbacks import QuickPortion, TakePortion
+
+
+# Быстрые кнопки по умолчанию, пока в чате мало истории
+DEFAULT_QUICK = (200, 300)
+DEFAULT_TAKE = (100, 150, 200, 300)
+
+# id(клавиатуры) → (слабая ссылка, JSON); запись удаляется вместе с клавиатурой
+_serialized: Dict[int, Tuple[weakref.ref, str]] = {}
+
+
+def _static(rows: List[List[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
+    """Собрать неизменяемую клавиатуру и закэшировать её JSON"""
+    markup = InlineKeyboardMarkup(inline_keyboard=rows)
+    key = id(markup)
+    # То же, что делает BaseSession.prepare_value: без None-полей
+    _serialized[key] = (weakref.ref(markup), json.dumps(markup.model_dump(exclude_none=True)))
+    weakref.finalize(markup, _serialized.pop, key, None)
+    return markup
+
+
+def serialized(markup) -> Optional[str]:
+    """Готовый JSON собранной здесь клавиатуры или None для чужой"""
+    entry = _serialized.get(id(markup))
+    if entry is not None and entry[0]() is markup:
+        return entry[1]
+    return None
+
+
+def _pick(portions: Iterable[int], defaults: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Первые частые порции, дополненные значениями по умолчанию, по возрастанию"""
+    picked: List[int] = []
+    for grams in (*portions, *defaults):
+        if grams not in picked:
+            picked.append(grams)
+        if len(picked) == len(defaults):
+            break
+    return tuple(sorted(picked))
 
 
-def main_kb() -> InlineKeyboardMarkup:
+class KeyboardSession(AiohttpSession):
+    """AiohttpSession, которая не сериализует статические клавиатуры повторно"""
+    
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup_json = serialized(getattr(method, "reply_markup", None))
+        if markup_json is None:
+            return super().build_form_data(bot, method)
+        
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", markup_json)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
+# ─────────────────── КНОПКИ ───────────────────
+
+_CANCEL = InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")
+_BACK = InlineKeyboardButton(text="🔙 Назад", callback_data="cancel")
+
+
+def _quick(grams: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text=f"⚡ {grams}г",
+        callback_data=QuickPortion(grams=grams).pack()
+    )
+
+
+def _take(grams: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text=f"{grams} г",
+        callback_data=TakePortion(grams=grams).pack()
+    )
+
+
+# ─────────────────── КЛАВИАТУРЫ ───────────────────
+
+@lru_cache(maxsize=128)
+def _main_kb(quick: Tuple[int, ...]) -> InlineKeyboardMarkup:
     """Главное меню - Modern Design 2026"""
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return _static([
         # БЫСТРЫЕ ДЕЙСТВИЯ (топ приоритет)
-        [
-            InlineKeyboardButton(text="⚡ 200г", callback_data="quick_200"),
-            InlineKeyboardButton(text="⚡ 300г", callback_data="quick_300"),
-        ],
+        [_quick(grams) for grams in quick],
         # ОСНОВНОЕ
         [InlineKeyboardButton(text="🍗 Взять порцию", callback_data="take")],
         [InlineKeyboardButton(text="➕ Новая партия", callback_data="new")],
@@ -28,58 +124,104 @@ def main_kb() -> InlineKeyboardMarkup:
     ])
 
 
-def take_kb() -> InlineKeyboardMarkup:
-    """Клавиатура выбора порции"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="100 г", callback_data="take_100"),
-            InlineKeyboardButton(text="150 г", callback_data="take_150"),
-        ],
-        [
-            InlineKeyboardButton(text="200 г", callback_data="take_200"),
-            InlineKeyboardButton(text="300 г", callback_data="take_300"),
-        ],
+@lru_cache(maxsize=128)
+def _take_kb(take: Tuple[int, ...]) -> InlineKeyboardMarkup:
+    """Клавиатура выбора порции: кнопки по две в ряд"""
+    buttons = [_take(grams) for grams in take]
+    return _static([
+        *(buttons[i:i + 2] for i in range(0, len(buttons), 2)),
         [InlineKeyboardButton(text="✍️ Другое", callback_data="take_other")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+        [_CANCEL],
     ])
 
+_CONFIRM_KB = {
+    action: _static([[
+        InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_{action}"),
+        InlineKeyboardButton(text="❌ Нет", callback_data="cancel"),
+    ]])
+    for action in ("clear_batch", "clear_history")
+}
+
+_ADMIN_KB = _static([
+    [InlineKeyboardButton(text="💾 Создать бэкап", callback_data="admin_backup")],
+    [InlineKeyboardButton(text="🗑 Очистить партию", callback_data="admin_clear_batch")],
+    [InlineKeyboardButton(text="📜 Очистить историю", callback_data="admin_clear_history")],
+    [_BACK],
+])
+
+_BACK_KB = _static([[_BACK]])
+
+_CANCEL_KB = _static([[_CANCEL]])
+
+_NOTE_KB = _static([
+    [InlineKeyboardButton(text="➡️ Пропустить", callback_data="skip_note")],
+    [_CANCEL],
+])
+
+_STATS_KB = _static([
+    [
+        InlineKeyboardButton(text="📊 Сегодня", callback_data="stats_today"),
+        InlineKeyboardButton(text="📈 Неделя", callback_data="stats_week"),
+    ],
+    [
+        InlineKeyboardButton(text="📅 Месяц", callback_data="stats_month"),
+        InlineKeyboardButton(text="🔬 За год", callback_data="stats_year"),
+    ],
+    [
+        InlineKeyboardButton(text="🏆 Рейтинг недели", callback_data="stats_top"),
+        InlineKeyboardButton(text="👤 Моя статистика", callback_data="stats_me"),
+    ],
+    [_BACK],
+])
+
+
+@lru_cache(maxsize=256)
+def main_kb(portions: Tuple[int, ...] = ()) -> InlineKeyboardMarkup:
+    """
+    Главное меню
+    
+    Args:
+        portions: частые порции чата (Database.get_quick_portions)
+    """
+    return _main_kb(_pick(portions, DEFAULT_QUICK))
+
+
+@lru_cache(maxsize=256)
+def take_kb(portions: Tuple[int, ...] = ()) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора порции
+    
+    Args:
+        portions: частые порции чата (Database.get_quick_portions)
+    """
+    return _take_kb(_pick(portions, DEFAULT_TAKE))
+
 
 def confirm_kb(action: str) -> InlineKeyboardMarkup:
-    """Клавиатура подтверждения действия"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_{action}"),
-            InlineKeyboardButton(text="❌ Нет", callback_data="cancel")
-        ]
-    ])
+    """Клавиатура подтверждения действия (clear_batch, clear_history)"""
+    return _CONFIRM_KB[action]
 
 
 def admin_kb() -> InlineKeyboardMarkup:
     """Клавиатура администратора"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💾 Создать бэкап", callback_data="admin_backup")],
-        [InlineKeyboardButton(text="🗑 Очистить партию", callback_data="admin_clear_batch")],
-        [InlineKeyboardButton(text="📜 Очистить историю", callback_data="admin_clear_history")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="cancel")]
-    ])
+    return _ADMIN_KB
 
 
 def back_kb() -> InlineKeyboardMarkup:
     """Простая кнопка назад"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="cancel")]
-    ])
+    return _BACK_KB
+
+
+def cancel_kb() -> InlineKeyboardMarkup:
+    """Кнопка отмены для шагов ввода"""
+    return _CANCEL_KB
+
+
+def note_kb() -> InlineKeyboardMarkup:
+    """Пропустить заметку к партии или отменить"""
+    return _NOTE_KB
 
 
 def stats_kb() -> InlineKeyboardMarkup:
     """Клавиатура статистики"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📊 Сегодня", callback_data="stats_today"),
-            InlineKeyboardButton(text="📈 Неделя", callback_data="stats_week"),
-        ],
-        [
-            InlineKeyboardButton(text="📅 Месяц", callback_data="stats_month"),
-        ],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="cancel")]
-    ])
+    return _STATS_KB
@@ -0,0 +1,78 @@
+"""
+Журнал запаса
+
+Остаток сырой у партий выводится из журнала событий тенанта, в который
+строки только добавляются: партия создана, взятие, поправка остатка,
+закрытие партий, отмена взятия. Колонка batch.raw_left - проекция
+журнала: она обновляется в той же транзакции, что и событие, поэтому
+текущий остаток читается одной строкой. Каждые SNAPSHOT_EVERY событий
+сохраняется снимок остатков, и пересборка проекции проигрывает только
+события после последнего снимка.
+
+Проигрывание - чистая функция над словарём «партия → остаток», её же
+можно вызвать на копии состояния, чтобы посчитать «что если».
+"""
+import json
+from typing import Dict, Iterable, Optional
+
+from records import LedgerEvent
+
+
+# Типы событий; amount - сырой вес в граммах
+BATCH_CREATED = "batch_created"  # партия открыта с остатком amount
+TAKE = "take"  # из партии взято amount
+ADJUST = "adjust"  # остаток исправлен на amount (может быть отрицательным)
+RESET = "reset"  # партия закрыта с остатком amount
+UNDO = "undo"  # взятие отменено, в партию возвращено amount
+
+SNAPSHOT_EVERY = 100
+
+Stock = Dict[int, float]
+
+
+def apply(stock: Stock, kind: str, batch_id: int, amount: float):
+    """Применить одно событие к остаткам (на месте)"""
+    if kind == BATCH_CREATED:
+        stock[batch_id] = amount
+    elif kind == TAKE:
+        left = stock.get(batch_id, 0.0) - amount
+        if left > 0:
+            stock[batch_id] = left
+        else:
+            # Опустевшая партия уходит в архив
+            stock.pop(batch_id, None)
+    elif kind in (ADJUST, UNDO):
+        stock[batch_id] = stock.get(batch_id, 0.0) + amount
+    elif kind == RESET:
+        stock.pop(batch_id, None)
+    else:
+        raise ValueError(f"Неизвестное событие журнала: {kind!r}")
+
+
+def replay(events: Iterable[LedgerEvent], stock: Optional[Stock] = None) -> Stock:
+    """
+    Остатки после событий
+    
+    Args:
+        events: события по возрастанию id
+        stock: остатки на начало (снимок); не изменяется
+    
+    Returns:
+        dict: партия → остаток сырой
+    """
+    result = dict(stock) if stock else {}
+    for event in events:
+        apply(result, event.kind, event.batch_id, event.amount)
+    return result
+
+
+def dump(stock: Stock) -> str:
+    """Остатки в JSON для ledger_snapshot"""
+    return json.dumps({str(batch_id): left for batch_id, left in stock.items()}, separators=(",", ":"))
+
+
+def load(text: Optional[str]) -> Stock:
+    """Остатки из JSON ledger_snapshot (None - пустой запас)"""
+    if not text:
+        return {}
+    return {int(batch_id): left for batch_id, left in json.loads(text).items()}
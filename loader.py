@@ -0,0 +1,104 @@
+"""
+Загрузка данных для рендеринга
+
+Рендерер объявляет, что ему нужно (партия, прогноз, последние записи
+истории, окно дневных итогов), а Database.load() достаёт всё за одно
+подключение: одинаковые потребности объединяются, из нескольких окон
+и лимитов истории читается только самое широкое.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from forecast import ConsumptionForecast
+from records import BatchSnapshot, DayTotals, HistoryEntry
+
+
+class Need(NamedTuple):
+    """Потребность рендерера: вид данных и параметр (лимит или дни)"""
+    kind: str
+    size: int = 0
+
+
+BATCH = Need("batch")
+FORECAST = Need("forecast")
+
+
+def history(limit: int) -> Need:
+    """Последние limit записей истории"""
+    return Need("history", limit)
+
+
+def rollup(days: int) -> Need:
+    """Дневные итоги за последние days дней (включая сегодня)"""
+    return Need("rollup", days)
+
+
+class Plan(NamedTuple):
+    """Свёрнутый набор потребностей: что и в каком объёме читать"""
+    batch: bool
+    forecast: bool
+    history_limit: int
+    rollup_days: int
+
+
+def plan(needs: Iterable[Need]) -> Plan:
+    """Объединить потребности: флаги по видам, максимум по размерам"""
+    batch = forecast = False
+    history_limit = rollup_days = 0
+    for need in needs:
+        if need.kind == "batch":
+            batch = True
+        elif need.kind == "forecast":
+            forecast = True
+        elif need.kind == "history":
+            history_limit = max(history_limit, need.size)
+        elif need.kind == "rollup":
+            rollup_days = max(rollup_days, need.size)
+        else:
+            raise ValueError(f"Неизвестная потребность: {need!r}")
+    return Plan(batch, forecast, history_limit, rollup_days)
+
+
+class RenderData:
+    """Результат Database.load()"""
+    
+    def __init__(self, now: datetime):
+        self.now = now
+        self.today = now.date()
+        self.batch: Optional[BatchSnapshot] = None
+        self.forecast: Optional[ConsumptionForecast] = None
+        self.history: List[HistoryEntry] = []
+        self.rollup: Dict[str, DayTotals] = {}
+    
+    def period_stats(self, days: int) -> Optional[Dict]:
+        """
+        Статистика за последние days дней из дневных итогов
+        
+        Returns:
+            dict: те же ключи, что у Statistics.get_period_stats, или None
+        """
+        start = self.today - timedelta(days=days - 1)
+        cutoff = start.isoformat()
+        
+        total_taken = 0.0
+        total_portions = 0
+        batches_created = 0
+        for day, totals in self.rollup.items():
+            if day >= cutoff:
+                total_taken += totals.taken
+                total_portions += totals.portions
+                batches_created += totals.batches
+        
+        if not (total_portions or batches_created):
+            return None
+        
+        return {
+            "days": days,
+            "total_taken": total_taken,
+            "total_portions": total_portions,
+            "batches_created": batches_created,
+            "avg_per_day": total_taken / days if days > 0 else 0,
+            "avg_portion": total_taken / total_portions if total_portions > 0 else 0,
+            "period_start": datetime.combine(start, datetime.min.time()),
+            "period_end": self.now,
+        }
@@ -0,0 +1,168 @@
+"""
+Настройка логирования
+
+Все записи уходят через QueueHandler в очередь, а форматирование и вывод
+выполняет QueueListener в фоновом потоке - запись лога не блокирует
+event loop. Поддерживаются JSON-формат и выборочное логирование
+(сэмплирование) частых событий по маршрутам.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# ID апдейта, который сейчас обрабатывается (выставляет LoggingMiddleware)
+update_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("update_id", default=None)
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись ID текущего апдейта"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "update_id", None) is None:
+            record.update_id = update_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Сэмплирование по маршрутам
+    
+    Запись с extra={"route": "callback:quick"} пропускается с вероятностью
+    из rates. Подходит и префикс маршрута: правило "callback" действует на все
+    callback'и, если для конкретного маршрута нет своего. WARNING и выше
+    не отбрасываются никогда.
+    """
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+    
+    def rate_for(self, route: str) -> float:
+        while route:
+            if route in self.rates:
+                return self.rates[route]
+            route = route.rpartition(":")[0]
+        return 1.0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        route = getattr(record, "route", None)
+        if route is None:
+            return True
+        rate = self.rate_for(route)
+        if rate >= 1.0:
+            return True
+        if rate > 0 and random.random() < rate:
+            record.sample_rate = rate
+            return True
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra попадают на верхний уровень"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _PreparingQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке event loop
+    
+    Стандартный prepare() вызывает format(); здесь только подставляются
+    аргументы и сохраняется трейсбек, а формат выбирает listener.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Разбор LOG_SAMPLE: "callback:quick=0.1,message=0.5"
+    
+    Returns:
+        dict: маршрут → доля сохраняемых записей (0.0-1.0)
+    """
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        route, _, value = part.partition("=")
+        try:
+            rates[route.strip()] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(
+    level: str = None,
+    fmt: str = None,
+    sample: str = None
+) -> QueueListener:
+    """
+    Настроить логирование через очередь и фоновый поток
+    
+    Args:
+        level: уровень (по умолчанию LOG_LEVEL или INFO)
+        fmt: "text" или "json" (по умолчанию LOG_FORMAT или text)
+        sample: правила сэмплирования (по умолчанию LOG_SAMPLE)
+    
+    Returns:
+        QueueListener: запущенный listener (stop() сбрасывает очередь)
+    """
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    rates = parse_sample_rates(sample if sample is not None else os.getenv("LOG_SAMPLE", ""))
+    
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _PreparingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(rates))
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    return listener
@@ -8,25 +8,36 @@ import os
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 from config import Config
 from database import Database
-from middlewares import LoggingMiddleware, ErrorHandlerMiddleware, TopicFilterMiddleware
+from middlewares import (
+    LoggingMiddleware,
+    ErrorHandlerMiddleware,
+    TenantMiddleware,
+    ProfilerMiddleware,
+    UpdateRecorderMiddleware,
+)
 from handlers import register_handlers
+from keyboards import KeyboardSession
 from backup import BackupManager
+from maintenance import MaintenanceJob
+from profiler import ProfilerManager
+from recorder import UpdateRecorder
+from retention import HistoryArchive, RetentionJob
+from sharding import run_supervisor
+from logging_setup import setup_logging
+from utils import WeightValidator
 
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Настройка логирования (вывод в фоновом потоке, см. logging_setup.py)
+setup_logging()
 
 log = logging.getLogger(__name__)
 
@@ -51,6 +62,142 @@ async def on_shutdown(bot: Bot):
     await bot.session.close()
 
 
+def create_bot(config: Config, session: BaseSession = None) -> Bot:
+    """
+    Создание экземпляра бота
+    
+    Args:
+        config: конфигурация
+        session: HTTP-сессия; по умолчанию KeyboardSession
+            (на config.bot_api_url, если задан)
+    """
+    if session is None:
+        session = (
+            KeyboardSession(api=TelegramAPIServer.from_base(config.bot_api_url))
+            if config.bot_api_url else KeyboardSession()
+        )
+    return Bot(
+        token=config.bot_token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def start_scheduler(bot: Bot, db: Database, config: Config, suffix: str = "") -> AsyncIOScheduler:
+    """
+    Запуск планировщика: очистка ключей идемпотентности, перенос старой
+    истории в архив, обслуживание файла БД и ежедневные бэкапы БД админам
+    
+    Args:
+        suffix: добавка к имени файла бэкапа и сегмента архива, подпись
+            отчёта об обслуживании (шард при SHARDS > 1)
+    """
+    scheduler = AsyncIOScheduler(timezone="UTC")
+    
+    # Ключи идемпотентности с истёкшим сроком - каждые 10 минут
+    scheduler.add_job(
+        db.sweep_idempotency_keys,
+        trigger=IntervalTrigger(minutes=10),
+        id="idempotency_sweep",
+        name="Очистка ключей идемпотентности",
+        replace_existing=True
+    )
+    
+    if config.history_retention_days > 0:
+        # Перенос истории в архив каждый день в 02:00 UTC - до бэкапа
+        retention = RetentionJob(
+            db,
+            HistoryArchive.for_db(db.db_path, config.archive_dir, suffix=suffix),
+            config.history_retention_days
+        )
+        scheduler.add_job(
+            retention.run,
+            trigger=CronTrigger(hour=2, minute=0),
+            id="history_retention",
+            name="Перенос старой истории в архив",
+            replace_existing=True
+        )
+        log.info(f"✅ История старше {config.history_retention_days} дн. уходит в архив (каждый день в 02:00 UTC)")
+    
+    # Обслуживание БД каждый день в 02:30 UTC: после переноса истории
+    # (освобождает её страницы) и до бэкапа (он получает сжатый файл)
+    maintenance = MaintenanceJob(db.db_path, suffix=suffix)
+    scheduler.add_job(
+        maintenance.auto_maintenance,
+        trigger=CronTrigger(hour=2, minute=30),
+        args=[bot, config.admin_ids],
+        id="db_maintenance",
+        name="Обслуживание БД",
+        replace_existing=True
+    )
+    
+    if config.admin_ids:
+        # Автобэкап каждый день в 03:00 UTC (06:00 MSK)
+        backup_manager = BackupManager(db.db_path, suffix=suffix)
+        scheduler.add_job(
+            backup_manager.auto_backup,
+            trigger=CronTrigger(hour=3, minute=0),
+            args=[bot, config.admin_ids],
+            id="daily_backup",
+            name="Ежедневный автобэкап БД",
+            replace_existing=True
+        )
+        log.info("✅ Автобэкапы включены (каждый день в 03:00 UTC)")
+    else:
+        log.warning("⚠️ Автобэкапы отключены: администраторы не настроены")
+    
+    scheduler.start()
+    log.info("✅ Планировщик запущен")
+    return scheduler
+
+
+def create_dispatcher(db: Database, config: Config) -> Dispatcher:
+    """
+    Создание диспетчера с middleware, обработчиками и зависимостями
+    
+    Используется и ботом, и бенчмарками (benchmarks/), чтобы нагрузка
+    шла через тот же путь обработки апдейтов.
+    """
+    dp = Dispatcher()
+    
+    # Запись апдейтов (самый внешний слой - время включает всю обработку)
+    if config.record_updates_path:
+        recorder = UpdateRecorder(
+            config.record_updates_path,
+            max_bytes=config.record_max_bytes,
+            backup_count=config.record_backups
+        )
+        dp.update.outer_middleware(UpdateRecorderMiddleware(recorder))
+    
+    # Профилировщик по запросу (/profile) считает все апдейты
+    profiler = ProfilerManager(config.db_path)
+    dp.update.outer_middleware(ProfilerMiddleware(profiler))
+    
+    # Регистрация middleware
+    # Тенант определяется ПЕРВЫМ: выключенные чаты отсекаются до фильтров,
+    # а обработчики получают db своего чата и топика
+    tenants = TenantMiddleware(db, config)
+    dp.message.outer_middleware(tenants)
+    dp.callback_query.outer_middleware(tenants)
+    
+    dp.message.middleware(LoggingMiddleware())
+    dp.callback_query.middleware(LoggingMiddleware())
+    dp.message.middleware(ErrorHandlerMiddleware())
+    dp.callback_query.middleware(ErrorHandlerMiddleware())
+    
+    # Регистрация обработчиков
+    register_handlers(dp)
+    
+    # Передача зависимостей в обработчики
+    dp["db"] = db
+    dp["config"] = config
+    dp["profiler"] = profiler
+    dp["validator"] = WeightValidator.from_config(config)
+    dp["archive"] = HistoryArchive.for_db(config.db_path, config.archive_dir)
+    
+    return dp
+
+
 async def main():
     """Главная функция"""
     try:
@@ -65,56 +212,27 @@ async def main():
             os.makedirs(db_dir, exist_ok=True)
             log.info(f"Создана директория для БД: {db_dir}")
         
+        # Режим шардов: этот процесс только раздаёт апдейты рабочим
+        if config.shards > 1:
+            bot = create_bot(config)
+            await on_startup(bot, config)
+            try:
+                await run_supervisor(config, bot)
+            finally:
+                await on_shutdown(bot)
+            return
+        
         # Инициализация базы данных
         db = Database(config.db_path, timezone_offset=config.timezone_offset)
-        await db.init()
+        await db.init(legacy_thread_id=config.topic_id)
         log.info(f"База данных инициализирована: {config.db_path} (часовой пояс: UTC{config.timezone_offset:+d})")
         
         # Создание бота и диспетчера
-        bot = Bot(
-            token=config.bot_token,
-            default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-        )
-        
-        dp = Dispatcher()
-        
-        # Регистрация middleware
-        # TopicFilter должен быть ПЕРВЫМ (фильтрует до всего остального)
-        if config.topic_id:
-            dp.message.middleware(TopicFilterMiddleware(config.topic_id))
-            log.info(f"Бот будет работать только в топике ID: {config.topic_id}")
-        
-        dp.message.middleware(LoggingMiddleware())
-        dp.callback_query.middleware(LoggingMiddleware())
-        dp.message.middleware(ErrorHandlerMiddleware())
-        dp.callback_query.middleware(ErrorHandlerMiddleware())
+        bot = create_bot(config)
+        dp = create_dispatcher(db, config)
         
-        # Регистрация обработчиков
-        register_handlers(dp)
-        
-        # Передача зависимостей в обработчики
-        dp["db"] = db
-        dp["config"] = config
-        
-        # Настройка автоматических бэкапов
-        if config.admin_ids:
-            backup_manager = BackupManager(db.db_path)
-            scheduler = AsyncIOScheduler(timezone="UTC")
-            
-            # Автобэкап каждый день в 03:00 UTC (06:00 MSK)
-            scheduler.add_job(
-                backup_manager.auto_backup,
-                trigger=CronTrigger(hour=3, minute=0),
-                args=[bot, config.admin_ids],
-                id="daily_backup",
-                name="Ежедневный автобэкап БД",
-                replace_existing=True
-            )
-            
-            scheduler.start()
-            log.info("✅ Планировщик автобэкапов запущен (каждый день в 03:00 UTC)")
-        else:
-            log.warning("⚠️ Автобэкапы отключены: администраторы не настроены")
+        # Фоновые задачи: очистка ключей идемпотентности, архив истории, обслуживание БД и автобэкапы
+        start_scheduler(bot, db, config)
         
         # Запуск бота
         await on_startup(bot, config)
@@ -0,0 +1,171 @@
+"""
+Обслуживание базы данных
+
+Раз в сутки, в тихие часы, планировщик проверяет файл БД (quick_check),
+обновляет статистику планировщика запросов (ANALYZE и PRAGMA optimize),
+возвращает файлу свободные страницы (incremental_vacuum - после
+clear_history, /reset и переноса истории в архив) и, если БД в режиме
+WAL, сбрасывает журнал в основной файл (wal_checkpoint). Всё выполняется отдельным
+подключением в рабочем потоке, чтобы не задерживать апдейты; админам
+приходит короткий отчёт со временем шагов и размером файла.
+"""
+import asyncio
+import html
+import logging
+import os
+import sqlite3
+import time
+from typing import List, NamedTuple
+
+from aiogram import Bot
+
+
+log = logging.getLogger(__name__)
+
+
+class MaintenanceStep(NamedTuple):
+    """Один шаг обслуживания"""
+    name: str
+    seconds: float
+    result: str
+
+
+class MaintenanceReport(NamedTuple):
+    """Итог обслуживания"""
+    steps: List[MaintenanceStep]
+    size_before: int  # байт: файл БД
+    size_after: int
+    journal_mode: str  # PRAGMA journal_mode: wal, delete, ...
+    wal_before: int  # байт: файл -wal (0, если его нет)
+    wal_after: int
+    healthy: bool  # quick_check вернул ok
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class MaintenanceJob:
+    """Обслуживание файла БД по расписанию"""
+    
+    # Сколько ждать, пока бот держит блокировку записи
+    BUSY_TIMEOUT = 30.0
+    
+    def __init__(self, db_path: str, suffix: str = ""):
+        """
+        Args:
+            db_path: путь к файлу БД
+            suffix: подпись в отчёте (шард при SHARDS > 1)
+        """
+        self.db_path = db_path
+        self.suffix = suffix
+        self.label = f" ({suffix.strip('_')})" if suffix else ""
+    
+    def _run(self) -> MaintenanceReport:
+        """Все шаги подряд (в рабочем потоке)"""
+        wal_path = self.db_path + "-wal"
+        size_before, wal_before = _size(self.db_path), _size(wal_path)
+        steps = []
+        
+        # isolation_level=None: ANALYZE и прагмы идут без неявной транзакции
+        conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+        try:
+            def step(name: str, run) -> str:
+                started = time.perf_counter()
+                result = run()
+                steps.append(MaintenanceStep(name, time.perf_counter() - started, result))
+                return result
+            
+            def execute(sql: str) -> str:
+                conn.execute(sql)
+                return "ok"
+            
+            # Первые 10 ошибок хватит, чтобы понять, что файл повреждён
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            problems = step("quick_check", lambda: "; ".join(
+                row[0] for row in conn.execute("PRAGMA quick_check(10)")
+            ))
+            healthy = problems == "ok"
+            if healthy:
+                step("ANALYZE", lambda: execute("ANALYZE"))
+                step("optimize", lambda: execute("PRAGMA optimize"))
+                
+                def vacuum() -> str:
+                    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    # Через execute прагма освободила бы одну страницу за вызов
+                    conn.executescript("PRAGMA incremental_vacuum")
+                    return f"страниц освобождено: {free - conn.execute('PRAGMA freelist_count').fetchone()[0]}"
+                step("incremental_vacuum", vacuum)
+                
+                if journal_mode == "wal":
+                    step("wal_checkpoint", lambda: "busy={} log={} checkpointed={}".format(
+                        *conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                    ))
+        finally:
+            conn.close()
+        
+        return MaintenanceReport(
+            steps=steps,
+            size_before=size_before,
+            size_after=_size(self.db_path),
+            journal_mode=journal_mode,
+            wal_before=wal_before,
+            wal_after=_size(wal_path),
+            healthy=healthy,
+        )
+    
+    async def run(self) -> MaintenanceReport:
+        """Обслужить БД в рабочем потоке"""
+        report = await asyncio.to_thread(self._run)
+        log.info(
+            f"🧰 Обслуживание БД{self.label}: "
+            + ", ".join(f"{s.name} {s.seconds * 1000:.0f} мс" for s in report.steps)
+            + f"; {report.size_before / 1024:.1f} → {report.size_after / 1024:.1f} KB"
+        )
+        if not report.healthy:
+            log.error(f"❌ quick_check БД{self.label}: {report.steps[0].result}")
+        return report
+    
+    def format_report(self, report: MaintenanceReport) -> str:
+        """Отчёт для админов (HTML)"""
+        title = ("🧰 <b>Обслуживание БД</b>" if report.healthy else "⚠️ <b>БД повреждена</b>") + self.label
+        lines = [
+            f"• {s.name}: {s.seconds * 1000:.0f} мс" + ("" if s.result == "ok" else f" - {html.escape(s.result)}")
+            for s in report.steps
+        ]
+        if report.journal_mode == "wal":
+            wal = f"{report.wal_before / 1024:.1f} → {report.wal_after / 1024:.1f} KB"
+        else:
+            wal = f"выключен, журнал {html.escape(report.journal_mode)}"
+        return (
+            f"{title}\n\n" + "\n".join(lines) + "\n\n"
+            f"📦 Файл: {report.size_before / 1024:.1f} → {report.size_after / 1024:.1f} KB\n"
+            f"📝 WAL: {wal}"
+        )
+    
+    async def auto_maintenance(self, bot: Bot, admin_ids: List[int]) -> bool:
+        """
+        Обслуживание с отчётом админам (вызывать по расписанию)
+        
+        Returns:
+            bool: файл БД в порядке
+        """
+        try:
+            report = await self.run()
+            text = self.format_report(report)
+            healthy = report.healthy
+        except sqlite3.Error as e:
+            # Например, "database disk image is malformed" уже на quick_check
+            log.error(f"❌ Ошибка обслуживания БД{self.label}: {e}", exc_info=True)
+            text = f"⚠️ <b>Обслуживание БД не выполнено</b>{self.label}\n\n{html.escape(str(e))}"
+            healthy = False
+        
+        for admin_id in admin_ids:
+            try:
+                await bot.send_message(admin_id, text)
+            except Exception as e:
+                log.error(f"❌ Не удалось отправить отчёт админу {admin_id}: {e}")
+        return healthy
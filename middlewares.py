@@ -2,25 +2,49 @@
 Middleware для бота
 """
 import logging
-from typing import Callable, Dict, Any, Awaitable
+import time
+from typing import Callable, Dict, Any, Awaitable, Optional, Tuple
 
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, TelegramObject
 
+from config import Config
+from database import Database
+from logging_setup import update_id_var
+
 
 log = logging.getLogger(__name__)
 
 
-class TopicFilterMiddleware(BaseMiddleware):
-    """Middleware для фильтрации по топику (ветке) в группе"""
+def tenant_of(event: TelegramObject) -> Optional[Tuple[int, int]]:
+    """
+    (chat_id, thread_id) события; thread_id = 0 вне топиков
     
-    def __init__(self, topic_id: int = None):
-        """
-        Args:
-            topic_id: ID топика где должен работать бот (None = работает везде)
-        """
+    Для callback берётся сообщение с кнопкой. Если оно недоступно
+    (слишком старое), тенант не определить - возвращается None.
+    """
+    message = event if isinstance(event, Message) else getattr(event, "message", None)
+    if not isinstance(message, Message):
+        return None
+    thread_id = message.message_thread_id if message.is_topic_message else 0
+    return message.chat.id, thread_id or 0
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Привязка события к чату и топику
+    
+    Подставляет в обработчики db того тенанта, откуда пришло событие
+    (Database.for_tenant). Новые чаты и топики регистрируются включёнными
+    только в топике TOPIC_ID (или везде, если он не задан); в выключенном
+    обрабатывается только /enable от админа. Пропущенные callback
+    получают ответ, чтобы у пользователя не крутился индикатор загрузки.
+    """
+    
+    def __init__(self, db: Database, config: Config):
         super().__init__()
-        self.topic_id = topic_id
+        self.db = db
+        self.config = config
     
     async def __call__(
         self,
@@ -28,32 +52,50 @@ class TopicFilterMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        """Проверка топика"""
+        tenant = tenant_of(event)
+        if tenant is None:
+            log.debug("Не удалось определить чат события - пропускаем")
+            return await self._skip(event, "⌛ Сообщение устарело, открой меню заново")
         
-        # Если топик не указан - пропускаем все
-        if self.topic_id is None:
-            return await handler(event, data)
+        settings = await self.db.get_tenant(*tenant)
+        if settings is None:
+            return await self._skip(event, "😔 Произошла ошибка. Попробуй ещё раз")
         
-        # Проверяем только сообщения (не callback)
-        if isinstance(event, Message):
-            # Получаем ID топика из сообщения
-            message_thread_id = event.message_thread_id
-            
-            # Логируем для отладки
-            if message_thread_id:
-                log.debug(f"Сообщение из топика {message_thread_id}")
-            
-            # Если сообщение не из нужного топика - игнорируем
-            if message_thread_id != self.topic_id:
-                log.debug(f"Игнорируем сообщение из топика {message_thread_id} (нужен {self.topic_id})")
-                return None
+        if not settings.enabled and not self._enabling(event):
+            log.debug(f"Бот выключен в чате {tenant[0]}, топик {tenant[1]} - игнорируем")
+            return await self._skip(event)
         
-        # Callback всегда обрабатываем (они от кнопок)
+        data["db"] = self.db.for_tenant(*tenant)
         return await handler(event, data)
+    
+    @staticmethod
+    async def _skip(event: TelegramObject, text: Optional[str] = None) -> None:
+        """Не обрабатывать событие; callback всё равно нужно подтвердить"""
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer(text)
+            except Exception as e:
+                log.error(f"Не удалось ответить на callback: {e}")
+        return None
+    
+    def _enabling(self, event: TelegramObject) -> bool:
+        """Команда /enable от администратора"""
+        return (
+            isinstance(event, Message)
+            and (event.text or "").split("@")[0].strip() == "/enable"
+            and event.from_user is not None
+            and self.config.is_admin(event.from_user.id)
+        )
 
 
 class LoggingMiddleware(BaseMiddleware):
-    """Middleware для логирования сообщений и callback'ов"""
+    """
+    Middleware для логирования сообщений и callback'ов
+    
+    Пишет одну структурированную запись на событие после обработки:
+    маршрут (для сэмплирования), пользователь и время обработки.
+    Выставляет ID апдейта для всех логов внутри обработчика.
+    """
     
     async def __call__(
         self,
@@ -62,19 +104,32 @@ class LoggingMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         """Обработка события"""
-        
-        if isinstance(event, Message):
-            user = event.from_user
-            username = f"@{user.username}" if user.username else "no_username"
-            text = event.text[:50] if event.text else "[no_text]"
-            log.info(f"Message from {user.id} ({username}): {text}")
+        event_update = data.get("event_update")
+        token = update_id_var.set(event_update.update_id if event_update else None)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
             
-        elif isinstance(event, CallbackQuery):
-            user = event.from_user
-            username = f"@{user.username}" if user.username else "no_username"
-            log.info(f"Callback from {user.id} ({username}): {event.data}")
-        
-        return await handler(event, data)
+            if isinstance(event, Message):
+                text = event.text[:50] if event.text else "[no_text]"
+                route = "command" if text.startswith("/") else "message"
+                log.info(
+                    "Message from %s: %s", event.from_user.id, text,
+                    extra={"route": route, "user_id": event.from_user.id, "latency_ms": latency_ms}
+                )
+                
+            elif isinstance(event, CallbackQuery):
+                callback_data = event.data or ""
+                # "quick:200" и "stats_today" → callback:quick, callback:stats
+                route = "callback:" + callback_data.partition(":")[0].split("_")[0]
+                log.info(
+                    "Callback from %s: %s", event.from_user.id, callback_data,
+                    extra={"route": route, "user_id": event.from_user.id, "latency_ms": latency_ms}
+                )
+            
+            update_id_var.reset(token)
 
 
 class ErrorHandlerMiddleware(BaseMiddleware):
@@ -107,3 +162,56 @@ class ErrorHandlerMiddleware(BaseMiddleware):
                 log.error(f"Не удалось уведомить пользователя об ошибке: {notify_error}")
             
             return None
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """Middleware для подсчёта апдейтов во время профилирования"""
+    
+    def __init__(self, profiler):
+        """
+        Args:
+            profiler: экземпляр ProfilerManager
+        """
+        super().__init__()
+        self.profiler = profiler
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка события с отметкой в профилировщике"""
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.on_update()
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Middleware для записи апдейтов с временем обработки (см. recorder.py)"""
+    
+    def __init__(self, recorder):
+        """
+        Args:
+            recorder: экземпляр UpdateRecorder
+        """
+        super().__init__()
+        self.recorder = recorder
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка события с записью в журнал"""
+        received_at = time.time()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                self.recorder.record(event, received_at, time.perf_counter() - started)
+            except Exception as e:
+                log.error(f"Не удалось записать апдейт: {e}")
@@ -7,6 +7,7 @@ from typing import Optional
 
 from aiogram import Bot
 from database import Database
+from forecast import format_forecast
 
 
 log = logging.getLogger(__name__)
@@ -40,8 +41,8 @@ class NotificationManager:
             if not batch:
                 return
             
-            raw_left = batch["raw_left"]
-            raw_total = batch["raw_total"]
+            raw_left = batch.raw_left
+            raw_total = batch.raw_total
             percentage = (raw_left / raw_total) * 100 if raw_total > 0 else 0
             
             # Критически низкий остаток (< 10%)
@@ -51,8 +52,11 @@ class NotificationManager:
                 )
             # Низкий остаток (< 20%)
             elif percentage < 20:
+                forecast = format_forecast(
+                    await self.db.get_forecast(), raw_left, self.db.local_now()
+                )
                 await self._send_low_alert(
-                    bot, chat_id, raw_left, percentage, message_thread_id
+                    bot, chat_id, raw_left, percentage, message_thread_id, forecast
                 )
             # Средний остаток (< 40%)
             elif percentage < 40:
@@ -100,7 +104,8 @@ class NotificationManager:
         chat_id: int,
         raw_left: float,
         percentage: float,
-        message_thread_id: int = None
+        message_thread_id: int = None,
+        forecast: Optional[str] = None
     ):
         """Предупреждение о низком остатке"""
         # Отправлять не чаще раза в 12 часов
@@ -112,7 +117,7 @@ class NotificationManager:
             "🔴 <b>Остаток низкий!</b>\n\n"
             f"Осталось <b>{int(raw_left)} г</b> ({int(percentage)}%)\n\n"
             "💡 <b>Подумай о новой партии</b>\n"
-            "Через 1-2 дня может закончиться"
+            + (f"По прогнозу {forecast}" if forecast else "Через 1-2 дня может закончиться")
         )
         
         try:
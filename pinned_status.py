@@ -7,6 +7,8 @@ from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
 
 from database import Database
+from forecast import format_forecast
+from utils.render import STATUS_NEEDS
 from utils.status_formatter import format_status_message
 
 
@@ -32,20 +34,28 @@ async def update_pinned_status(
         bool: успешно ли обновлено
     """
     try:
-        # Получить данные партии
-        batch = await db.get_batch()
+        # Версии читаются до запроса: запись между ними лишь сделает ключ устаревшим
+        versions = db.versions
+        
+        # Партия и прогноз - всё, что нужно статусу
+        data = await db.load(STATUS_NEEDS)
+        batch = data.batch
         if not batch:
             log.debug("Партия не найдена, закреп не обновляется")
             return False
         
-        # Получить историю для прогноза
-        history = await db.get_history(limit=50)
+        forecast = format_forecast(data.forecast, batch.raw_left, data.now)
         
         # Форматировать сообщение с учётом часового пояса
-        status_text = format_status_message(batch, history, timezone_offset=db.timezone_offset)
+        status_text = format_status_message(
+            batch,
+            timezone_offset=db.timezone_offset,
+            versions=versions,
+            forecast=forecast
+        )
         
         # Получить ID старого закреплённого сообщения
-        old_pinned_id = batch["pinned_msg_id"] if "pinned_msg_id" in batch.keys() else None
+        old_pinned_id = batch.pinned_msg_id
         
         # Попытка обновить существующее сообщение
         if old_pinned_id:
@@ -55,9 +65,16 @@ async def update_pinned_status(
                     chat_id=chat_id,
                     message_id=old_pinned_id
                 )
-                log.info(f"✅ ОБНОВЛЕНО сообщение со статусом (ID: {old_pinned_id})")
+                log.info(
+                    "✅ ОБНОВЛЕНО сообщение со статусом (ID: %s)", old_pinned_id,
+                    extra={"route": "pinned:update"}
+                )
                 return True
             except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    # Статус не изменился - закреп актуален, новое сообщение не нужно
+                    log.debug(f"Статус в сообщении {old_pinned_id} не изменился")
+                    return True
                 log.warning(f"⚠️ Не удалось обновить сообщение {old_pinned_id}: {e}")
                 log.info("Создаём новое сообщение со статусом...")
         
@@ -72,16 +89,12 @@ async def update_pinned_status(
         await db.update_pinned_msg_id(new_msg.message_id)
         
         # ВАЖНО: НЕ ЗАКРЕПЛЯЕМ АВТОМАТИЧЕСКИ!
-        # В топиках Telegram это работает некорректно
-        log.info("=" * 60)
-        log.info(f"📌 СОЗДАНО сообщение со статусом!")
-        log.info(f"📝 ID сообщения: {new_msg.message_id}")
-        log.info("")
-        log.info("⚠️  ЗАКРЕПИ ЕГО ВРУЧНУЮ:")
-        log.info("   1. Найди сообщение со статусом (📊 СТАТУС ПАРТИИ)")
-        log.info("   2. Нажми на него → Закрепить")
-        log.info("   3. Готово! Дальше бот будет обновлять его автоматически")
-        log.info("=" * 60)
+        # В топиках Telegram это работает некорректно - закрепить нужно вручную
+        log.info(
+            "📌 СОЗДАНО сообщение со статусом (ID: %s) - закрепи его вручную",
+            new_msg.message_id,
+            extra={"pinned_msg_id": new_msg.message_id}
+        )
         
         return True
         
@@ -103,11 +116,7 @@ async def unpin_status(bot: Bot, chat_id: int, db: Database) -> bool:
         bool: успешно ли откреплено
     """
     try:
-        batch = await db.get_batch()
-        if not batch:
-            return False
-        
-        pinned_id = batch["pinned_msg_id"] if "pinned_msg_id" in batch.keys() else None
+        pinned_id = await db.get_pinned_msg_id()
         if not pinned_id:
             return False
         
@@ -0,0 +1,204 @@
+"""
+Профилирование бота по запросу администратора
+"""
+import asyncio
+import cProfile
+import html
+import io
+import logging
+import os
+import pstats
+import time
+from datetime import datetime
+from typing import Optional
+
+from aiogram import Bot
+
+from backup import BackupManager
+
+
+log = logging.getLogger(__name__)
+
+
+class ProfilerManager:
+    """
+    Менеджер профилирования
+    
+    Включает cProfile на N секунд или на N обработанных апдейтов.
+    Профилировщик работает в потоке event loop, поэтому в отчёт попадают
+    хендлеры, методы Database и форматирование сообщений. Сами SQL-запросы
+    выполняются в потоке aiosqlite и видны как время ожидания.
+    """
+    
+    MAX_SECONDS = 600
+    MAX_UPDATES = 10000
+    TOP_FUNCTIONS = 30
+    REPORT_LIMIT = 3500  # символов, с запасом до лимита Telegram в 4096
+    
+    def __init__(self, db_path: str, profile_dir: str = "/tmp/profiles"):
+        """
+        Args:
+            db_path: путь к файлу БД (для BackupManager)
+            profile_dir: директория для файлов профиля
+        """
+        self.db_path = db_path
+        self.profile_dir = profile_dir
+        
+        self._profile: Optional[cProfile.Profile] = None
+        self._bot: Optional[Bot] = None
+        self._admin_id: Optional[int] = None
+        self._started_at = 0.0
+        self._updates_left: Optional[int] = None
+        self._updates_seen = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._finishing = False
+        
+        os.makedirs(profile_dir, exist_ok=True)
+    
+    @property
+    def active(self) -> bool:
+        """Идёт ли сейчас профилирование"""
+        return self._profile is not None
+    
+    def start(
+        self,
+        bot: Bot,
+        admin_id: int,
+        seconds: int = None,
+        updates: int = None
+    ) -> bool:
+        """
+        Запустить профилирование
+        
+        Args:
+            bot: экземпляр бота
+            admin_id: кому отправить отчёт
+            seconds: длительность в секундах
+            updates: количество апдейтов
+        
+        Returns:
+            bool: False если профилирование уже идёт
+        """
+        if self.active:
+            return False
+        
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Другой профилировщик уже активен в этом потоке
+            log.warning(f"Не удалось включить профилировщик: {e}")
+            return False
+        
+        self._profile = profile
+        self._bot = bot
+        self._admin_id = admin_id
+        self._started_at = time.perf_counter()
+        self._updates_left = updates
+        self._updates_seen = 0
+        self._finishing = False
+        
+        if seconds:
+            self._timer = asyncio.create_task(self._stop_after(seconds))
+        
+        log.info(f"🔬 Профилирование запущено: seconds={seconds}, updates={updates}, admin={admin_id}")
+        return True
+    
+    def on_update(self):
+        """Учесть обработанный апдейт (вызывается из ProfilerMiddleware)"""
+        if not self.active or self._finishing:
+            return
+        
+        self._updates_seen += 1
+        
+        if self._updates_left is not None:
+            self._updates_left -= 1
+            if self._updates_left <= 0:
+                self._finishing = True
+                asyncio.create_task(self.finish())
+    
+    async def _stop_after(self, seconds: int):
+        """Остановить профилирование по таймеру"""
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            return
+        self._finishing = True
+        await self.finish()
+    
+    async def finish(self) -> bool:
+        """
+        Остановить профилирование и отправить отчёт администратору
+        
+        Returns:
+            bool: успешно ли отправлен отчёт
+        """
+        profile = self._profile
+        if profile is None:
+            return False
+        
+        profile.disable()
+        self._profile = None
+        
+        if self._timer and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        
+        elapsed = time.perf_counter() - self._started_at
+        bot, admin_id = self._bot, self._admin_id
+        self._bot = self._admin_id = None
+        
+        try:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            profile_path = os.path.join(self.profile_dir, f"chicken_profile_{timestamp}.prof")
+            profile.dump_stats(profile_path)
+            
+            report = self.format_report(profile)
+            
+            await bot.send_message(
+                chat_id=admin_id,
+                text=(
+                    f"🔬 <b>Профиль готов</b>\n\n"
+                    f"⏱ Длительность: {elapsed:.1f} с\n"
+                    f"📨 Апдейтов: {self._updates_seen}\n\n"
+                    f"<pre>{html.escape(report)}</pre>"
+                )
+            )
+            
+            caption = (
+                f"🔬 <b>Сырой профиль</b>\n\n"
+                f"Открыть: <code>python -m pstats {os.path.basename(profile_path)}</code>\n"
+                f"или snakeviz / tuna"
+            )
+            backup_manager = BackupManager(self.db_path)
+            success = await backup_manager.send_file_to_admin(bot, admin_id, profile_path, caption)
+            
+            log.info(f"🔬 Профилирование завершено: {elapsed:.1f} с, {self._updates_seen} апдейтов")
+            return success
+        
+        except Exception as e:
+            log.error(f"❌ Ошибка отправки профиля: {e}", exc_info=True)
+            return False
+    
+    def format_report(self, profile: cProfile.Profile) -> str:
+        """
+        Сформировать текстовый отчёт: топ функций по суммарному времени
+        
+        Args:
+            profile: остановленный профилировщик
+        
+        Returns:
+            str: отчёт, обрезанный под лимит сообщения
+        """
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.TOP_FUNCTIONS)
+        
+        # Заголовок pstats содержит пустые строки и служебный текст
+        lines = [line.rstrip() for line in stream.getvalue().splitlines() if line.strip()]
+        report = "\n".join(lines)
+        
+        if len(report) > self.REPORT_LIMIT:
+            report = report[:self.REPORT_LIMIT] + "\n…"
+        
+        return report
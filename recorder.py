@@ -0,0 +1,116 @@
+"""
+Запись входящих апдейтов в JSONL для последующего воспроизведения
+"""
+import json
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+from typing import Iterator, List
+
+from aiogram.types import Update
+
+
+log = logging.getLogger(__name__)
+
+
+class UpdateRecorder:
+    """
+    Пишет каждый апдейт одной JSON-строкой:
+    {"ts": время получения, "duration_ms": время обработки, "update": {...}}
+    
+    Ротация и ограничение размера - через RotatingFileHandler:
+    файл path переименовывается в path.1, path.1 в path.2 и т.д.
+    """
+    
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5):
+        """
+        Args:
+            path: путь к JSONL-файлу
+            max_bytes: размер файла, после которого он ротируется
+            backup_count: сколько ротированных файлов хранить
+        """
+        self.path = path
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._handler = RotatingFileHandler(
+            path,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        
+        # Отдельный логгер, чтобы записи не попадали в общий лог
+        self._logger = logging.getLogger(f"{__name__}.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(self._handler)
+        
+        log.info(f"Запись апдейтов включена: {path} (до {max_bytes // 1024} KB x {backup_count + 1})")
+    
+    def record(self, update: Update, received_at: float, duration: float):
+        """
+        Записать апдейт
+        
+        Args:
+            update: апдейт
+            received_at: время получения (time.time())
+            duration: время обработки в секундах
+        """
+        line = json.dumps(
+            {
+                "ts": round(received_at, 6),
+                "duration_ms": round(duration * 1000, 3),
+                "update": update.model_dump(mode="json", by_alias=True, exclude_none=True),
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        self._logger.info(line)
+    
+    def close(self):
+        """Закрыть файл"""
+        self._logger.removeHandler(self._handler)
+        self._handler.close()
+
+
+def recorded_files(path: str) -> List[str]:
+    """
+    Файлы записи в хронологическом порядке (path.N ... path.1, path)
+    
+    Args:
+        path: путь к основному JSONL-файлу
+    """
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    files = list(reversed(rotated))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Прочитать записи из файла и его ротированных копий
+    
+    Строки пишутся по завершении обработки, поэтому при параллельной
+    обработке порядок в файле может отличаться от порядка получения -
+    для воспроизведения записи нужно сортировать по "ts".
+    Битые строки (например, обрезанные при падении) пропускаются.
+    """
+    for filename in recorded_files(path):
+        with open(filename, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning(f"Пропущена битая строка {filename}:{line_no}")
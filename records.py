@@ -0,0 +1,241 @@
+"""
+Записи БД
+
+Строки таблиц приходят из Database сразу неизменяемыми dataclass
+со __slots__: поля читаются как атрибуты, а не поиском по строке
+в aiosqlite.Row, и у записи нет собственного словаря.
+
+Для массового анализа истории (сотни и тысячи строк) есть колоночный
+HistoryColumns: числа лежат в array, а не в отдельных объектах.
+"""
+from array import array
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar
+
+
+R = TypeVar("R")
+
+
+@dataclass(frozen=True, slots=True)
+class OpenBatch:
+    """Открытая партия (таблица batch)"""
+    id: int
+    raw_total: float
+    raw_left: float
+    cooked_total: float
+    coef: float
+    created: str
+    note: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class ArchivedBatch:
+    """
+    Закрытая партия (таблица batch_archive)
+    
+    reason: finished - съедена, reset - удалена админом, replaced - заменена
+    новой партией до появления нескольких партий (восстановлена из истории,
+    raw_left и batch_id неизвестны)
+    """
+    id: int
+    batch_id: Optional[int]
+    raw_total: float
+    raw_left: Optional[float]
+    cooked_total: float
+    coef: float
+    created: str
+    closed: str
+    reason: str
+    note: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class BatchSnapshot:
+    """
+    Запас чата: все открытые партии одной записью
+    
+    id и created - самой старой партии (из неё берутся порции), coef -
+    средний по остатку, note - заметки партий через «; ». С одной
+    партией совпадает с ней.
+    """
+    id: int
+    raw_total: float
+    raw_left: float
+    cooked_total: float
+    coef: float
+    created: str
+    note: Optional[str] = None
+    pinned_msg_id: Optional[int] = None
+    batches: int = 1
+    
+    @property
+    def percent_left(self) -> float:
+        """Доля оставшейся сырой, 0..1"""
+        return self.raw_left / self.raw_total if self.raw_total > 0 else 0.0
+    
+    @classmethod
+    def from_batches(
+        cls,
+        batches: Sequence[OpenBatch],
+        pinned_msg_id: Optional[int] = None
+    ) -> Optional["BatchSnapshot"]:
+        """Свести открытые партии (по возрастанию created) в запас; None, если партий нет"""
+        if not batches:
+            return None
+        head = batches[0]
+        raw_total = sum(b.raw_total for b in batches)
+        raw_left = sum(b.raw_left for b in batches)
+        cooked_total = sum(b.cooked_total for b in batches)
+        if len(batches) == 1:
+            coef = head.coef
+        elif raw_left > 0:
+            coef = sum(b.raw_left * b.coef for b in batches) / raw_left
+        else:
+            coef = cooked_total / raw_total
+        note = "; ".join(b.note for b in batches if b.note) or None
+        return cls(
+            head.id, raw_total, raw_left, cooked_total, coef, head.created,
+            note, pinned_msg_id, len(batches)
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryEntry:
+    """Запись истории операций (таблица history)"""
+    id: int
+    action_type: str
+    text: str
+    created: str
+
+
+@dataclass(frozen=True, slots=True)
+class TrackedMessage:
+    """Сообщение бота для автоудаления (таблица messages)"""
+    id: int
+    msg_id: int
+    chat_id: int
+    created: str
+
+
+@dataclass(frozen=True, slots=True)
+class DayTotals:
+    """Итоги дня (таблица daily_rollup)"""
+    day: str
+    taken: float
+    portions: int
+    batches: int
+
+
+@dataclass(frozen=True, slots=True)
+class LedgerEvent:
+    """
+    Событие журнала запаса (таблица ledger)
+    
+    op - операция, к которой относится событие: взятие из нескольких
+    партий - несколько событий с одним op, отмена пишется с op взятия
+    """
+    id: int
+    op: int
+    kind: str
+    batch_id: int
+    amount: float
+    created: str
+    user_id: Optional[int] = None
+
+
+@dataclass(frozen=True, slots=True)
+class UserTotals:
+    """Итоги пользователя за окно (по таблице user_rollup)"""
+    user_id: int
+    name: str
+    taken: float
+    portions: int
+
+
+@dataclass(frozen=True, slots=True)
+class TenantConfig:
+    """Настройки чата или топика, который обслуживает бот (таблица tenants)"""
+    chat_id: int
+    thread_id: int
+    enabled: bool
+    created: str
+    pinned_msg_id: Optional[int] = None
+
+
+# ─────────────────── ФАБРИКИ СТРОК ───────────────────
+
+@lru_cache(maxsize=None)
+def columns(record: Type) -> str:
+    """Список колонок для SELECT в порядке полей записи"""
+    return ", ".join(f.name for f in fields(record))
+
+
+@lru_cache(maxsize=None)
+def row_factory(record: Type[R]) -> Callable[[object, Tuple], R]:
+    """
+    row_factory для курсора: кортеж строки → запись
+    
+    Колонки должны идти в порядке полей (SELECT {columns(record)} ...)
+    """
+    def factory(cursor, row: Tuple) -> R:
+        return record(*row)
+    return factory
+
+
+# ─────────────────── КОЛОНКИ ИСТОРИИ ───────────────────
+
+# Коды типов операций для колонки actions
+ACTION_CODES = {
+    "new_batch": 1,
+    "take": 2,
+    "reset": 3,
+    "undo": 4,
+}
+OTHER_ACTION = 0
+
+
+class HistoryColumns:
+    """
+    Записи истории по колонкам
+    
+    ids и actions - array, created и text - списки строк. Порядок тот же,
+    что у запроса (обычно новые первыми).
+    """
+    
+    __slots__ = ("ids", "actions", "created", "text")
+    
+    def __init__(self):
+        self.ids = array("q")
+        self.actions = array("b")
+        self.created: List[str] = []
+        self.text: List[str] = []
+    
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> "HistoryColumns":
+        """Собрать из кортежей (id, action_type, text, created)"""
+        result = cls()
+        if not rows:
+            return result
+        ids, actions, text, created = zip(*rows)
+        result.ids = array("q", ids)
+        code = ACTION_CODES.get
+        result.actions = array("b", [code(action, OTHER_ACTION) for action in actions])
+        result.text = list(text)
+        result.created = list(created)
+        return result
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def count(self, action_type: str) -> int:
+        """Сколько записей указанного типа"""
+        code = ACTION_CODES.get(action_type)
+        return self.actions.count(code) if code is not None else 0
+    
+    def indices(self, action_type: str) -> Iterator[int]:
+        """Номера строк указанного типа"""
+        code = ACTION_CODES.get(action_type)
+        if code is None:
+            return iter(())
+        return (i for i, c in enumerate(self.actions) if c == code)
@@ -0,0 +1,147 @@
+"""
+Хранение истории
+
+Записи истории старше горизонта (HISTORY_RETENTION_DAYS) раз в сутки
+переносятся из БД в сжатые сегменты на диске, разложенные по месяцам:
+
+    {archive_dir}/history/YYYY-MM/{первый id}-{последний id}{suffix}.jsonl.gz
+
+Дневные итоги, рейтинг и журнал запаса остаются в БД, поэтому остатки,
+итоги по дням и рейтинг не меняются, а живая БД не растёт. Сегмент
+пишется во временный файл и переименовывается, и только после этого
+строки удаляются из БД: после сбоя между этими шагами строки попадут
+в следующий сегмент повторно, а чтение архива отбрасывает дубли по id.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from database import Database
+from records import HistoryEntry
+
+
+log = logging.getLogger(__name__)
+
+
+class ArchiveMonth(NamedTuple):
+    """Сводка архива за месяц"""
+    month: str  # YYYY-MM
+    segments: int
+    size: int  # байт на диске
+
+
+class HistoryArchive:
+    """Сегменты истории на диске"""
+    
+    def __init__(self, root: str, suffix: str = ""):
+        """
+        Args:
+            root: директория архива
+            suffix: добавка к имени сегмента (чтобы шарды не затирали друг друга)
+        """
+        self.root = root
+        self.suffix = suffix
+        self.history_dir = os.path.join(root, "history")
+    
+    @classmethod
+    def for_db(cls, db_path: str, archive_dir: Optional[str] = None, suffix: str = "") -> "HistoryArchive":
+        """Архив БД: archive_dir или {имя БД}_archive рядом с файлом БД"""
+        return cls(archive_dir or f"{os.path.splitext(db_path)[0]}_archive", suffix=suffix)
+    
+    def write(self, rows: Sequence[Tuple]) -> int:
+        """
+        Сохранить строки истории (колонки Database.ARCHIVE_COLUMNS)
+        
+        Строки раскладываются по месяцам created, на каждый месяц - один сегмент
+        
+        Returns:
+            int: сколько сегментов записано
+        """
+        by_month: Dict[str, List[Tuple]] = defaultdict(list)
+        created = Database.ARCHIVE_COLUMNS.index("created")
+        for row in rows:
+            by_month[row[created][:7]].append(row)
+        
+        for month, month_rows in by_month.items():
+            directory = os.path.join(self.history_dir, month)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{month_rows[0][0]}-{month_rows[-1][0]}{self.suffix}.jsonl.gz")
+            tmp = path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                for row in month_rows:
+                    f.write(json.dumps(dict(zip(Database.ARCHIVE_COLUMNS, row)), ensure_ascii=False))
+                    f.write("\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        return len(by_month)
+    
+    def _segments(self, month: str) -> List[str]:
+        directory = os.path.join(self.history_dir, month)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(".jsonl.gz")
+        )
+    
+    def months(self) -> List[ArchiveMonth]:
+        """Месяцы в архиве, от старых к новым"""
+        if not os.path.isdir(self.history_dir):
+            return []
+        result = []
+        for month in sorted(os.listdir(self.history_dir)):
+            segments = self._segments(month)
+            if segments:
+                result.append(ArchiveMonth(month, len(segments), sum(os.path.getsize(p) for p in segments)))
+        return result
+    
+    def read(self, chat_id: int, thread_id: int, month: str) -> List[HistoryEntry]:
+        """
+        Записи тенанта за месяц из архива, по возрастанию id
+        
+        Args:
+            month: "YYYY-MM"
+        """
+        entries: Dict[int, HistoryEntry] = {}
+        for path in self._segments(month):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    if row["chat_id"] == chat_id and row["thread_id"] == thread_id:
+                        entries[row["id"]] = HistoryEntry(row["id"], row["action_type"], row["text"], row["created"])
+        return [entries[i] for i in sorted(entries)]
+
+
+class RetentionJob:
+    """Ежедневный перенос старой истории в архив и очистка сообщений"""
+    
+    def __init__(self, db: Database, archive: HistoryArchive, retention_days: int):
+        """
+        Args:
+            db: корневой экземпляр БД (задача работает по всем тенантам)
+            archive: куда складывать записи
+            retention_days: сколько дней истории держать в БД
+        """
+        self.db = db
+        self.archive = archive
+        self.retention_days = retention_days
+    
+    async def _sink(self, rows: List[Tuple]):
+        # Сжатие и fsync - в потоке, чтобы не задерживать апдейты
+        await asyncio.to_thread(self.archive.write, rows)
+    
+    async def run(self) -> Tuple[int, int]:
+        """
+        Returns:
+            (записей истории перенесено, записей о сообщениях удалено)
+        """
+        # Сначала сообщения: их страницы вернёт incremental_vacuum после переноса
+        pruned = await self.db.prune_messages()
+        archived = await self.db.archive_history(self.retention_days, self._sink)
+        return archived, pruned
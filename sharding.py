@@ -0,0 +1,423 @@
+"""
+Шардирование чатов по процессам
+
+Один процесс asyncio упирается в одно ядро. При SHARDS=N (N > 1)
+main.py запускает супервизор: он один забирает апдейты (polling),
+по chat_id выбирает шард и передаёт апдейт рабочему процессу этого
+шарда через pipe - по JSON-строке на апдейт. У каждого рабочего свой
+файл SQLite (chicken.2-of-4.db), свои кэши и свой Dispatcher.
+
+Порядок: апдейты одного чата всегда попадают в один рабочий и там
+обрабатываются строго по очереди; разные чаты идут параллельно.
+
+Падения: супервизор хранит апдейт, пока рабочий не подтвердит его
+обработку. Упавший рабочий перезапускается, и неподтверждённые
+апдейты отправляются заново в прежнем порядке. Доставка «хотя бы
+один раз»: апдейт, на котором процесс упал, может обработаться дважды.
+Это касается только падения рабочего: неподтверждённые апдейты лежат
+в памяти супервизора, а offset getUpdates сдвигается сразу после
+раздачи, поэтому при падении самого супервизора они теряются.
+
+Запуск рабочего (делает супервизор):
+    python -m sharding <шард> <число шардов>
+"""
+import asyncio
+import dataclasses
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+from config import Config
+from database import LEGACY_CHAT_ID, Database
+from middlewares import tenant_of
+
+
+log = logging.getLogger(__name__)
+
+# Конфигурация для рабочего процесса (JSON Config)
+CONFIG_ENV = "CHICKEN_SHARD_CONFIG"
+
+# Сколько раз доставлять апдейт, на котором падает рабочий
+MAX_DELIVERIES = 3
+
+# Пауза перед перезапуском упавшего рабочего, сек (удваивается до максимума)
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 30.0
+
+# Сколько ждать рабочих при остановке, сек
+STOP_TIMEOUT = 10.0
+
+# Строка рабочего после инициализации (остальные строки - update_id)
+READY = b"ready\n"
+
+# Длина строки апдейта в pipe
+LINE_LIMIT = 16 * 1024 * 1024
+
+# Таблицы с колонкой chat_id, которые делятся между шардами (users - по
+# пользователю, а не по чату, и копируется в каждый шард целиком)
+SHARDED_TABLES = (
+    "batch", "batch_archive", "history", "messages", "daily_rollup", "user_rollup", "forecast", "tenants",
+    "idempotency", "ledger", "ledger_snapshot",
+)
+
+
+# ─────────────────── МАРШРУТИЗАЦИЯ ───────────────────
+
+def shard_of(chat_id: int, shards: int) -> int:
+    """
+    Номер шарда чата
+    
+    abs(chat_id) % shards - то же выражение разбивает существующую
+    БД на шарды в SQL (split_database)
+    """
+    return abs(chat_id) % shards
+
+
+def chat_of(update: Update) -> int:
+    """Чат апдейта (0, если не определить - такие идут в шард 0)"""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return 0
+    tenant = tenant_of(event)
+    if tenant is not None:
+        return tenant[0]
+    user = getattr(event, "from_user", None)
+    return user.id if user else 0
+
+
+def shard_path(db_path: str, shard: int, shards: int) -> str:
+    """Файл БД шарда: chicken.db → chicken.2-of-4.db"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.{shard}-of-{shards}{ext}"
+
+
+def split_database(db_path: str, shards: int) -> List[str]:
+    """
+    Подготовить файлы шардов
+    
+    Недостающий файл шарда создаётся копией db_path, из которой удалены
+    строки чужих чатов. Данные старой версии (chat_id = 0), которые не
+    удалось заранее передать чату (Database.adopt_legacy), копируются
+    во все шарды: их получит первый групповой чат в топике TOPIC_ID,
+    в каком бы шарде он ни оказался. После разбиения db_path больше
+    не используется.
+    
+    Raises:
+        RuntimeError: есть файлы шардов от другого SHARDS - данные
+            разошлись бы по двум разбиениям
+    
+    Returns:
+        list: пути файлов шардов по номерам
+    """
+    paths = [shard_path(db_path, shard, shards) for shard in range(shards)]
+    root, ext = os.path.splitext(db_path)
+    foreign = sorted(set(glob.glob(f"{glob.escape(root)}.*-of-*{ext}")) - set(paths))
+    if foreign:
+        raise RuntimeError(
+            f"Найдены файлы шардов от другого SHARDS: {', '.join(foreign)}. "
+            f"Перенесите данные или верните прежнее значение SHARDS"
+        )
+    
+    if not os.path.exists(db_path):
+        return paths
+    
+    for shard, path in enumerate(paths):
+        if os.path.exists(path):
+            continue
+        
+        tmp_path = path + ".tmp"
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+            for table in SHARDED_TABLES:
+                target.execute(
+                    f"DELETE FROM {table} WHERE chat_id != ? AND abs(chat_id) % ? != ?",
+                    (LEGACY_CHAT_ID, shards, shard)
+                )
+            target.commit()
+            target.execute("VACUUM")
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, path)
+        log.info(f"Создан шард {shard + 1}/{shards}: {path}")
+    
+    return paths
+
+
+# ─────────────────── РАБОЧИЙ ПРОЦЕСС ───────────────────
+
+class ShardWorker:
+    """
+    Обработка апдейтов шарда
+    
+    Для каждого чата держится хвост очереди - задача последнего апдейта.
+    Новый апдейт чата ждёт предыдущий, апдейты разных чатов не ждут
+    друг друга. После обработки (успешной или нет) в pipe пишется
+    update_id - подтверждение для супервизора.
+    """
+    
+    def __init__(self, dp: Dispatcher, bot: Bot, acks):
+        self.dp = dp
+        self.bot = bot
+        self.acks = acks
+        self._tails: Dict[int, asyncio.Task] = {}
+    
+    def submit(self, update_id: int, chat_id: int, update: Dict[str, Any]):
+        """Поставить апдейт в очередь его чата"""
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._process(update_id, update, previous))
+        self._tails[chat_id] = task
+        
+        def release(done: asyncio.Task):
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+        task.add_done_callback(release)
+    
+    async def _process(self, update_id: int, update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            # Ошибку уже не исправить повтором - подтверждаем, чтобы не зациклиться
+            log.error(f"Ошибка обработки апдейта {update_id}: {e}", exc_info=True)
+        self.acks.write(f"{update_id}\n".encode())
+    
+    async def drain(self):
+        """Дождаться всех начатых апдейтов"""
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def run_worker(shard: int, shards: int):
+    """
+    Рабочий процесс шарда: читает апдейты из stdin, подтверждает в stdout
+    
+    stdout занят подтверждениями, поэтому всё, что процесс печатает
+    (в том числе логи), перенаправляется в stderr
+    """
+    acks = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=0)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    
+    # main настраивает логирование при импорте - уже после перенаправления
+    from main import create_bot, create_dispatcher, start_scheduler
+    
+    config = Config(**json.loads(os.environ[CONFIG_ENV]))
+    config = dataclasses.replace(
+        config,
+        db_path=shard_path(config.db_path, shard, shards),
+        record_updates_path=(
+            shard_path(config.record_updates_path, shard, shards)
+            if config.record_updates_path else None
+        ),
+    )
+    
+    db = Database(config.db_path, timezone_offset=config.timezone_offset)
+    await db.init(legacy_thread_id=config.topic_id)
+    
+    bot = create_bot(config)
+    dp = create_dispatcher(db, config)
+    start_scheduler(bot, db, config, suffix=f"_shard{shard}")
+    
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    
+    worker = ShardWorker(dp, bot, acks)
+    acks.write(READY)
+    log.info(f"Шард {shard + 1}/{shards} запущен: {config.db_path}")
+    try:
+        while line := await reader.readline():
+            message = json.loads(line)
+            worker.submit(message["id"], message["chat"], message["update"])
+        # stdin закрыт - супервизор останавливается
+        await worker.drain()
+    finally:
+        await bot.session.close()
+        acks.close()
+    log.info(f"Шард {shard + 1}/{shards} остановлен")
+
+
+# ─────────────────── СУПЕРВИЗОР ───────────────────
+
+class ShardProcess:
+    """
+    Рабочий процесс с точки зрения супервизора
+    
+    pending - отправленные, но не подтверждённые апдейты в порядке
+    отправки: они доставляются заново после перезапуска
+    """
+    
+    def __init__(self, shard: int, shards: int, env: Dict[str, str]):
+        self.shard = shard
+        self.shards = shards
+        self.env = env
+        self.pending: "OrderedDict[int, bytes]" = OrderedDict()
+        self.deliveries: Dict[int, int] = {}
+        self.restarts = 0
+        self.ready = asyncio.Event()
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    async def start(self):
+        """Запустить процесс и передать ему неподтверждённые апдейты"""
+        self._proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "sharding", str(self.shard), str(self.shards),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=self.env,
+            limit=LINE_LIMIT,
+        )
+        for update_id, line in self.pending.items():
+            self.deliveries[update_id] = self.deliveries.get(update_id, 0) + 1
+            self._proc.stdin.write(line)
+        self._watcher = asyncio.create_task(self._watch(self._proc))
+        await self._drain()
+    
+    async def send(self, update_id: int, chat_id: int, update: Dict[str, Any]):
+        """Передать апдейт рабочему (или оставить до перезапуска, если тот упал)"""
+        line = json.dumps(
+            {"id": update_id, "chat": chat_id, "update": update},
+            ensure_ascii=False
+        ).encode() + b"\n"
+        self.pending[update_id] = line
+        self.deliveries[update_id] = 1
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.stdin.write(line)
+            await self._drain()
+    
+    async def _drain(self):
+        try:
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # Процесс упал - апдейты остались в pending, _watch перезапустит
+            pass
+    
+    async def _watch(self, proc: asyncio.subprocess.Process):
+        """Читать подтверждения; при падении перезапустить процесс"""
+        async for line in proc.stdout:
+            if line == READY:
+                self.ready.set()
+                continue
+            try:
+                update_id = int(line)
+            except ValueError:
+                # Посторонний вывод в stdout рабочего не должен останавливать приём подтверждений
+                log.warning(f"Шард {self.shard + 1}/{self.shards}: не подтверждение в stdout: {line[:200]!r}")
+                continue
+            self.pending.pop(update_id, None)
+            self.deliveries.pop(update_id, None)
+            self.restarts = 0
+        code = await proc.wait()
+        if self._stopping:
+            return
+        
+        log.error(
+            f"Шард {self.shard + 1}/{self.shards} завершился с кодом {code}, "
+            f"неподтверждённых апдейтов: {len(self.pending)}"
+        )
+        # Первый неподтверждённый апдейт - вероятная причина падения
+        if self.pending:
+            update_id = next(iter(self.pending))
+            if self.deliveries.get(update_id, 0) >= MAX_DELIVERIES:
+                log.error(f"Апдейт {update_id} отброшен после {MAX_DELIVERIES} попыток")
+                del self.pending[update_id]
+                del self.deliveries[update_id]
+        
+        delay = min(RESTART_DELAY * 2 ** self.restarts, RESTART_DELAY_MAX)
+        self.restarts += 1
+        await asyncio.sleep(delay)
+        if not self._stopping:
+            await self.start()
+    
+    async def stop(self):
+        """Закрыть stdin, дождаться обработки начатого, при зависании - убить"""
+        self._stopping = True
+        proc = self._proc
+        if proc is None or proc.returncode is not None:
+            return
+        proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"Шард {self.shard + 1}/{self.shards} не остановился за {STOP_TIMEOUT} с")
+            proc.kill()
+            await proc.wait()
+        if self._watcher is not None:
+            await self._watcher
+
+
+async def run_supervisor(config: Config, bot: Bot, polling_timeout: int = 10):
+    """
+    Приём апдейтов и раздача по шардам
+    
+    Работает, пока задачу не отменят; при отмене останавливает рабочих.
+    
+    Args:
+        config: конфигурация (config.shards > 1)
+        bot: бот для getUpdates
+        polling_timeout: таймаут long polling, сек
+    """
+    shards = config.shards
+    
+    # Старая схема мигрирует один раз, до копирования в шарды
+    if os.path.exists(config.db_path):
+        db = Database(config.db_path, timezone_offset=config.timezone_offset)
+        await db.init(legacy_thread_id=config.topic_id)
+        await db.adopt_legacy()
+    await asyncio.to_thread(split_database, config.db_path, shards)
+    
+    # Типы апдейтов - те же, что слушал бы обычный Dispatcher
+    from handlers import register_handlers
+    probe = Dispatcher()
+    register_handlers(probe)
+    allowed_updates = probe.resolve_used_update_types()
+    
+    env = dict(os.environ)
+    env[CONFIG_ENV] = json.dumps(dataclasses.asdict(config))
+    workers = [ShardProcess(shard, shards, env) for shard in range(shards)]
+    offset = None
+    try:
+        for worker in workers:
+            await worker.start()
+        await asyncio.gather(*(worker.ready.wait() for worker in workers))
+        log.info(f"Супервизор запущен: {shards} шардов")
+        
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=polling_timeout,
+                    allowed_updates=allowed_updates
+                )
+            except Exception as e:
+                log.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(RESTART_DELAY)
+                continue
+            
+            for update in updates:
+                chat_id = chat_of(update)
+                raw = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+                await workers[shard_of(chat_id, shards)].send(update.update_id, chat_id, raw)
+                offset = update.update_id + 1
+    finally:
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        log.info("Супервизор остановлен")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker(int(sys.argv[1]), int(sys.argv[2])))
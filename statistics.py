@@ -2,14 +2,25 @@
 Статистика и аналитика
 """
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 
+from analytics import Analytics
 from database import Database
+from forecast import format_forecast
+from loader import rollup
+from utils.render import (
+    RenderCache, render_extended_stats, render_leaderboard, render_stats, render_stats_forecast,
+    render_user_stats, stats_needs,
+)
 
 
 log = logging.getLogger(__name__)
 
+# Готовая статистика по (чат, окно, Database.write_seq, дата): пока в БД
+# ничего не записано, повторный запрос не обращается к ней вовсе
+STATS_CACHE_SIZE = 128
+stats_cache = RenderCache(maxsize=STATS_CACHE_SIZE)
+
 
 class Statistics:
     """Класс для работы со статистикой"""
@@ -22,73 +33,17 @@ class Statistics:
         """
         Получить статистику за период
         
+        Считается по дневным итогам (daily_rollup): последние days
+        календарных дней, включая сегодня.
+        
         Args:
             days: количество дней
             
         Returns:
             dict: статистика или None
         """
-        try:
-            # Получить историю
-            history = await self.db.get_history(limit=1000)
-            if not history:
-                return None
-            
-            # Граница периода
-            cutoff_date = datetime.now() - timedelta(days=days)
-            
-            # Фильтровать по периоду
-            period_history = []
-            for record in history:
-                try:
-                    created = datetime.fromisoformat(record["created"])
-                    if created >= cutoff_date:
-                        period_history.append(record)
-                except:
-                    continue
-            
-            if not period_history:
-                return None
-            
-            # Подсчёт статистики
-            total_taken = 0
-            total_portions = 0
-            batches_created = 0
-            
-            for record in period_history:
-                if record["action_type"] == "take":
-                    # Извлечь вес из текста "Взято: 200г сырой → ..."
-                    try:
-                        text = record["text"]
-                        if "Взято:" in text and "г сырой" in text:
-                            weight_str = text.split("Взято:")[1].split("г сырой")[0].strip()
-                            weight = float(weight_str)
-                            total_taken += weight
-                            total_portions += 1
-                    except:
-                        continue
-                
-                elif record["action_type"] == "new_batch":
-                    batches_created += 1
-            
-            # Средние значения
-            avg_per_day = total_taken / days if days > 0 else 0
-            avg_portion = total_taken / total_portions if total_portions > 0 else 0
-            
-            return {
-                "days": days,
-                "total_taken": total_taken,
-                "total_portions": total_portions,
-                "batches_created": batches_created,
-                "avg_per_day": avg_per_day,
-                "avg_portion": avg_portion,
-                "period_start": cutoff_date,
-                "period_end": datetime.now()
-            }
-            
-        except Exception as e:
-            log.error(f"Ошибка расчёта статистики: {e}")
-            return None
+        data = await self.db.load((rollup(days),))
+        return data.period_stats(days)
     
     async def get_today_stats(self) -> Optional[Dict]:
         """Получить статистику за сегодня"""
@@ -104,106 +59,149 @@ class Statistics:
     
     async def get_batch_history(self, limit: int = 10) -> List[Dict]:
         """
-        Получить историю партий
+        Получить историю партий: открытые и из архива, новые первыми
         
         Args:
             limit: количество партий
             
         Returns:
-            list: список партий с коэффициентами
+            list: партии с коэффициентами, остатком и причиной закрытия
+                (closed и reason - None у открытых)
         """
-        try:
-            history = await self.db.get_history(limit=1000)
-            if not history:
-                return []
-            
-            batches = []
-            for record in history:
-                if record["action_type"] == "new_batch":
-                    # Извлечь данные из текста
-                    try:
-                        text = record["text"]
-                        # "Новая партия: 1500г сырой → 1200г готовой (к=0.800)"
-                        if "→" in text and "к=" in text:
-                            raw_str = text.split(":")[1].split("г сырой")[0].strip()
-                            cooked_str = text.split("→")[1].split("г готовой")[0].strip()
-                            coef_str = text.split("к=")[1].split(")")[0]
-                            
-                            batches.append({
-                                "created": record["created"],
-                                "raw": float(raw_str),
-                                "cooked": float(cooked_str),
-                                "coef": float(coef_str),
-                                "text": record["text"]
-                            })
-                    except:
-                        continue
-            
-            return batches[:limit]
-            
-        except Exception as e:
-            log.error(f"Ошибка получения истории партий: {e}")
-            return []
+        open_batches = await self.db.get_open_batches()
+        archived = await self.db.get_batch_archive(limit=limit)
+        
+        batches = [
+            {
+                "created": b.created,
+                "raw": b.raw_total,
+                "cooked": b.cooked_total,
+                "coef": b.coef,
+                "note": b.note,
+                "left": b.raw_left,
+                "closed": None,
+                "reason": None,
+            }
+            for b in open_batches
+        ]
+        batches.extend(
+            {
+                "created": b.created,
+                "raw": b.raw_total,
+                "cooked": b.cooked_total,
+                "coef": b.coef,
+                "note": b.note,
+                "left": b.raw_left,
+                "closed": b.closed,
+                "reason": b.reason,
+            }
+            for b in archived
+        )
+        batches.sort(key=lambda b: b["created"], reverse=True)
+        return batches[:limit]
     
-    async def format_stats_message(self, days: int = 7) -> str:
+    async def format_stats_message(self, days: int = 7, chat_id: Optional[int] = None) -> str:
         """
         Форматировать сообщение со статистикой
         
+        Текст кэшируется по (чат, период, write_seq, дата): периоды - календарные
+        дни, поэтому без новых записей текст меняется только с датой. Прогноз
+        зависит от времени и дописывается при каждом запросе из памяти.
+        
         Args:
             days: период в днях
+            chat_id: чат, для которого строится статистика
             
         Returns:
             str: отформатированное сообщение
         """
-        stats = await self.get_period_stats(days)
+        now = self.db.local_now()
+        key = ("stats", chat_id, days, self.db.write_seq, now.date())
+        cached = stats_cache.get(key)
+        if cached is None:
+            cached = stats_cache.put(key, await self._render_stats(days))
         
+        text, raw_left = cached
+        if raw_left is not None:
+            forecast = format_forecast(await self.db.get_forecast(), raw_left, now)
+            text += render_stats_forecast(forecast)
+        return text
+    
+    async def _render_stats(self, days: int) -> Tuple[str, Optional[float]]:
+        """(текст статистики без прогноза, остаток партии или None)"""
+        data = await self.db.load(stats_needs(days))
+        stats = data.period_stats(days)
         if not stats:
-            return (
-                "📊 <b>СТАТИСТИКА</b>\n\n"
-                f"За последние {days} дней нет данных\n\n"
-                "Начни брать порции чтобы увидеть статистику! 📈"
-            )
-        
-        # Период
-        period_name = {
-            1: "СЕГОДНЯ",
-            7: "ЗА НЕДЕЛЮ",
-            30: "ЗА МЕСЯЦ"
-        }.get(days, f"ЗА {days} ДНЕЙ")
-        
-        # Эмодзи индикатор активности
-        activity_emoji = "🔥" if stats["total_portions"] > 10 else "✅" if stats["total_portions"] > 5 else "📊"
-        
-        lines = [
-            f"{activity_emoji} <b>СТАТИСТИКА {period_name}</b>",
-            "",
-            f"🍗 <b>Съедено:</b> {int(stats['total_taken'])} г",
-            f"📊 <b>В среднем:</b> {int(stats['avg_per_day'])} г/день",
-            f"🍽️ <b>Порций взято:</b> {stats['total_portions']} шт",
-            f"📦 <b>Средняя порция:</b> {int(stats['avg_portion'])} г",
-        ]
+            return render_stats(days, None), None
+        
+        # Тренд: предыдущий период берётся из того же окна
+        prev_stats = data.period_stats(days * 2)
+        
+        raw_left = data.batch.raw_left if data.batch else None
+        return render_stats(days, stats, prev_stats, raw_left), raw_left
+    
+    async def format_extended_stats(self, days: int = 365, chat_id: Optional[int] = None) -> str:
+        """
+        Подробная статистика за произвольный период
+        
+        Считается по колонкам взятий в памяти (Database.get_takes),
+        поэтому даже год истории обходится без запросов к БД.
+        
+        Args:
+            days: период в днях
+            chat_id: чат, для которого строится статистика
+            
+        Returns:
+            str: отформатированное сообщение
+        """
+        now = self.db.local_now()
+        key = ("stats_extended", chat_id, days, self.db.write_seq, now.date())
+        text = stats_cache.get(key)
+        if text is not None:
+            return text
+        
+        takes = await self.db.get_takes()
+        report = Analytics(takes, now).report(days)
+        return stats_cache.put(key, render_extended_stats(report, days))
+    
+    async def format_leaderboard(self, days: int = 7, chat_id: Optional[int] = None) -> str:
+        """
+        Рейтинг пользователей за период
+        
+        Строится по user_rollup (строки окна, а не вся история)
+        и кэшируется по (чат, период, write_seq, дата).
+        
+        Args:
+            days: период в днях
+            chat_id: чат, для которого строится рейтинг
+            
+        Returns:
+            str: отформатированное сообщение
+        """
+        key = ("stats_top", chat_id, days, self.db.write_seq, self.db.local_now().date())
+        text = stats_cache.get(key)
+        if text is not None:
+            return text
+        
+        leaders = await self.db.get_leaderboard(days)
+        return stats_cache.put(key, render_leaderboard(leaders, days))
+    
+    async def format_user_stats(self, user_id: int, chat_id: Optional[int] = None) -> str:
+        """
+        Личная статистика пользователя: неделя, месяц и место в рейтинге недели
+        
+        Args:
+            user_id: пользователь
+            chat_id: чат, для которого строится статистика
+            
+        Returns:
+            str: отформатированное сообщение
+        """
+        key = ("stats_user", chat_id, user_id, self.db.write_seq, self.db.local_now().date())
+        text = stats_cache.get(key)
+        if text is not None:
+            return text
         
-        if stats["batches_created"] > 0:
-            lines.append(f"👨‍🍳 <b>Партий создано:</b> {stats['batches_created']}")
-        
-        # Тренд (если есть данные за предыдущий период)
-        prev_stats = await self.get_period_stats(days * 2)
-        if prev_stats and prev_stats["total_taken"] > 0:
-            prev_taken = prev_stats["total_taken"] - stats["total_taken"]
-            if prev_taken > 0:
-                change_pct = ((stats["total_taken"] - prev_taken) / prev_taken) * 100
-                if abs(change_pct) > 5:
-                    trend_emoji = "📈" if change_pct > 0 else "📉"
-                    trend_text = "больше" if change_pct > 0 else "меньше"
-                    lines.append("")
-                    lines.append(f"{trend_emoji} <b>Тренд:</b> {abs(int(change_pct))}% {trend_text}")
-        
-        # Текущий статус
-        batch = await self.db.get_batch()
-        if batch:
-            raw_left = batch["raw_left"]
-            lines.append("")
-            lines.append("━━━━━━━━━━━━━━━━━━━")
-            lines.append(f"💾 <b>Текущий остаток:</b> {int(raw_left)} г")
-        
-        return "\n".join(lines)
+        leaders = await self.db.get_leaderboard(days=7)
+        month = await self.db.get_user_totals(user_id, days=30)
+        return stats_cache.put(key, render_user_stats(user_id, leaders, month))
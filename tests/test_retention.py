@@ -0,0 +1,60 @@
+"""
+Перенос истории в архив и кэш рендеринга тенантов
+"""
+import asyncio
+import sqlite3
+
+from database import Database
+from retention import HistoryArchive, RetentionJob
+from utils.render import HISTORY_NEEDS, cache as render_cache, render_history
+
+
+CHAT_ID = -1001234567890
+THREAD_ID = 4
+OLD_TEXT = "Взято: 321г сырой (запись для архива)"
+
+
+async def _render(db: Database) -> str:
+    """Экран истории так же, как handlers.history.show_history"""
+    key = ("history", db.versions)
+    text = render_cache.get(key)
+    if text is None:
+        data = await db.load(HISTORY_NEEDS)
+        text = render_cache.put(key, render_history(data.history))
+    return text
+
+
+def test_archived_history_leaves_tenant_render(tmp_path):
+    """После переноса в архив экран истории тенанта не показывает перенесённые записи"""
+    db_path = str(tmp_path / "chicken.db")
+    
+    async def scenario():
+        root = Database(db_path)
+        await root.init()
+        tenant = root.for_tenant(CHAT_ID, THREAD_ID)
+        await root.get_tenant(CHAT_ID, THREAD_ID)
+        await tenant.add_history("take", "Взято: 200г сырой (свежая запись)")
+        
+        # Старая запись - в обход экземпляра, как будто она пролежала год
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "INSERT INTO history (chat_id, thread_id, action_type, text, created) VALUES (?, ?, ?, ?, ?)",
+            (CHAT_ID, THREAD_ID, "take", OLD_TEXT, "2020-01-01 12:00:00")
+        )
+        conn.commit()
+        conn.close()
+        tenant._forget()
+        
+        before = await _render(tenant)
+        assert OLD_TEXT in before
+        
+        archive = HistoryArchive(str(tmp_path / "archive"))
+        archived, _ = await RetentionJob(root, archive, retention_days=30).run()
+        assert archived == 1
+        
+        after = await _render(tenant)
+        assert OLD_TEXT not in after
+        assert "свежая запись" in after
+        assert [e.text for e in archive.read(CHAT_ID, THREAD_ID, "2020-01")] == [OLD_TEXT]
+    
+    asyncio.run(scenario())
@@ -2,12 +2,13 @@
 Утилиты бота
 """
 from .parser import WeightParser
-from .validators import WeightValidator, PortionValidator
+from .validators import WeightValidator, WeightError, PortionValidator
 from .status_formatter import format_status_message
 
 __all__ = [
     'WeightParser',
     'WeightValidator',
+    'WeightError',
     'PortionValidator',
     'format_status_message',
 ]
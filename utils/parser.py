@@ -1,27 +1,70 @@
 """
 Парсер веса из текста
 """
+import math
 import re
-from typing import Optional
+from array import array
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+
+# Типы токенов
+_NUM = "num"        # число: 200, 1.5
+_FRAC = "frac"      # дробь: 1/2
+_WORD_NUM = "word"  # числительное: двести, полтора
+_UNIT = "unit"      # единица: г, кг, lb...
+_PLUS = "plus"      # сумма: 200+150
+_TIMES = "times"    # умножение: 2 по 150, 2x150
+
+# Один проход по строке: альтернативы проверяются слева направо
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<frac>\d+(?:[.,]\d+)?\s*/\s*\d+(?:[.,]\d+)?)
+    |(?P<num>\d+(?:[.,]\d+)?)
+    |(?P<plus>\+)
+    |(?P<times>[x×*](?![a-zа-яё]))
+    |(?P<word>[a-zа-яё]+)
+    """,
+    re.VERBOSE,
+)
+
+_GRAMS_PER_LB = 453.59237
+_GRAMS_PER_OZ = 28.349523125
 
 
 class WeightParser:
     """Парсер веса из текстового ввода"""
     
-    # Словарь распространенных выражений
-    WEIGHT_WORDS = {
-        "полкило": 500,
-        "пол кило": 500,
-        "половина": 500,
-        "половинка": 500,
-        "четверть": 250,
-        "1/4": 250,
-        "1/2": 500,
-        "кило": 1000,
-        "килограмм": 1000,
-        "килограма": 1000,
+    # Единицы измерения → граммов в единице
+    UNIT_WORDS = {
+        **dict.fromkeys(("г", "гр", "грамм", "грамма", "граммов", "g", "gr", "gram", "grams"), 1.0),
+        **dict.fromkeys(
+            ("кг", "кило", "килограмм", "килограмма", "килограммов", "килограма", "kg", "kilo", "kilos"),
+            1000.0
+        ),
+        **dict.fromkeys(("lb", "lbs", "фунт", "фунта", "фунтов"), _GRAMS_PER_LB),
+        **dict.fromkeys(("oz", "унция", "унции", "унций"), _GRAMS_PER_OZ),
+    }
+    
+    # Числительные и доли (без единицы трактуются как килограммы, см. _bare_grams)
+    NUMBER_WORDS = {
+        "один": 1, "одна": 1, "два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5,
+        "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+        "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50,
+        "шестьдесят": 60, "семьдесят": 70, "восемьдесят": 80, "девяносто": 90,
+        "сто": 100, "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500,
+        "шестьсот": 600, "семьсот": 700, "восемьсот": 800, "девятьсот": 900,
+        "тысяча": 1000, "тысячу": 1000,
+        "пол": 0.5, "половина": 0.5, "половинка": 0.5, "половину": 0.5,
+        "четверть": 0.25, "полтора": 1.5, "полторы": 1.5,
     }
     
+    # Слова-операторы
+    TIMES_WORDS = {"по", "x"}
+    
+    # Число без единицы меньше этого порога считается килограммами
+    KG_THRESHOLD = 50
+    
     @classmethod
     def parse(cls, text: str) -> Optional[float]:
         """
@@ -30,7 +73,10 @@ class WeightParser:
         Поддерживает форматы:
         - 1500 или 1500г - граммы
         - 1.5 или 1.5кг - килограммы
-        - полкило, четверть и т.д.
+        - 1 lb, 8 oz - фунты и унции
+        - полкило, четверть, двести грамм - слова
+        - 1/2, 1/4 кг - дроби
+        - 200+150, 2 по 150, 1 кг 200 г - суммы
         
         Returns:
             float: вес в граммах или None если не удалось распарсить
@@ -38,48 +84,122 @@ class WeightParser:
         if not text:
             return None
         
-        # Нормализация текста
-        t = text.lower().strip()
-        t = t.replace(",", ".")  # Заменить запятую на точку
-        
-        # Проверка на ключевые слова
-        for word, value in cls.WEIGHT_WORDS.items():
-            if word in t:
-                return float(value)
-        
-        # Убираем всё кроме цифр, точек, пробелов и букв "кг"
-        t = re.sub(r"[^\d\.кгkg ]", "", t)
-        
-        # Парсинг килограммов
-        kg_patterns = [
-            r"([\d\.]+)\s*кг",
-            r"([\d\.]+)\s*kg",
-        ]
-        
-        for pattern in kg_patterns:
-            kg_match = re.search(pattern, t)
-            if kg_match:
-                try:
-                    kg_value = float(kg_match.group(1))
-                    return kg_value * 1000
-                except ValueError:
+        return _parse_normalized(text.lower().strip())
+    
+    @classmethod
+    def parse_many(cls, texts: Iterable[str]) -> array:
+        """
+        Пакетный парсинг (импорт, бэкфилл исторических записей)
+        
+        Args:
+            texts: строки (список, генератор, колонка файла)
+        
+        Returns:
+            array('d'): вес в граммах по каждой строке, NaN если не распознано
+        """
+        result = array("d")
+        append = result.append
+        parse = _parse_normalized
+        nan = math.nan
+        
+        for text in texts:
+            if not text:
+                append(nan)
+                continue
+            grams = parse(text.lower().strip())
+            append(nan if grams is None else grams)
+        
+        return result
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[Tuple[str, float]]:
+        """
+        Разбить нормализованный текст на токены (тип, значение)
+        
+        Незнакомые слова и символы пропускаются.
+        """
+        tokens = []
+        for match in _TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            value = match.group(kind)
+            
+            if kind == "num":
+                tokens.append((_NUM, float(value.replace(",", "."))))
+            elif kind == "frac":
+                numerator, _, denominator = value.partition("/")
+                denominator = float(denominator.strip().replace(",", "."))
+                if denominator:
+                    tokens.append((_FRAC, float(numerator.strip().replace(",", ".")) / denominator))
+            elif kind == "plus":
+                tokens.append(_PLUS_TOKEN)
+            elif kind == "times":
+                tokens.append(_TIMES_TOKEN)
+            else:
+                tokens.extend(_WORD_TOKENS.get(value, ()))
+        
+        return tokens
+    
+    @classmethod
+    def evaluate(cls, tokens: List[Tuple[str, float]]) -> Optional[float]:
+        """
+        Вычислить вес по токенам
+        
+        Грамматика: сумма количеств; количество - число, числительное
+        или дробь с необязательной единицей; "N по X" умножает X на N.
+        
+        Returns:
+            float: вес в граммах или None если количеств нет
+        """
+        total = 0.0
+        found = False
+        multiplier = 1.0
+        factor_kind = None
+        value: Optional[float] = None
+        value_kind = None
+        
+        def flush_bare():
+            nonlocal total, found, multiplier, factor_kind, value, value_kind
+            if value is None and factor_kind is not None:
+                # "200 по" без второго числа - это просто 200
+                value, value_kind, multiplier = multiplier, factor_kind, 1.0
+            if value is not None:
+                total += multiplier * cls._bare_grams(value, value_kind)
+                found = True
+            multiplier = 1.0
+            value = value_kind = factor_kind = None
+        
+        for kind, token_value in tokens:
+            if kind in (_NUM, _FRAC, _WORD_NUM):
+                if value is not None and value_kind == _WORD_NUM and kind == _WORD_NUM and token_value < value:
+                    # Составное числительное: двести пятьдесят
+                    value += token_value
                     continue
+                if value is not None:
+                    flush_bare()
+                value, value_kind = token_value, kind
+            elif kind == _UNIT:
+                amount = 1.0 if value is None else value
+                total += multiplier * amount * token_value
+                found = True
+                multiplier = 1.0
+                value = value_kind = factor_kind = None
+            elif kind == _TIMES:
+                if value is not None:
+                    multiplier *= value
+                    factor_kind = value_kind
+                    value = value_kind = None
+            elif kind == _PLUS:
+                flush_bare()
         
-        # Парсинг граммов (просто число)
-        g_match = re.search(r"([\d\.]+)", t)
-        if g_match:
-            try:
-                value = float(g_match.group(1))
-                
-                # Автоопределение: если меньше 50, вероятно килограммы
-                if 0 < value < 50:
-                    return value * 1000
-                
-                return value
-            except ValueError:
-                return None
-        
-        return None
+        flush_bare()
+        return total if found else None
+    
+    @classmethod
+    def _bare_grams(cls, value: float, kind: str) -> float:
+        """Число без единицы: дроби и маленькие числа - килограммы, остальное - граммы"""
+        if kind == _FRAC or 0 < value < cls.KG_THRESHOLD:
+            return value * 1000
+        return value
     
     @classmethod
     def format_weight(cls, grams: float) -> str:
@@ -88,8 +208,27 @@ class WeightParser:
         
         Args:
             grams: вес в граммах
-            
+        
         Returns:
             str: отформатированная строка в граммах (например "1500 г")
         """
         return f"{int(grams)} г"
+
+
+_PLUS_TOKEN = (_PLUS, 0.0)
+_TIMES_TOKEN = (_TIMES, 0.0)
+
+# Слово → готовые токены (одна проверка по словарю на слово)
+_WORD_TOKENS = {
+    **{word: ((_WORD_NUM, float(value)),) for word, value in WeightParser.NUMBER_WORDS.items()},
+    **{word: (_TIMES_TOKEN,) for word in WeightParser.TIMES_WORDS},
+    # полкило, полкилограмма, полкг
+    **{"пол" + word: ((_WORD_NUM, 0.5), (_UNIT, grams)) for word, grams in WeightParser.UNIT_WORDS.items()},
+    **{word: ((_UNIT, grams),) for word, grams in WeightParser.UNIT_WORDS.items()},
+}
+
+
+@lru_cache(maxsize=2048)
+def _parse_normalized(text: str) -> Optional[float]:
+    """Разбор нормализованного текста (с кэшем повторяющихся вводов)"""
+    return WeightParser.evaluate(WeightParser.tokenize(text))
@@ -0,0 +1,488 @@
+"""
+Слой рендеринга сообщений
+
+Шаблоны статуса, статистики и истории собраны один раз при импорте,
+прогресс-бары и эмодзи мемоизированы. Готовый текст кэшируется по ключу
+с версиями партии и истории (Database.versions) - повторный рендер
+неизменившегося состояния стоит одного поиска в словаре.
+"""
+import html
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Hashable, Iterable, Mapping, Optional, Tuple
+
+from analytics import Analytics, WindowReport
+from loader import BATCH, FORECAST, Need, history, rollup
+from records import BatchSnapshot, HistoryEntry, UserTotals
+
+
+# ─────────────────── ШАБЛОНЫ ───────────────────
+
+_STATUS_TEMPLATE = (
+    "📊 <b>СТАТУС ПАРТИИ</b>\n"
+    "\n"
+    "{emoji} <b>Остаток:</b> {percent}%\n"
+    "{bar}\n"
+    "\n"
+    "🥩 <b>Сырой:</b> {raw_left} г / {raw_total} г\n"
+    "🍗 <b>Готовой:</b> {cooked_left} г / {cooked_total} г\n"
+    "⚖️ <b>Коэффициент:</b> {coef:.3f}\n"
+    "\n"
+    "📅 <b>Создано:</b> {created}"
+).format
+
+_STATUS_NOTE = "\n📝 <b>Заметка:</b> {}".format
+_STATUS_BATCHES = "\n📦 <b>Партий в запасе:</b> {} (сначала расходуется самая старая)".format
+_STATUS_CRITICAL = "\n\n⚠️ <b>Остаток критически низкий!</b>"
+_STATUS_LOW = "\n\n⚠️ <b>Остаток становится низким</b>"
+_STATUS_FORECAST = "\n\n⏳ <b>Прогноз:</b> {}".format
+_STATUS_UPDATED = "\n\n🔄 Обновлено: {}".format
+
+_STATS_TEMPLATE = (
+    "{emoji} <b>СТАТИСТИКА {period}</b>\n"
+    "\n"
+    "🍗 <b>Съедено:</b> {total_taken} г\n"
+    "📊 <b>В среднем:</b> {avg_per_day} г/день\n"
+    "🍽️ <b>Порций взято:</b> {total_portions} шт\n"
+    "📦 <b>Средняя порция:</b> {avg_portion} г"
+).format
+
+_STATS_EMPTY = (
+    "📊 <b>СТАТИСТИКА</b>\n\n"
+    "За последние {} дней нет данных\n\n"
+    "Начни брать порции чтобы увидеть статистику! 📈"
+).format
+
+_STATS_BATCHES = "\n👨‍🍳 <b>Партий создано:</b> {}".format
+_STATS_TREND = "\n\n{} <b>Тренд:</b> {}% {}".format
+_STATS_LEFT = "\n\n━━━━━━━━━━━━━━━━━━━\n💾 <b>Текущий остаток:</b> {} г".format
+_STATS_FORECAST = "\n⏳ <b>Прогноз:</b> {}".format
+
+_EXTENDED_TEMPLATE = (
+    "🔬 <b>ПОДРОБНАЯ СТАТИСТИКА {period}</b>\n"
+    "\n"
+    "🍗 <b>Съедено:</b> {total} г, {portions} порций\n"
+    "📊 <b>В среднем:</b> {avg_per_day} г/день\n"
+    "👨‍🍳 <b>Партий:</b> создано {batches}, в ходу было {batches_used}"
+).format
+
+_EXTENDED_EMPTY = (
+    "🔬 <b>ПОДРОБНАЯ СТАТИСТИКА</b>\n\n"
+    "За последние {} дней взятий не было"
+).format
+
+_EXTENDED_MOVING = "\n📈 <b>За последние {} дн.:</b> {} г/день".format
+_EXTENDED_PORTION = (
+    "\n\n📦 <b>Порция:</b> медиана {p50} г, обычно {p25}–{p75} г, "
+    "крупные от {p90} г"
+).format
+_EXTENDED_SECTION = "\n\n<b>{}</b>".format
+_EXTENDED_ROW = "\n<code>{:<9}</code> {} {}".format
+
+_LEADERBOARD_HEADER = "🏆 <b>РЕЙТИНГ {}</b>\n".format
+_LEADERBOARD_ROW = "\n{} {} — <b>{}</b> г, {} порц.".format
+_LEADERBOARD_FOOTER = "\n\n━━━━━━━━━━━━━━━━━━━\n🍗 <b>Всего:</b> {} г, участников: {}".format
+_LEADERBOARD_EMPTY = (
+    "🏆 <b>РЕЙТИНГ</b>\n\n"
+    "За последние {} дней никто не брал порций"
+).format
+_MEDALS = ("🥇", "🥈", "🥉")
+
+_USER_TEMPLATE = (
+    "👤 <b>МОЯ СТАТИСТИКА</b>\n"
+    "\n"
+    "<b>{name}</b>\n"
+    "\n"
+    "📈 <b>За неделю:</b> {week_taken} г, {week_portions} порц.\n"
+    "📅 <b>За месяц:</b> {month_taken} г, {month_portions} порц.\n"
+    "📊 <b>В среднем:</b> {avg_per_day} г/день"
+).format
+_USER_PLACE = "\n\n🏆 <b>Место за неделю:</b> {} из {}, доля чата {}%".format
+_USER_EMPTY = (
+    "👤 <b>МОЯ СТАТИСТИКА</b>\n\n"
+    "За последние {} дней у тебя не было взятий"
+).format
+
+_WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+_PERIOD_NAMES = {
+    1: "СЕГОДНЯ",
+    7: "ЗА НЕДЕЛЮ",
+    30: "ЗА МЕСЯЦ",
+}
+
+_HISTORY_HEADER = "📜 <b>История операций:</b>\n\n"
+_HISTORY_ENTRY = "{} <code>{}</code>\n   {}\n\n".format
+_HISTORY_FOOTER = "─────────────────\nПоказано последних {} записей".format
+HISTORY_EMPTY = (
+    "📜 <b>История операций</b>\n\n"
+    "История пуста.\n"
+    "Создай партию или возьми порцию!"
+)
+
+_HISTORY_EMOJI = {
+    "new_batch": "➕",
+    "take": "🍗",
+    "take_undone": "🚫",
+    "undo": "↩️",
+    "reset": "🗑",
+}
+
+
+# ─────────────────── ПОТРЕБНОСТИ ───────────────────
+# Что загрузить через Database.load() перед вызовом рендерера
+
+HISTORY_LIMIT = 15
+
+STATUS_NEEDS: Tuple[Need, ...] = (BATCH, FORECAST)
+HISTORY_NEEDS: Tuple[Need, ...] = (history(HISTORY_LIMIT),)
+
+
+def stats_needs(days: int) -> Tuple[Need, ...]:
+    """Период и предыдущий период такой же длины (для тренда) - одним окном"""
+    return BATCH, FORECAST, rollup(days), rollup(days * 2)
+
+
+# ─────────────────── КЭШ ───────────────────
+
+class RenderCache:
+    """Небольшой LRU-кэш готовых текстов (или кортежей с текстом)"""
+    
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение по ключу или None"""
+        text = self._data.get(key)
+        if text is not None:
+            self._data.move_to_end(key)
+        return text
+    
+    def put(self, key: Hashable, text: Any) -> Any:
+        """Сохранить значение и вернуть его"""
+        self._data[key] = text
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return text
+    
+    def clear(self):
+        self._data.clear()
+
+
+cache = RenderCache()
+
+
+# ─────────────────── СЕГМЕНТЫ ───────────────────
+
+@lru_cache(maxsize=64)
+def _bar(filled: int, length: int) -> str:
+    return "🟩" * filled + "⬜" * (length - filled)
+
+
+def progress_bar(current: float, total: float, length: int = 10) -> str:
+    """
+    Прогресс-бар из эмодзи (например "🟩🟩🟩🟩🟩⬜⬜⬜⬜⬜")
+    
+    Args:
+        current: текущее значение
+        total: максимальное значение
+        length: длина бара в символах
+    """
+    if total == 0:
+        return _bar(0, length)
+    return _bar(int(current / total * length), length)
+
+
+def status_emoji(percentage: float) -> str:
+    """Эмодзи остатка: 🟢 много, 🟡 средне, 🔴 мало"""
+    if percentage >= 0.7:
+        return "🟢"
+    if percentage >= 0.3:
+        return "🟡"
+    return "🔴"
+
+
+@lru_cache(maxsize=256)
+def _created_str(created: str) -> str:
+    try:
+        return datetime.fromisoformat(created).strftime("%d-%m-%y %H:%M")
+    except (TypeError, ValueError):
+        return created
+
+
+# ─────────────────── СТАТУС ───────────────────
+
+def render_status(
+    batch: BatchSnapshot,
+    timezone_offset: int = 0,
+    key: Optional[Hashable] = None,
+    forecast: Optional[str] = None
+) -> str:
+    """
+    Сообщение о статусе партии
+    
+    Args:
+        batch: данные партии из БД
+        timezone_offset: смещение часового пояса от UTC в часах
+        key: версии состояния (Database.versions); без ключа не кэшируется
+        forecast: строка прогноза (зависит от времени, поэтому не кэшируется)
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    cache_key = ("status", key) if key is not None else None
+    body = cache.get(cache_key) if cache_key else None
+    
+    if body is None:
+        body = _render_status_body(batch)
+        if cache_key:
+            cache.put(cache_key, body)
+    
+    if forecast:
+        body += _STATUS_FORECAST(forecast)
+    
+    # Время обновления меняется каждый раз, поэтому не входит в кэш
+    local_now = datetime.now() + timedelta(hours=timezone_offset)
+    return body + _STATUS_UPDATED(local_now.strftime("%d-%m %H:%M"))
+
+
+def _render_status_body(batch: BatchSnapshot) -> str:
+    raw_total = batch.raw_total
+    raw_left = batch.raw_left
+    coef = batch.coef
+    percentage = batch.percent_left
+    
+    text = _STATUS_TEMPLATE(
+        emoji=status_emoji(percentage),
+        percent=int(percentage * 100),
+        bar=progress_bar(raw_left, raw_total, length=10),
+        raw_left=int(raw_left),
+        raw_total=int(raw_total),
+        cooked_left=int(raw_left * coef),
+        cooked_total=int(batch.cooked_total),
+        coef=coef,
+        created=_created_str(batch.created),
+    )
+    
+    if batch.batches > 1:
+        text += _STATUS_BATCHES(batch.batches)
+    
+    if batch.note:
+        text += _STATUS_NOTE(batch.note)
+    
+    if percentage < 0.2:
+        text += _STATUS_CRITICAL
+    elif percentage < 0.4:
+        text += _STATUS_LOW
+    
+    return text
+
+
+# ─────────────────── СТАТИСТИКА ───────────────────
+
+def render_stats(
+    days: int,
+    stats: Optional[Mapping[str, Any]],
+    prev_stats: Optional[Mapping[str, Any]] = None,
+    raw_left: Optional[float] = None,
+    forecast: Optional[str] = None
+) -> str:
+    """
+    Сообщение со статистикой за период
+    
+    Args:
+        days: период в днях
+        stats: результат Statistics.get_period_stats(days)
+        prev_stats: то же за days * 2 (для тренда)
+        raw_left: остаток текущей партии, если она есть
+        forecast: строка прогноза для остатка
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    if not stats:
+        return _STATS_EMPTY(days)
+    
+    portions = stats["total_portions"]
+    emoji = "🔥" if portions > 10 else "✅" if portions > 5 else "📊"
+    
+    text = _STATS_TEMPLATE(
+        emoji=emoji,
+        period=_PERIOD_NAMES.get(days) or f"ЗА {days} ДНЕЙ",
+        total_taken=int(stats["total_taken"]),
+        avg_per_day=int(stats["avg_per_day"]),
+        total_portions=portions,
+        avg_portion=int(stats["avg_portion"]),
+    )
+    
+    if stats["batches_created"] > 0:
+        text += _STATS_BATCHES(stats["batches_created"])
+    
+    # Тренд относительно предыдущего периода такой же длины
+    if prev_stats and prev_stats["total_taken"] > 0:
+        prev_taken = prev_stats["total_taken"] - stats["total_taken"]
+        if prev_taken > 0:
+            change_pct = (stats["total_taken"] - prev_taken) / prev_taken * 100
+            if abs(change_pct) > 5:
+                if change_pct > 0:
+                    text += _STATS_TREND("📈", abs(int(change_pct)), "больше")
+                else:
+                    text += _STATS_TREND("📉", abs(int(change_pct)), "меньше")
+    
+    if raw_left is not None:
+        text += _STATS_LEFT(int(raw_left))
+        if forecast:
+            text += _STATS_FORECAST(forecast)
+    
+    return text
+
+
+def _column(value: float, top: float, length: int = 8) -> str:
+    """Полоска гистограммы, пропорциональная value / top"""
+    filled = int(round(value / top * length)) if top > 0 else 0
+    return "▇" * max(filled, 1 if value > 0 else 0)
+
+
+def render_extended_stats(report: Optional[WindowReport], days: int) -> str:
+    """
+    Подробная статистика: перцентили, гистограмма порций, дни недели
+    
+    Args:
+        report: Analytics.report(days) или None, если взятий нет
+        days: период в днях
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    if report is None:
+        return _EXTENDED_EMPTY(days)
+    
+    text = _EXTENDED_TEMPLATE(
+        period=_PERIOD_NAMES.get(days) or f"ЗА {days} ДНЕЙ",
+        total=int(report.total),
+        portions=report.portions,
+        avg_per_day=int(report.avg_per_day),
+        batches=report.batches,
+        batches_used=report.batches_used,
+    )
+    
+    if report.moving_avg:
+        text += _EXTENDED_MOVING(Analytics.MOVING_WINDOW, int(report.moving_avg[-1]))
+    
+    p = report.percentiles
+    if p:
+        text += _EXTENDED_PORTION(p25=int(p[25]), p50=int(p[50]), p75=int(p[75]), p90=int(p[90]))
+    
+    if report.histogram:
+        text += _EXTENDED_SECTION("Размеры порций:")
+        top = max(count for _, count in report.histogram)
+        step = Analytics.HISTOGRAM_STEP
+        for start, count in report.histogram:
+            text += _EXTENDED_ROW(f"{start}–{start + step - 1} г", _column(count, top), count)
+    
+    if any(report.weekdays):
+        text += _EXTENDED_SECTION("По дням недели, г/день:")
+        top = max(report.weekdays)
+        for name, grams in zip(_WEEKDAYS, report.weekdays):
+            text += _EXTENDED_ROW(name, _column(grams, top), int(grams))
+    
+    return text
+
+
+def render_stats_forecast(forecast: Optional[str]) -> str:
+    """Строка прогноза под статистикой (дописывается к render_stats без forecast)"""
+    return _STATS_FORECAST(forecast) if forecast else ""
+
+
+# ─────────────────── ПОЛЬЗОВАТЕЛИ ───────────────────
+
+def _user_name(user: UserTotals) -> str:
+    """Имя для HTML-сообщения: без разметки пользователя, id - если имя неизвестно"""
+    return html.escape(user.name) if user.name else f"id{user.user_id}"
+
+
+def render_leaderboard(leaders: Iterable[UserTotals], days: int, limit: int = 10) -> str:
+    """
+    Рейтинг пользователей за период
+    
+    Args:
+        leaders: Database.get_leaderboard(days) (по убыванию съеденного)
+        days: период в днях
+        limit: сколько мест показать
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    leaders = list(leaders)
+    if not leaders:
+        return _LEADERBOARD_EMPTY(days)
+    
+    text = _LEADERBOARD_HEADER(_PERIOD_NAMES.get(days) or f"ЗА {days} ДНЕЙ")
+    for place, user in enumerate(leaders[:limit], 1):
+        mark = _MEDALS[place - 1] if place <= len(_MEDALS) else f"{place}."
+        text += _LEADERBOARD_ROW(mark, _user_name(user), int(user.taken), user.portions)
+    return text + _LEADERBOARD_FOOTER(int(sum(u.taken for u in leaders)), len(leaders))
+
+
+def render_user_stats(
+    user_id: int,
+    leaders: Iterable[UserTotals],
+    month: Optional[UserTotals],
+    week_days: int = 7,
+    month_days: int = 30
+) -> str:
+    """
+    Личная статистика: неделя, месяц и место в рейтинге недели
+    
+    Args:
+        user_id: пользователь
+        leaders: Database.get_leaderboard(week_days) - весь рейтинг недели
+        month: Database.get_user_totals(user_id, month_days)
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    if month is None or not month.portions:
+        return _USER_EMPTY(month_days)
+    
+    leaders = list(leaders)
+    place = next((i for i, u in enumerate(leaders, 1) if u.user_id == user_id), None)
+    week = leaders[place - 1] if place else None
+    
+    text = _USER_TEMPLATE(
+        name=_user_name(month),
+        week_taken=int(week.taken) if week else 0,
+        week_portions=week.portions if week else 0,
+        month_taken=int(month.taken),
+        month_portions=month.portions,
+        avg_per_day=int(month.taken / month_days),
+    )
+    if week:
+        total = sum(u.taken for u in leaders)
+        share = int(round(week.taken / total * 100)) if total > 0 else 0
+        text += _USER_PLACE(place, len(leaders), share)
+    return text
+
+
+# ─────────────────── ИСТОРИЯ ───────────────────
+
+def render_history(records: Iterable[HistoryEntry]) -> str:
+    """
+    Список операций для экрана истории
+    
+    Args:
+        records: записи истории (новые первыми)
+    
+    Returns:
+        str: отформатированное сообщение
+    """
+    entries = [
+        _HISTORY_ENTRY(_HISTORY_EMOJI.get(r.action_type, "•"), r.created, r.text)
+        for r in records
+    ]
+    if not entries:
+        return HISTORY_EMPTY
+    return _HISTORY_HEADER + "".join(entries) + _HISTORY_FOOTER(len(entries))
@@ -1,7 +1,19 @@
 """
 Валидаторы данных
 """
-from typing import Optional, Tuple
+import math
+from array import array
+from enum import IntEnum
+from typing import Iterable, Optional, Tuple
+
+
+class WeightError(IntEnum):
+    """Коды ошибок валидации веса (для пакетной проверки)"""
+    OK = 0
+    UNPARSED = 1
+    NOT_POSITIVE = 2
+    TOO_SMALL = 3
+    TOO_LARGE = 4
 
 
 class WeightValidator:
@@ -11,30 +23,101 @@ class WeightValidator:
         self.min_weight = min_weight
         self.max_weight = max_weight
     
-    def validate(self, weight: Optional[float]) -> Tuple[bool, Optional[str]]:
+    @classmethod
+    def from_config(cls, config) -> 'WeightValidator':
+        """Общий валидатор с лимитами из конфигурации (создаётся один раз при старте)"""
+        return cls(config.min_weight, config.max_weight)
+    
+    def check(self, weight: Optional[float]) -> WeightError:
         """
-        Валидация веса
+        Проверка веса без формирования сообщения
         
         Args:
-            weight: вес в граммах
-            
+            weight: вес в граммах (None или NaN - не распознан)
+        
         Returns:
-            Tuple[bool, Optional[str]]: (валидно, сообщение об ошибке)
+            WeightError: код результата
         """
-        if weight is None:
-            return False, "Не удалось распознать вес. Попробуй: 1500 или 1.5 кг"
+        if weight is None or weight != weight:
+            return WeightError.UNPARSED
         
         if weight <= 0:
-            return False, "Вес должен быть больше нуля"
+            return WeightError.NOT_POSITIVE
         
         if weight < self.min_weight:
-            return False, f"Слишком мало (минимум {int(self.min_weight)} г)"
+            return WeightError.TOO_SMALL
         
         if weight > self.max_weight:
+            return WeightError.TOO_LARGE
+        
+        return WeightError.OK
+    
+    def error_message(self, code: WeightError) -> Optional[str]:
+        """
+        Сообщение об ошибке для кода
+        
+        Args:
+            code: код из check() или validate_many()
+        
+        Returns:
+            Optional[str]: текст ошибки или None если ошибки нет
+        """
+        if code == WeightError.UNPARSED:
+            return "Не удалось распознать вес. Попробуй: 1500 или 1.5 кг"
+        
+        if code == WeightError.NOT_POSITIVE:
+            return "Вес должен быть больше нуля"
+        
+        if code == WeightError.TOO_SMALL:
+            return f"Слишком мало (минимум {int(self.min_weight)} г)"
+        
+        if code == WeightError.TOO_LARGE:
             kg = self.max_weight / 1000
-            return False, f"Слишком много (максимум {kg:.0f} кг)"
+            return f"Слишком много (максимум {kg:.0f} кг)"
         
-        return True, None
+        return None
+    
+    def validate(self, weight: Optional[float]) -> Tuple[bool, Optional[str]]:
+        """
+        Валидация веса
+        
+        Args:
+            weight: вес в граммах
+        
+        Returns:
+            Tuple[bool, Optional[str]]: (валидно, сообщение об ошибке)
+        """
+        code = self.check(weight)
+        return code == WeightError.OK, self.error_message(code)
+    
+    def validate_many(self, weights: Iterable[float]) -> array:
+        """
+        Пакетная валидация (например, результата WeightParser.parse_many)
+        
+        Args:
+            weights: веса в граммах, None или NaN - не распознан
+        
+        Returns:
+            array('b'): код WeightError по каждому значению
+        """
+        result = array("b")
+        append = result.append
+        min_weight, max_weight = self.min_weight, self.max_weight
+        isnan = math.isnan
+        
+        for weight in weights:
+            if weight is None or isnan(weight):
+                append(WeightError.UNPARSED)
+            elif weight <= 0:
+                append(WeightError.NOT_POSITIVE)
+            elif weight < min_weight:
+                append(WeightError.TOO_SMALL)
+            elif weight > max_weight:
+                append(WeightError.TOO_LARGE)
+            else:
+                append(WeightError.OK)
+        
+        return result
     
     def validate_coef(self, raw: float, cooked: float) -> Tuple[bool, Optional[str]]:
         """
@@ -43,7 +126,7 @@ class WeightValidator:
         Args:
             raw: вес сырой
             cooked: вес готовой
-            
+        
         Returns:
             Tuple[bool, Optional[str]]: (валидно, сообщение об ошибке)
         """
@@ -73,7 +156,7 @@ class PortionValidator:
         Args:
             requested: запрошенное количество
             available: доступное количество
-            
+        
         Returns:
             Tuple[bool, Optional[str]]: (валидно, сообщение об ошибке)
         """